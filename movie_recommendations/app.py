@@ -1,7 +1,11 @@
 import streamlit as st
 from st_pages import add_page_title, get_nav_from_toml
+from functions.helper_functions.query_metrics import start_metrics_server
 
 
+# serves /metrics for Prometheus when QUERY_METRICS_PORT is set, once per process
+start_metrics_server()
+
 nav = get_nav_from_toml(".streamlit/pages_sections.toml")
 pg = st.navigation(nav)
 
@@ -0,0 +1,174 @@
+"""
+IVF benchmark: recall@k and queries per second of the IVF index against the exact cosine scan, per nprobe,
+and the memory and recall of each quantization with and without the exact rerank
+Run from the movie_recommendations directory:
+    python -m benchmarks.ann --synthetic 50000 [--dim 256] [--nprobe 1 2 4 8 16 32] [--json results.json]
+    python -m benchmarks.ann --embedding plot [--same-genre] [--quantization float32 int8 pq] [--rerank 4]
+"""
+
+import json
+import time
+import argparse
+import numpy as np
+from functions.embedding_index import EmbeddingIndex, load_embedding_index
+from functions.embedding_store import EmbeddingStore
+from functions.ann_index import IVFIndex, build_ann_index
+
+
+def synthetic_catalogue(count, dim, genres=20, clusters=100, seed=0):
+    """
+    Clustered unit vectors with 1-3 random genres and a release year per movie, the embeddings of
+    real catalogues are clustered too, uniformly random vectors would understate IVF recall
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)]
+    vectors += 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    ids = [f"movie-{i}" for i in range(count)]
+    row_genres = [
+        [f"genre-{g}" for g in rng.choice(genres, rng.integers(1, 4), replace=False)]
+        for _ in range(count)
+    ]
+    years = rng.integers(1920, 2025, size=count).tolist()
+    return ids, vectors, row_genres, years
+
+
+def exact_top_k(index, id, k, same_genre):
+    if same_genre:
+        return [target_id for target_id, _ in index.top_k_same_genre(id, k)]
+    row = index.row_of[id]
+    scores = index.cosine_scores(index.unit_vectors([row]))[0]
+    scores[row] = -np.inf
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [index.ids[i] for i in top]
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    results = [function(id) for id in queries]
+    elapsed = time.perf_counter() - start
+    return results, len(queries) / elapsed if elapsed else float("inf")
+
+
+def recall(approximate, exact):
+    hits = [
+        len(set(found) & set(expected)) / len(expected)
+        for found, expected in zip(approximate, exact)
+        if expected
+    ]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="IVF recall@k and QPS against exact cosine"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", type=int, help="number of synthetic movies")
+    source.add_argument("--embedding", choices=["plot", "poster"])
+    parser.add_argument("--dim", type=int, default=256, help="synthetic dimensions")
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--same-genre", action="store_true")
+    parser.add_argument(
+        "--quantization",
+        nargs="+",
+        default=["float32", "float16", "int8", "pq"],
+        help="any of float32 float16 int8 pq",
+    )
+    parser.add_argument("--pq-subspaces", type=int)
+    parser.add_argument(
+        "--rerank", type=int, default=4, help="candidates re-scored per result"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.synthetic:
+        ids, vectors, row_genres, years = synthetic_catalogue(
+            args.synthetic, args.dim, seed=args.seed
+        )
+        exact = EmbeddingIndex(ids, vectors, row_genres)
+        ivf = IVFIndex.build(
+            ids, vectors, row_genres, years, args.nlist, seed=args.seed
+        )
+        # the rerank reads the exact vectors the way it reads an exported store
+        ivf.attach_store(
+            EmbeddingStore(
+                "synthetic", vectors, np.linalg.norm(vectors, axis=1), ids, ids
+            )
+        )
+    else:
+        exact = load_embedding_index(args.embedding)
+        ivf = build_ann_index(
+            args.embedding, args.nlist, seed=args.seed, quantization="float32"
+        )
+    build_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed)
+    queries = [
+        exact.ids[i]
+        for i in rng.choice(len(exact), min(args.queries, len(exact)), replace=False)
+    ]
+    expected, exact_qps = timed(
+        lambda id: exact_top_k(exact, id, args.k, args.same_genre), queries
+    )
+    results = {
+        "movies": len(exact),
+        "nlist": ivf.nlist,
+        "k": args.k,
+        "same_genre": args.same_genre,
+        "build_s": build_s,
+        "exact_qps": exact_qps,
+        "exact_bytes": len(exact) * ivf.codes.shape[1] * 4,
+        "ivf": [],
+    }
+    print(f"{len(exact)} movies, {ivf.nlist} lists, built in {build_s:.1f} s")
+    print(f"{'exact':>10}: {exact_qps:10.1f} qps")
+    for quantization in args.quantization:
+        index = (
+            ivf
+            if quantization == "float32"
+            else ivf.quantized(quantization, args.pq_subspaces)
+        )
+        memory = index.memory_bytes()
+        print(
+            f"{quantization}: {memory / 2**20:.1f} MiB, {memory / len(index):.0f} bytes per movie"
+        )
+        reranks = [0] if quantization == "float32" else [0, args.rerank]
+        for rerank in dict.fromkeys(reranks):
+            for nprobe in args.nprobe:
+                found, qps = timed(
+                    lambda id: [
+                        target_id
+                        for target_id, _ in index.search_similar(
+                            id, args.k, nprobe, args.same_genre, rerank=rerank
+                        )
+                    ],
+                    queries,
+                )
+                score = recall(found, expected)
+                results["ivf"].append(
+                    {
+                        "quantization": quantization,
+                        "memory_bytes": memory,
+                        "rerank": rerank,
+                        "nprobe": nprobe,
+                        "recall": score,
+                        "qps": qps,
+                    }
+                )
+                print(
+                    f"  rerank {rerank} nprobe {nprobe:>3}: {qps:10.1f} qps  recall@{args.k} {score:.3f}"
+                )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Recommender benchmark: latency distribution, throughput under concurrent clients and peak memory of the
+recommender and catalogue queries, against synthetic catalogues of several sizes or the offline dataset
+Each scale runs in a fresh interpreter on the local backend, so indexes and caches start empty.
+Run from the movie_recommendations directory:
+    python -m benchmarks.recommenders --scales 1000 10000 100000 [--clients 8] [--json results.json]
+    python -m benchmarks.recommenders --dataset offline [--baseline previous.json] [--threshold 0.2]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+RESULT_PREFIX = "RECOMMENDERS_RESULT "
+
+BENCHMARKS = [
+    "list_all_movies",
+    "search_movies_based_genres",
+    "plot_embedding_similarity_genre",
+    "movie_user_recommendations_singular",
+]
+
+# settings that change what is measured, copied into the results so runs can be compared
+RECORDED_SETTINGS = [
+    "RECSYS_BACKEND",
+    "PLOT_SIMILARITY_ENGINE",
+    "CO_RATING_ENGINE",
+    "ANN_NPROBE",
+    "ANN_QUANTIZATION",
+    "QUERY_CACHE_TTL_SECONDS",
+]
+
+
+def write_synthetic_graph(
+    directory,
+    movies,
+    users,
+    ratings_per_user=20,
+    genres=20,
+    plot_dim=1536,
+    poster_dim=512,
+    seed=0,
+):
+    """
+    Writes everything the local backend reads into directory: catalogue.json, ratings.npz and the
+    plot / poster embedding stores, shaped like the exports of functions.local_graph
+    Popularity is skewed the way real ratings are, so the co-rating recommender finds neighbours
+    """
+    from benchmarks.ann import synthetic_catalogue
+    from functions.rating_matrix import RatingMatrix
+    from functions.embedding_store import store_paths
+    import scipy.sparse as sp
+
+    rng = np.random.default_rng(seed)
+    _, plot_vectors, row_genres, years = synthetic_catalogue(
+        movies, plot_dim, genres, seed=seed
+    )
+    ids = [f"movie:{i}" for i in range(movies)]
+    # Zipf-like popularity by a random rank, imdbVotes follow it
+    popularity = 1 / (rng.permutation(movies) + 10.0) ** 0.8
+    popularity /= popularity.sum()
+    votes = np.rint(popularity * movies * 10**4).astype(np.int64)
+
+    catalogue = {
+        "genres": [
+            {"id": f"genre-{g}", "neo4j_id": g, "properties": {"name": f"Genre {g}"}}
+            for g in range(genres)
+        ],
+        "movies": [
+            {
+                "id": id,
+                "neo4j_id": genres + i,
+                "properties": {
+                    "title": f"Movie {i}",
+                    "released": f"{years[i]}-01-01",
+                    "year": years[i],
+                    "imdbVotes": int(votes[i]),
+                    "imdbRating": round(float(rng.uniform(1, 10)), 1),
+                    "plot": f"Plot of movie {i}",
+                    "poster": f"https://example.com/posters/{i}.jpg",
+                    "movieId": str(i),
+                    "budget": int(rng.integers(10**5, 10**8)),
+                },
+                "genres": row_genres[i],
+            }
+            for i, id in enumerate(ids)
+        ],
+    }
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "catalogue.json"), "w") as f:
+        json.dump(catalogue, f)
+
+    rows = np.repeat(np.arange(users), ratings_per_user)
+    cols = rng.choice(movies, size=len(rows), p=popularity)
+    # one rating per user and movie, the duplicates drawn above are dropped
+    pairs = np.unique(rows.astype(np.int64) * movies + cols)
+    rows, cols = pairs // movies, pairs % movies
+    ratings = rng.choice(
+        np.arange(1, 11, dtype=np.float32) / 2,
+        size=len(pairs),
+        p=[0.02, 0.03, 0.03, 0.05, 0.07, 0.1, 0.15, 0.2, 0.15, 0.2],
+    )
+    matrix = sp.csr_matrix((ratings, (rows, cols)), shape=(users, movies))
+    RatingMatrix(
+        [str(user) for user in range(users)], ids, matrix, votes.astype(float), 0
+    ).save(os.path.join(directory, "ratings.npz"))
+
+    _, poster_vectors, _, _ = synthetic_catalogue(
+        movies, poster_dim, genres, seed=seed + 1
+    )
+    for name, vectors in [("plot", plot_vectors), ("poster", poster_vectors)]:
+        paths = store_paths(name, directory)
+        np.save(paths["vectors"], vectors)
+        np.save(paths["norms"], np.linalg.norm(vectors, axis=1))
+        with open(paths["ids"], "w") as f:
+            json.dump(
+                {
+                    "ids": ids,
+                    "keys": [str(i) for i in range(movies)],
+                    "key_property": "movieId",
+                    "genres": row_genres,
+                },
+                f,
+            )
+
+
+def summarize_latencies(latencies):
+    latencies = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(latencies.mean()),
+        "min_ms": float(latencies.min()),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def timed_call(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def benchmark_calls(calls, iterations, clients, memory_calls):
+    """
+    calls: functions taking no argument, cycled through
+    The first call is timed on its own since it builds the indexes, then iterations sequential calls
+    give the latency distribution, clients threads making iterations calls each give the throughput,
+    and memory_calls more calls under tracemalloc give the peak Python allocation of one call
+    """
+    first_call_ms = timed_call(calls[0]) * 1000
+    latencies = [timed_call(calls[i % len(calls)]) for i in range(iterations)]
+
+    def client(offset):
+        return [timed_call(calls[(offset + i) % len(calls)]) for i in range(iterations)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        loaded = [
+            latency
+            for latencies_of_client in pool.map(client, range(clients))
+            for latency in latencies_of_client
+        ]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peak = 0
+    for i in range(memory_calls):
+        tracemalloc.reset_peak()
+        calls[i % len(calls)]()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    return {
+        "first_call_ms": first_call_ms,
+        "latency": summarize_latencies(latencies),
+        "throughput": {
+            "clients": clients,
+            "requests": len(loaded),
+            "requests_per_s": len(loaded) / elapsed if elapsed else float("inf"),
+            **summarize_latencies(loaded),
+        },
+        "peak_alloc_bytes": peak,
+        # the process high-water mark so far, includes the indexes built by the first call
+        "max_rss_bytes": max_rss_bytes(),
+    }
+
+
+def run_worker(config):
+    """
+    Runs every benchmark in this interpreter, against whatever backend the environment selects
+    """
+    import functions.general as general
+    import functions.content_filtering_methods as content_filtering
+    import functions.collaborative_filtering_methods as collaborative_filtering
+
+    rng = np.random.default_rng(config["seed"])
+    movies = [row["MovieID"] for row in general.list_all_movies()]
+    genres = [row["Genre"]["name"] for row in general.list_all_genres()]
+    sample = [
+        movies[i]
+        for i in rng.choice(len(movies), min(config["sample"], len(movies)), False)
+    ]
+    genre_sets = [
+        sorted(rng.choice(genres, min(2, len(genres)), replace=False).tolist())
+        for _ in range(config["sample"])
+    ]
+    k = config["k"]
+    calls = {
+        "list_all_movies": [general.list_all_movies],
+        "search_movies_based_genres": [
+            lambda selected=selected: general.search_movies_based_genres(selected)
+            for selected in genre_sets
+        ],
+        "plot_embedding_similarity_genre": [
+            lambda id=id: content_filtering.plot_embedding_similarity_genre(id, k)
+            for id in sample
+        ],
+        "movie_user_recommendations_singular": [
+            lambda id=id: collaborative_filtering.movie_user_recommendations_singular(
+                id, 5.0, k
+            )
+            for id in sample
+        ],
+    }
+    results = {}
+    for name in config["benchmarks"]:
+        results[name] = benchmark_calls(
+            calls[name], config["iterations"], config["clients"], config["memory_calls"]
+        )
+    return {"movies": len(movies), "genres": len(genres), "results": results}
+
+
+def run_scale(config, env):
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.recommenders",
+            "--worker",
+            json.dumps(config),
+        ],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :])
+    raise RuntimeError(f"Benchmark worker failed:\n{completed.stderr}")
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions against a previous results file: p95 latency up or throughput down by more than threshold
+    """
+    previous = {scale["scale"]: scale["results"] for scale in baseline["scales"]}
+    regressions = []
+    for scale in results["scales"]:
+        for name, current in scale["results"].items():
+            before = previous.get(scale["scale"], {}).get(name)
+            if before is None:
+                continue
+            checks = [
+                ("p95_ms", before["latency"]["p95_ms"], current["latency"]["p95_ms"]),
+                (
+                    "requests_per_s",
+                    -before["throughput"]["requests_per_s"],
+                    -current["throughput"]["requests_per_s"],
+                ),
+            ]
+            for metric, old, new in checks:
+                if old and (new - old) / abs(old) > threshold:
+                    regressions.append(
+                        {
+                            "scale": scale["scale"],
+                            "benchmark": name,
+                            "metric": metric,
+                            "baseline": abs(old),
+                            "current": abs(new),
+                        }
+                    )
+    return regressions
+
+
+def print_scale(scale):
+    print(f"{scale['scale']}: {scale['movies']} movies, {scale['genres']} genres")
+    for name, result in scale["results"].items():
+        latency, throughput = result["latency"], result["throughput"]
+        print(
+            f"  {name:>36}: first {result['first_call_ms']:8.1f} ms"
+            f"  p50 {latency['p50_ms']:8.2f}  p95 {latency['p95_ms']:8.2f}  p99 {latency['p99_ms']:8.2f} ms"
+            f"  {throughput['requests_per_s']:8.1f} req/s x{throughput['clients']}"
+            f"  peak {result['peak_alloc_bytes'] / 2**20:7.1f} MiB"
+            f"  rss {result['max_rss_bytes'] / 2**20:7.1f} MiB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Latency, throughput and memory of the recommender queries"
+    )
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--dataset",
+        choices=["synthetic", "offline"],
+        default="synthetic",
+        help="offline benchmarks the backend of the current environment instead",
+    )
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=[1000, 10000], help="synthetic movies"
+    )
+    parser.add_argument(
+        "--users-per-movie", type=float, default=1.0, help="synthetic users per movie"
+    )
+    parser.add_argument("--ratings-per-user", type=int, default=20)
+    parser.add_argument("--plot-dim", type=int, default=1536)
+    parser.add_argument("--poster-dim", type=int, default=512)
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--memory-calls", type=int, default=5)
+    parser.add_argument("--sample", type=int, default=50, help="movies queried")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="keep the query cache on, by default every call reaches the backend",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed relative regression"
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        print(RESULT_PREFIX + json.dumps(run_worker(json.loads(args.worker))))
+        return
+
+    config = {
+        "benchmarks": args.benchmarks,
+        "iterations": args.iterations,
+        "clients": args.clients,
+        "memory_calls": args.memory_calls,
+        "sample": args.sample,
+        "k": args.k,
+        "seed": args.seed,
+    }
+    env = dict(os.environ)
+    if not args.cache:
+        env["QUERY_CACHE_TTL_SECONDS"] = "1e-9"
+
+    scales = []
+    if args.dataset == "offline":
+        scale = {"scale": "offline", **run_scale(config, env)}
+        print_scale(scale)
+        scales.append(scale)
+    else:
+        for movies in args.scales:
+            with tempfile.TemporaryDirectory() as directory:
+                users = max(1, int(movies * args.users_per_movie))
+                write_synthetic_graph(
+                    directory,
+                    movies,
+                    users,
+                    args.ratings_per_user,
+                    plot_dim=args.plot_dim,
+                    poster_dim=args.poster_dim,
+                    seed=args.seed,
+                )
+                # indexes are built in memory from the synthetic data, never read from the real exports
+                scale_env = {
+                    **env,
+                    "RECSYS_BACKEND": "local",
+                    "LOCAL_GRAPH_DIR": directory,
+                    "RATING_MATRIX_PATH": os.path.join(directory, "ratings.npz"),
+                    "EMBEDDING_STORE_DIR": directory,
+                    "CO_RATING_INDEX_PATH": os.path.join(directory, "co_rating.npz"),
+                    "ANN_INDEX_DIR": directory,
+                }
+                scale = {
+                    "scale": str(movies),
+                    "users": users,
+                    **run_scale(config, scale_env),
+                }
+            print_scale(scale)
+            scales.append(scale)
+
+    results = {
+        "dataset": args.dataset,
+        "config": config,
+        "settings": {
+            name: (scale_env if args.dataset == "synthetic" else env).get(name)
+            for name in RECORDED_SETTINGS
+        },
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scales": scales,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['scale']} {regression['benchmark']} {regression['metric']}: "
+                f"{regression['baseline']:.2f} -> {regression['current']:.2f}"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.threshold:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Cold start benchmark: times importing the query modules and the first query, each run in a fresh interpreter
+Run from the movie_recommendations directory:
+    python -m benchmarks.startup --runs 10 [--json results.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+RESULT_PREFIX = "STARTUP_RESULT "
+
+# runs inside a fresh interpreter, so module caches, the driver and the log handlers start empty
+PROBE = f"""
+import json, time, logging
+start = time.perf_counter()
+import functions.general
+import functions.content_filtering_methods
+import functions.collaborative_filtering_methods
+imported = time.perf_counter()
+error = None
+try:
+    functions.general.list_all_genres()
+except Exception as e:
+    error = repr(e)
+first_query = time.perf_counter()
+# distinct handler objects, each one is an open stream or log file
+handlers = len({{
+    id(handler)
+    for logger in logging.Logger.manager.loggerDict.values()
+    if isinstance(logger, logging.Logger)
+    for handler in logger.handlers
+}})
+print({RESULT_PREFIX!r} + json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_query_ms": (first_query - imported) * 1000,
+    "log_handlers": handlers,
+    "error": error,
+}}))
+"""
+
+
+def run_probe():
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "0"},
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :])
+    raise RuntimeError(f"Probe failed:\n{completed.stderr}")
+
+
+def summarize(values):
+    return {
+        "median": statistics.median(values),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold import and first query latency")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # the first run warms the OS file cache and writes the .pyc files, it is not counted
+    run_probe()
+    runs = [run_probe() for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "backend": os.getenv("RECSYS_BACKEND", "neo4j"),
+        "import_ms": summarize([run["import_ms"] for run in runs]),
+        "first_query_ms": summarize([run["first_query_ms"] for run in runs]),
+        "log_handlers": runs[-1]["log_handlers"],
+        "error": runs[-1]["error"],
+    }
+    for metric in ["import_ms", "first_query_ms"]:
+        summary = results[metric]
+        print(
+            f"{metric:>15}: median {summary['median']:8.1f}  min {summary['min']:8.1f}  max {summary['max']:8.1f}"
+        )
+    print(f"{'log_handlers':>15}: {results['log_handlers']}")
+    if results["error"]:
+        print(f"{'first query':>15}: {results['error']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
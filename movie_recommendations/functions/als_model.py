@@ -0,0 +1,348 @@
+from functions.connections import RECSYS_BACKEND
+from functions.rating_matrix import load_rating_matrix, get_rating_matrix
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.logging_config import get_logger
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+logger = get_logger(__name__, "RATING_MATRIX_LOG_FILE_PATH")
+
+ALS_MODEL_PATH = os.getenv("ALS_MODEL_PATH", "data/als_model.npz")
+ALS_FACTORS = int(os.getenv("ALS_FACTORS", "64"))
+ALS_ITERATIONS = int(os.getenv("ALS_ITERATIONS", "15"))
+ALS_REGULARIZATION = float(os.getenv("ALS_REGULARIZATION", "0.1"))
+# how much more a rating far from NEUTRAL_RATING counts than an unrated movie
+ALS_ALPHA = float(os.getenv("ALS_ALPHA", "2.0"))
+ALS_THREADS = int(os.getenv("ALS_THREADS", str(os.cpu_count() or 1)))
+# ratings at or above LIKED_RATING are positive feedback, the others negative,
+# with a confidence growing with the distance to NEUTRAL_RATING, so 3.0 says as little as no rating
+LIKED_RATING = 3.5
+NEUTRAL_RATING = 3.0
+
+
+def implicit_feedback(ratings, alpha=ALS_ALPHA):
+    """
+    (preference, confidence) arrays aligned with the data of a CSR rating matrix
+    """
+    preference = (ratings >= LIKED_RATING).astype(np.float32)
+    confidence = 1 + alpha * np.abs(ratings - NEUTRAL_RATING).astype(np.float32)
+    return preference, confidence
+
+
+def has_liked_seed(seeds):
+    """
+    Whether any of the (movie_id, rating) seeds is positive feedback for the model
+    """
+    return any(rating >= LIKED_RATING for _, rating in seeds)
+
+
+def _solve_rows(rows, feedback, fixed, gram, regularization, alpha, out):
+    """
+    Solves the implicit ALS normal equations of the given rows of feedback against the fixed factors:
+    (Y^T Y + Y^T (C - I) Y + regularization * I) x = Y^T C p, one batched solve for the whole block
+    """
+    factors = fixed.shape[1]
+    lhs = np.repeat(gram[None], len(rows), axis=0)
+    rhs = np.zeros((len(rows), factors), dtype=np.float32)
+    for i, row in enumerate(rows):
+        start, end = feedback.indptr[row], feedback.indptr[row + 1]
+        if start == end:
+            continue
+        rated = fixed[feedback.indices[start:end]]
+        preference, confidence = implicit_feedback(feedback.data[start:end], alpha)
+        lhs[i] += (rated.T * (confidence - 1)) @ rated
+        rhs[i] = rated.T @ (confidence * preference)
+    lhs += regularization * np.eye(factors, dtype=np.float32)
+    out[rows] = np.linalg.solve(lhs, rhs[..., None])[..., 0]
+
+
+def _half_step(feedback, fixed, target, regularization, alpha, pool, block_size=256):
+    # YtY is shared by every row, only the rated items add their (c - 1) y y^T terms
+    gram = fixed.T @ fixed
+    blocks = [
+        np.arange(start, min(start + block_size, feedback.shape[0]))
+        for start in range(0, feedback.shape[0], block_size)
+    ]
+    # numpy releases the GIL in the products and in the LAPACK solve, the blocks run in parallel
+    list(
+        pool.map(
+            lambda rows: _solve_rows(
+                rows, feedback, fixed, gram, regularization, alpha, target
+            ),
+            blocks,
+        )
+    )
+
+
+class ALSModel:
+    """
+    Implicit-feedback matrix factorization of the user x movie rating matrix, trained with
+    alternating least squares. A user's score for a movie is the dot product of their factors.
+    seen keeps which movies every training user rated, so they are masked out of that user's results.
+    """
+
+    def __init__(
+        self,
+        user_ids,
+        movie_ids,
+        user_factors,
+        item_factors,
+        seen,
+        imdb_votes,
+        watermark,
+        regularization=ALS_REGULARIZATION,
+        alpha=ALS_ALPHA,
+    ):
+        self.user_ids = list(user_ids)
+        self.movie_ids = list(movie_ids)
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        self.item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        self.seen = sp.csr_matrix(seen, dtype=np.bool_)
+        self.imdb_votes = np.nan_to_num(
+            np.asarray(imdb_votes, dtype=np.float64), nan=0.0
+        )
+        self.watermark = watermark
+        self.regularization = regularization
+        self.alpha = alpha
+        self.gram = self.item_factors.T @ self.item_factors
+        norms = np.linalg.norm(self.item_factors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.unit_item_factors = self.item_factors / norms
+
+    @classmethod
+    def train(
+        cls,
+        ratings,
+        factors=ALS_FACTORS,
+        iterations=ALS_ITERATIONS,
+        regularization=ALS_REGULARIZATION,
+        alpha=ALS_ALPHA,
+        threads=ALS_THREADS,
+        seed=0,
+    ):
+        """
+        ratings: a RatingMatrix
+        """
+        by_user = ratings.matrix.tocsr()
+        by_movie = by_user.T.tocsr()
+        rng = np.random.default_rng(seed)
+        user_factors = (
+            rng.standard_normal((by_user.shape[0], factors)).astype(np.float32) * 0.01
+        )
+        item_factors = (
+            rng.standard_normal((by_user.shape[1], factors)).astype(np.float32) * 0.01
+        )
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="als") as pool:
+            for iteration in range(iterations):
+                start = time.perf_counter()
+                _half_step(
+                    by_user,
+                    item_factors,
+                    user_factors,
+                    regularization,
+                    alpha,
+                    pool,
+                )
+                _half_step(
+                    by_movie,
+                    user_factors,
+                    item_factors,
+                    regularization,
+                    alpha,
+                    pool,
+                )
+                logger.info(
+                    f"ALS iteration {iteration + 1}/{iterations} took {time.perf_counter() - start:.2f} s"
+                )
+        return cls(
+            ratings.user_ids,
+            ratings.movie_ids,
+            user_factors,
+            item_factors,
+            by_user,
+            ratings.imdb_votes,
+            ratings.watermark,
+            regularization,
+            alpha,
+        )
+
+    def _top_k(self, scores, k, exclude):
+        scores = scores.astype(np.float64)
+        scores[exclude] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        # best score first, imdbVotes breaks ties
+        top = top[np.lexsort((-self.imdb_votes[top], -scores[top]))]
+        return [(self.movie_ids[col], float(scores[col])) for col in top]
+
+    def recommend_for_user(self, user_id, k=5):
+        """
+        Top k movies for a training user, the movies they rated are left out
+        Returns [(movie_id, score), ...], [] for an unknown user
+        """
+        row = self.user_index.get(user_id)
+        if row is None:
+            return []
+        seen = self.seen.indices[self.seen.indptr[row] : self.seen.indptr[row + 1]]
+        return self._top_k(self.item_factors @ self.user_factors[row], k, seen)
+
+    def fold_in(self, seeds):
+        """
+        Factors of a user who is not in the model, from [(movie_id, rating), ...]
+        One ALS step against the fixed item factors, the model is not retrained
+        """
+        cols = [self.movie_index[movie_id] for movie_id, _ in seeds]
+        rated = self.item_factors[cols]
+        preference, confidence = implicit_feedback(
+            np.asarray([rating for _, rating in seeds], dtype=np.float32), self.alpha
+        )
+        lhs = (
+            self.gram
+            + (rated.T * (confidence - 1)) @ rated
+            + self.regularization * np.eye(rated.shape[1], dtype=np.float32)
+        )
+        return np.linalg.solve(lhs, rated.T @ (confidence * preference))
+
+    def recommend(self, seeds, k=5):
+        """
+        Top k movies for a new user's (movie_id, rating) seeds, folded in without retraining
+        Movies missing from the model are ignored, the seeds themselves are left out
+        Without a seed rated LIKED_RATING or above the fold-in solves to the zero vector and every movie ties,
+        so nothing is returned then
+        Returns [(movie_id, score), ...]
+        """
+        seeds = [
+            (movie_id, rating)
+            for movie_id, rating in seeds
+            if movie_id in self.movie_index
+        ]
+        if not has_liked_seed(seeds):
+            return []
+        factors = self.fold_in(seeds)
+        seen = [self.movie_index[movie_id] for movie_id, _ in seeds]
+        return self._top_k(self.item_factors @ factors, k, seen)
+
+    def similar_movies(self, movie_id, k=5):
+        """
+        Top k movies by cosine similarity of the item factors
+        Returns [(movie_id, similarity), ...]
+        """
+        col = self.movie_index.get(movie_id)
+        if col is None:
+            return []
+        return self._top_k(
+            self.unit_item_factors @ self.unit_item_factors[col], k, [col]
+        )
+
+    def save(self, path=ALS_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            user_factors=self.user_factors,
+            item_factors=self.item_factors,
+            seen_indices=self.seen.indices.astype(np.int32),
+            seen_indptr=self.seen.indptr.astype(np.int64),
+            user_ids=np.asarray(self.user_ids),
+            movie_ids=np.asarray(self.movie_ids),
+            imdb_votes=self.imdb_votes,
+            watermark=np.asarray(self.watermark),
+            regularization=np.asarray(self.regularization),
+            alpha=np.asarray(self.alpha),
+        )
+        logger.info(f"ALS model saved to {path}")
+
+    @classmethod
+    def load(cls, path=ALS_MODEL_PATH):
+        with np.load(path) as saved:
+            indices = saved["seen_indices"]
+            seen = sp.csr_matrix(
+                (np.ones(len(indices), dtype=np.bool_), indices, saved["seen_indptr"]),
+                shape=(len(saved["user_ids"]), len(saved["movie_ids"])),
+            )
+            return cls(
+                saved["user_ids"].tolist(),
+                saved["movie_ids"].tolist(),
+                saved["user_factors"],
+                saved["item_factors"],
+                seen,
+                saved["imdb_votes"],
+                saved["watermark"].item(),
+                saved["regularization"].item(),
+                saved["alpha"].item(),
+            )
+
+
+_als_model = None
+_als_model_lock = threading.Lock()
+
+
+def get_als_model(path=ALS_MODEL_PATH):
+    """
+    Returns the process-wide ALS model, loading it from disk on first use
+    Returns None if the model has not been trained yet, except on the local backend,
+    which trains it in memory from the exported rating matrix
+    """
+    global _als_model
+    with _als_model_lock:
+        if _als_model is None:
+            if os.path.exists(path):
+                _als_model = ALSModel.load(path)
+                logger.info(f"ALS model loaded from {path}")
+            elif RECSYS_BACKEND == "local":
+                _als_model = ALSModel.train(get_rating_matrix())
+                logger.info("ALS model trained from the local rating matrix")
+        return _als_model
+
+
+def reset_als_model():
+    global _als_model
+    with _als_model_lock:
+        _als_model = None
+
+
+# the next query reloads the saved model, or retrains it on the local backend
+QUERY_CACHE.add_invalidation_listener(reset_als_model)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train the ALS matrix factorization on the RATED edges"
+    )
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--factors", type=int, default=ALS_FACTORS)
+    parser.add_argument("--iterations", type=int, default=ALS_ITERATIONS)
+    parser.add_argument("--regularization", type=float, default=ALS_REGULARIZATION)
+    parser.add_argument("--alpha", type=float, default=ALS_ALPHA)
+    parser.add_argument("--threads", type=int, default=ALS_THREADS)
+    parser.add_argument("--path", default=ALS_MODEL_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ratings = load_rating_matrix()
+    exported = time.perf_counter()
+    model = ALSModel.train(
+        ratings,
+        args.factors,
+        args.iterations,
+        args.regularization,
+        args.alpha,
+        args.threads,
+    )
+    logger.info(
+        f"ALS model trained on {ratings.matrix.nnz} ratings: export {exported - start:.1f} s, "
+        f"training {time.perf_counter() - exported:.1f} s"
+    )
+    model.save(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+from functions.connections import RECSYS_BACKEND
+from functions.general import fetch_movies_by_id
+from functions.embedding_index import load_embedding_index
+from functions.embedding_store import open_embedding_store
+from functions.quantization import make_codec, codec_from_state, Float32Codec
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.logging_config import get_logger
+import os
+import time
+import argparse
+import threading
+import numpy as np
+
+logger = get_logger(__name__, "EMBEDDING_INDEX_LOG_FILE_PATH")
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "data/ann_index")
+# inverted lists scanned per query, more lists means higher recall and slower queries
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# float32, float16, int8 or pq, how the index holds the vectors
+ANN_QUANTIZATION = os.getenv("ANN_QUANTIZATION", "float32")
+# compressed indexes re-score ANN_RERANK * k candidates on the exact vectors of the embedding store, 0 turns it off
+ANN_RERANK = int(os.getenv("ANN_RERANK", "4"))
+ANN_EMBEDDINGS = ["plot", "poster"]
+
+
+def ann_index_path(name, directory=ANN_INDEX_DIR):
+    return os.path.join(directory, f"{name}.ivf.npz")
+
+
+def default_nlist(count):
+    # around 4 * sqrt(n) lists keeps both the centroid scan and the probed lists small
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _nearest_centroid(vectors, centroids, block_size=8192):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start : start + block_size]
+        assignment[start : start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def spherical_kmeans(vectors, nlist, iterations=20, sample_size=None, seed=0):
+    """
+    k-means on unit vectors with cosine similarity, centroids are re-normalized after every step
+    Trains on a random sample of sample_size rows (256 per list by default) and returns the centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), sample_size or 256 * nlist)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroid(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # an empty list restarts from a random sample row
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index over one Movie embedding, for approximate cosine kNN on catalogues
+    too large for the exact scan of EmbeddingIndex.
+    Vectors are clustered around nlist centroids, and a query only scores the rows of the
+    nprobe lists whose centroids are closest to it. Rows are stored list by list, so a probed
+    list is one contiguous slice of the matrix.
+    Genre and year filters are applied to the probed rows, more lists are probed until k rows pass.
+    The rows can be held compressed by a codec of functions.quantization, the exact vectors of the
+    embedding store are then only read to re-score the best candidates.
+    """
+
+    def __init__(
+        self,
+        ids,
+        codes,
+        centroids,
+        offsets,
+        genre_ids,
+        genre_bitmap,
+        years,
+        codec=None,
+    ):
+        """
+        ids, codes, genre_bitmap columns and years are in list order,
+        list i holds rows offsets[i] to offsets[i + 1]
+        codes: the unit vectors encoded by codec, float32 vectors by default
+        years: release year per row, 0 when unknown
+        """
+        self.ids = list(ids)
+        self.row_of = {id: row for row, id in enumerate(self.ids)}
+        self.codes = codes
+        self.codec = codec or Float32Codec()
+        self.store = None
+        self.centroids = centroids
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.genre_ids = list(genre_ids)
+        self.genre_row = {genre: i for i, genre in enumerate(self.genre_ids)}
+        self.genre_bitmap = genre_bitmap
+        self.years = np.asarray(years, dtype=np.int32)
+
+    @classmethod
+    def build(
+        cls,
+        ids,
+        vectors,
+        genres,
+        years,
+        nlist=None,
+        iterations=20,
+        seed=0,
+        quantization="float32",
+        pq_subspaces=None,
+    ):
+        """
+        ids: element ids, one per row
+        vectors: embeddings, one per row, normalized here
+        genres: list of genre ids per row
+        years: release year per row, None or 0 when unknown
+        quantization: codec the rows are stored with, see functions.quantization
+        """
+        vectors = _normalize(vectors)
+        nlist = nlist or default_nlist(len(vectors))
+        start = time.perf_counter()
+        centroids = spherical_kmeans(vectors, nlist, iterations, seed=seed)
+        assignment = _nearest_centroid(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+
+        genre_ids = sorted({genre for row_genres in genres for genre in row_genres})
+        genre_row = {genre: i for i, genre in enumerate(genre_ids)}
+        genre_bitmap = np.zeros((len(genre_ids), len(order)), dtype=bool)
+        for position, row in enumerate(order):
+            genre_bitmap[[genre_row[genre] for genre in genres[row]], position] = True
+        logger.info(
+            f"IVF index built over {len(order)} vectors in {nlist} lists "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+        vectors = vectors[order]
+        codec = make_codec(quantization, pq_subspaces).fit(vectors)
+        return cls(
+            [ids[row] for row in order],
+            codec.encode(vectors),
+            centroids,
+            offsets,
+            genre_ids,
+            genre_bitmap,
+            [years[row] or 0 for row in order],
+            codec,
+        )
+
+    def quantized(self, quantization, pq_subspaces=None):
+        """
+        Copy of the index with the same lists and the rows re-encoded with another codec
+        """
+        vectors = self.codec.decode(self.codes)
+        codec = make_codec(quantization, pq_subspaces).fit(vectors)
+        index = IVFIndex(
+            self.ids,
+            codec.encode(vectors),
+            self.centroids,
+            self.offsets,
+            self.genre_ids,
+            self.genre_bitmap,
+            self.years,
+            codec,
+        )
+        if self.store is not None:
+            index.attach_store(self.store)
+        return index
+
+    def attach_store(self, store):
+        """
+        Reads exact vectors from an EmbeddingStore (or anything with vectors, norms and row_of)
+        for rerank and for the query vectors of movies in the index
+        A store missing some of the index's movies (re-exported after the index was built) is not attached,
+        the index keeps reading its own codes then
+        Returns whether the store was attached
+        """
+        store_rows = [store.row_of.get(id) for id in self.ids]
+        missing = store_rows.count(None)
+        if missing:
+            logger.warning(
+                f"Embedding store is missing {missing} of the {len(self.ids)} movies in the IVF index, "
+                "not attaching it, rebuild the index with python -m functions.ann_index build"
+            )
+            return False
+        self.store = store
+        self.store_rows = np.asarray(store_rows)
+        norms = np.asarray(store.norms, dtype=np.float32).copy()
+        norms[norms == 0] = 1.0
+        self.store_inv_norms = 1.0 / norms
+        return True
+
+    def _exact_vectors(self, rows):
+        # reads only these rows of the memory-mapped store
+        store_rows = self.store_rows[rows]
+        vectors = np.asarray(self.store.vectors[store_rows], dtype=np.float32)
+        return vectors * self.store_inv_norms[store_rows, None]
+
+    def memory_bytes(self):
+        """
+        Bytes held for the rows and the codec, the part quantization shrinks
+        """
+        return self.codes.nbytes + self.codec.nbytes()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def vector(self, id):
+        row = self.row_of.get(id)
+        if row is None:
+            return None
+        if self.store is not None:
+            return self._exact_vectors([row])[0]
+        return self.codec.decode(self.codes[[row]])[0]
+
+    def genres_of(self, id):
+        """
+        Genre ids of a movie in the index
+        """
+        row = self.row_of.get(id)
+        if row is None:
+            return []
+        return [self.genre_ids[i] for i in np.flatnonzero(self.genre_bitmap[:, row])]
+
+    def _filter(self, rows, genres, years):
+        keep = np.ones(len(rows), dtype=bool)
+        if genres is not None:
+            genre_rows = [
+                self.genre_row[genre] for genre in genres if genre in self.genre_row
+            ]
+            keep &= self.genre_bitmap[np.ix_(genre_rows, rows)].any(axis=0)
+        if years is not None:
+            # movies without a known year never pass a year filter
+            first, last = years
+            row_years = self.years[rows]
+            keep &= row_years > 0
+            if first is not None:
+                keep &= row_years >= first
+            if last is not None:
+                keep &= row_years <= last
+        return rows[keep]
+
+    def search(
+        self,
+        vector,
+        k=5,
+        nprobe=None,
+        genres=None,
+        years=None,
+        exclude=None,
+        rerank=None,
+    ):
+        """
+        Approximate top k by cosine similarity, returns [(id, similarity), ...] ordered descending
+        nprobe: lists scanned, ANN_NPROBE by default, raised until k rows pass the filters
+        genres: keep movies in any of these genre ids
+        years: (first, last) release years, inclusive, either end may be None
+        exclude: ids to leave out, e.g. the query movie itself
+        rerank: with a compressed codec and an attached store, re-scores the best rerank * k
+        candidates on the exact vectors, ANN_RERANK by default, 0 to skip
+        """
+        if k <= 0 or len(self) == 0:
+            return []
+        nprobe = max(1, min(nprobe or ANN_NPROBE, self.nlist))
+        query = _normalize(vector)
+        excluded = [self.row_of[id] for id in exclude or [] if id in self.row_of]
+        lists = np.argsort(-(self.centroids @ query), kind="stable")
+
+        candidates = []
+        found = 0
+        probed = 0
+        while probed < self.nlist and found < k:
+            # the first round scans nprobe lists, every later round as many again
+            rows = np.concatenate(
+                [
+                    np.arange(self.offsets[i], self.offsets[i + 1])
+                    for i in lists[probed : probed + nprobe]
+                ]
+            )
+            rows = self._filter(rows, genres, years)
+            if excluded:
+                rows = rows[~np.isin(rows, excluded)]
+            candidates.append(rows)
+            found += len(rows)
+            probed += nprobe
+        if not found:
+            return []
+
+        rows = np.concatenate(candidates)
+        scores = self.codec.scores(query, self.codes[rows])
+        rerank = ANN_RERANK if rerank is None else rerank
+        if rerank and self.store is not None and self.codec.name != "float32":
+            shortlist = min(len(rows), rerank * k)
+            best = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            rows = rows[best]
+            scores = self._exact_vectors(rows) @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    def search_similar(
+        self, id, k=5, nprobe=None, same_genre=True, years=None, rerank=None
+    ):
+        """
+        Approximate neighbours of a movie in the index, optionally restricted to its genres
+        """
+        vector = self.vector(id)
+        if vector is None:
+            return []
+        genres = self.genres_of(id) if same_genre else None
+        if same_genre and not genres:
+            return []
+        return self.search(vector, k, nprobe, genres, years, [id], rerank)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            ids=np.asarray(self.ids),
+            codes=self.codes,
+            codec=np.asarray(self.codec.name),
+            **{f"codec_{key}": value for key, value in self.codec.state().items()},
+            centroids=self.centroids,
+            offsets=self.offsets,
+            genre_ids=np.asarray(self.genre_ids, dtype=str),
+            genre_bitmap=self.genre_bitmap,
+            years=self.years,
+        )
+        logger.info(f"IVF index saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            codec_state = {
+                key[len("codec_") :]: saved[key]
+                for key in saved.files
+                if key.startswith("codec_")
+            }
+            return cls(
+                saved["ids"].tolist(),
+                saved["codes"],
+                saved["centroids"],
+                saved["offsets"],
+                saved["genre_ids"].tolist(),
+                saved["genre_bitmap"],
+                saved["years"],
+                codec_from_state(saved["codec"].item(), codec_state),
+            )
+
+
+def _movie_year(movie):
+    year = movie.get("year")
+    if year is None and movie.get("released"):
+        year = str(movie["released"])[:4]
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_ann_index(
+    name,
+    nlist=None,
+    iterations=20,
+    seed=0,
+    quantization=ANN_QUANTIZATION,
+    pq_subspaces=None,
+):
+    """
+    Builds the IVF index of the plot or poster embeddings, from the embedding store when it
+    has been exported, otherwise from the vectors in Neo4j
+    """
+    index = load_embedding_index(name)
+    if len(index) == 0:
+        raise ValueError(f"There are no {name} embeddings to index")
+    # normalized block by block, float16 stores are never materialised as float32 at once
+    vectors = np.concatenate(
+        [
+            index.unit_vectors(np.arange(start, min(start + 4096, len(index))))
+            for start in range(0, len(index), 4096)
+        ]
+    )
+    genres = [[index.genre_ids[i] for i in row] for row in index.row_genres]
+    movies = fetch_movies_by_id(index.ids, include_embeddings=False)
+    years = [_movie_year(movies.get(id, {})) for id in index.ids]
+    ann_index = IVFIndex.build(
+        index.ids,
+        vectors,
+        genres,
+        years,
+        nlist,
+        iterations,
+        seed,
+        quantization,
+        pq_subspaces,
+    )
+    if index.store is not None:
+        ann_index.attach_store(index.store)
+    logger.info(
+        f"{name} IVF index holds {ann_index.memory_bytes() / 2**20:.1f} MiB of {quantization} vectors"
+    )
+    return ann_index
+
+
+_ann_indexes = {}
+_ann_indexes_lock = threading.Lock()
+
+
+def get_ann_index(name, directory=ANN_INDEX_DIR):
+    """
+    Returns the process-wide IVF index of the plot or poster embeddings, loading it from disk on first use
+    Returns None if the index has not been built yet, except on the local backend,
+    which builds it in memory from the exported embedding store
+    """
+    with _ann_indexes_lock:
+        if name not in _ann_indexes:
+            path = ann_index_path(name, directory)
+            if os.path.exists(path):
+                index = IVFIndex.load(path)
+                store = open_embedding_store(name)
+                if store is not None:
+                    index.attach_store(store)
+                _ann_indexes[name] = index
+                logger.info(f"IVF index loaded from {path}")
+            elif RECSYS_BACKEND == "local":
+                _ann_indexes[name] = build_ann_index(name)
+            else:
+                return None
+        return _ann_indexes[name]
+
+
+def reset_ann_indexes():
+    with _ann_indexes_lock:
+        _ann_indexes.clear()
+
+
+# the indexes are derived from the graph, the next query reloads them
+QUERY_CACHE.add_invalidation_listener(reset_ann_indexes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the IVF approximate nearest neighbour indexes of the movie embeddings"
+    )
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument(
+        "names", nargs="*", help=f"any of {', '.join(ANN_EMBEDDINGS)}, defaults to all"
+    )
+    parser.add_argument(
+        "--nlist", type=int, help="lists per index, about 4 * sqrt(n) by default"
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--quantization",
+        choices=["float32", "float16", "int8", "pq"],
+        default=ANN_QUANTIZATION,
+    )
+    parser.add_argument(
+        "--pq-subspaces", type=int, help="pq sub-vectors, dimensions / 16 by default"
+    )
+    parser.add_argument("--dir", default=ANN_INDEX_DIR)
+    args = parser.parse_args()
+    unknown = set(args.names) - set(ANN_EMBEDDINGS)
+    if unknown:
+        parser.error(f"unknown embeddings: {', '.join(sorted(unknown))}")
+
+    for name in args.names or ANN_EMBEDDINGS:
+        build_ann_index(
+            name,
+            args.nlist,
+            args.iterations,
+            quantization=args.quantization,
+            pq_subspaces=args.pq_subspaces,
+        ).save(ann_index_path(name, args.dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+from functions.connections import RECSYS_BACKEND
+from functions.helper_functions.async_cypher import cached_run_cypher_async
+from functions import general
+from functions.general import (
+    to_display_frame,
+    MOVIE_DISPLAY_COLUMNS,
+    MOVIE_TITLE_COLUMNS,
+)
+from functions.helper_functions.logging_config import get_logger
+import asyncio
+
+logger = get_logger(__name__, "GENERAL_QUERY_LOG_FILE_PATH")
+
+# asyncio variants of the page queries that run side by side, returning exactly what the sync versions
+# in functions.general return. They share the Cypher text and the query cache with the sync versions,
+# the local backend has no query to await and runs the sync function on a worker thread instead.
+# Only the queries a page fans out have a variant here, movie_picker gathers them with its title search, e.g.
+#     results, movies = gather(
+#         search_movie_titles_async(text), search_movies_based_genres_display_async(genres)
+#     )
+
+
+async def search_movies_based_genres_display_async(genres):
+    if RECSYS_BACKEND == "local":
+        return await asyncio.to_thread(
+            general.search_movies_based_genres_display, genres
+        )
+    parameters = {"genres": sorted(set(genres))}
+    data = await cached_run_cypher_async(
+        general.SEARCH_MOVIES_BASED_GENRES_DISPLAY_QUERY, parameters
+    )
+    return to_display_frame(data, MOVIE_DISPLAY_COLUMNS)
+
+
+async def search_movie_titles_async(text, limit=general.TITLE_SEARCH_LIMIT):
+    terms = general.title_words(text)
+    if RECSYS_BACKEND == "local":
+        return await asyncio.to_thread(general.search_movie_titles, text, limit)
+    if not terms:
+        data = await cached_run_cypher_async(
+            general.TOP_MOVIE_TITLES_QUERY, {"limit": limit}
+        )
+    else:
+        data = await cached_run_cypher_async(
+            general.SEARCH_MOVIE_TITLES_QUERY,
+            {"search": general.lucene_title_query(terms), "limit": limit},
+        )
+    return to_display_frame(data, MOVIE_TITLE_COLUMNS)
@@ -0,0 +1,305 @@
+from functions.connections import get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import run_cypher
+from functions.rating_matrix import load_rating_matrix
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.logging_config import get_logger
+import os
+import argparse
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+logger = get_logger(__name__, "CO_RATING_INDEX_LOG_FILE_PATH")
+
+CO_RATING_INDEX_PATH = os.getenv("CO_RATING_INDEX_PATH", "data/co_rating_index.npz")
+
+# ratings go from 0.5 to 5.0 in steps of 0.5, one bucket per step
+RATING_BUCKETS = np.arange(1, 11, dtype=np.float32) / 2
+HIGH_RATING = 5.0
+
+
+def rating_bucket(rating):
+    return int(round(float(rating) * 2)) - 1
+
+
+def _rating_mask(matrix, rating):
+    # binary copy of a CSR rating matrix keeping only the entries equal to rating
+    # indices / indptr are copied since eliminate_zeros compacts them in place
+    mask = sp.csr_matrix(
+        (
+            (matrix.data == rating).astype(np.int32),
+            matrix.indices.copy(),
+            matrix.indptr.copy(),
+        ),
+        shape=matrix.shape,
+    )
+    mask.eliminate_zeros()
+    return mask
+
+
+class CoRatingIndex:
+    """
+    Item-item co-rating counts keyed by (movie, rating bucket).
+    Row bucket * n_movies + movie holds, for every other movie, the number of users who rated
+    the row's movie at that bucket's rating and rated the other movie 5.0, which is exactly
+    what movie_user_recommendations_singular counts at request time.
+    edge_count is the number of RATED edges in the graph when the index was built,
+    None when it is unknown (local backend, older saved indexes)
+    """
+
+    def __init__(self, movie_ids, co_counts, imdb_votes, watermark, edge_count=None):
+        self.movie_ids = list(movie_ids)
+        self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.co_counts = sp.csr_matrix(co_counts, dtype=np.int32)
+        self.imdb_votes = np.asarray(imdb_votes, dtype=np.float64)
+        self.watermark = watermark
+        self.edge_count = edge_count
+
+    def row(self, movie_id, rating):
+        bucket = rating_bucket(rating)
+        movie = self.movie_index.get(movie_id)
+        if movie is None or not 0 <= bucket < len(RATING_BUCKETS):
+            return None
+        return bucket * len(self.movie_ids) + movie
+
+    def top_k(self, movie_id, rating, k=5, by_user_count=False):
+        """
+        Returns [(rec_id, user_count), ...] ordered by the recommendation's imdbVotes descending,
+        or by user_count then imdbVotes with by_user_count=True
+        """
+        row = self.row(movie_id, rating)
+        if row is None:
+            return []
+        start, end = self.co_counts.indptr[row], self.co_counts.indptr[row + 1]
+        cols = self.co_counts.indices[start:end]
+        counts = self.co_counts.data[start:end]
+        if len(cols) == 0:
+            return []
+        # Neo4j sorts nulls first on ORDER BY ... DESC
+        votes = np.nan_to_num(self.imdb_votes[cols], nan=np.inf)
+        k = min(k, len(cols))
+        if by_user_count:
+            top = np.lexsort((-votes, -counts))[:k]
+            return [(self.movie_ids[cols[i]], int(counts[i])) for i in top]
+        top = np.argpartition(-votes, k - 1)[:k]
+        top = top[np.argsort(-votes[top], kind="stable")]
+        return [(self.movie_ids[cols[i]], int(counts[i])) for i in top]
+
+    def save(self, path=CO_RATING_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            data=self.co_counts.data,
+            indices=self.co_counts.indices,
+            indptr=self.co_counts.indptr,
+            shape=np.asarray(self.co_counts.shape),
+            movie_ids=np.asarray(self.movie_ids),
+            imdb_votes=self.imdb_votes,
+            watermark=np.asarray(self.watermark),
+            edge_count=np.asarray(-1 if self.edge_count is None else self.edge_count),
+        )
+        logger.info(f"Co-rating index saved to {path}")
+
+    @classmethod
+    def load(cls, path=CO_RATING_INDEX_PATH):
+        with np.load(path) as saved:
+            co_counts = sp.csr_matrix(
+                (saved["data"], saved["indices"], saved["indptr"]),
+                shape=tuple(saved["shape"]),
+            )
+            edge_count = (
+                saved["edge_count"].item() if "edge_count" in saved.files else -1
+            )
+            return cls(
+                saved["movie_ids"].tolist(),
+                co_counts,
+                saved["imdb_votes"],
+                saved["watermark"].item(),
+                None if edge_count < 0 else edge_count,
+            )
+
+
+RATED_COUNT_QUERY = """
+MATCH ()-[r:RATED]->()
+RETURN count(r) AS count
+"""
+
+
+def rated_edge_count():
+    """
+    Number of RATED edges in the graph, answered from the count store without reading any edge
+    """
+    return run_cypher(get_driver(), RATED_COUNT_QUERY)[0]["count"]
+
+
+def build_co_rating_index(ratings=None):
+    """
+    Builds the full index from the user x movie rating matrix, one sparse product per rating bucket
+    """
+    # counted before the export, an edge written in between only makes the next refresh rebuild
+    edge_count = None if RECSYS_BACKEND == "local" else rated_edge_count()
+    ratings = ratings or load_rating_matrix()
+    high = _rating_mask(ratings.matrix, HIGH_RATING)
+    blocks = [
+        (_rating_mask(ratings.matrix, rating).T @ high).tocsr()
+        for rating in RATING_BUCKETS
+    ]
+    co_counts = sp.vstack(blocks, format="csr")
+    logger.info(
+        f"Co-rating index built: {co_counts.shape[0]} rows, {co_counts.nnz} non-zero entries"
+    )
+    return CoRatingIndex(
+        ratings.movie_ids, co_counts, ratings.imdb_votes, ratings.watermark, edge_count
+    )
+
+
+def _touched_rows(index, new_edges):
+    """
+    (movie_id, rating) rows whose counts change because of the new RATED edges
+    A new edge adds its user to the (movie, rating) row, and a new 5.0 edge also adds the movie
+    to every row the user already belongs to
+    """
+    touched = {(edge["movie_id"], float(edge["rating"])) for edge in new_edges}
+    high_users = list(
+        {edge["user_id"] for edge in new_edges if edge["rating"] == HIGH_RATING}
+    )
+    if high_users:
+        query = """
+        UNWIND $user_ids AS user_id
+        MATCH (u:User {userId: user_id})-[r:RATED]->(m:Movie)
+        RETURN DISTINCT elementId(m) AS movie_id, r.rating AS rating
+        """
+        for row in run_cypher(get_driver(), query, {"user_ids": high_users}):
+            touched.add((row["movie_id"], float(row["rating"])))
+    return touched
+
+
+def refresh_co_rating_index(index, batch_size=500):
+    """
+    Recomputes only the rows touched by RATED edges newer than the index watermark
+    The watermark query seeks the RATED timestamp index created by create_catalogue_indexes
+    Falls back to a full build when the new edges reference movies the index has never seen, or when the
+    RATED edge count says edges were added or deleted without a newer timestamp
+    A rating changed in place without a new timestamp is not detected, stamp the edge when writing it
+    Returns (index, number of rows recomputed)
+    """
+    edge_count = rated_edge_count()
+    new_edges_query = """
+    MATCH (u:User)-[r:RATED]->(m:Movie)
+    WHERE r.timestamp > $watermark
+    RETURN u.userId AS user_id, elementId(m) AS movie_id, r.rating AS rating, r.timestamp AS timestamp
+    """
+    new_edges = run_cypher(
+        get_driver(), new_edges_query, {"watermark": index.watermark}
+    )
+    if index.edge_count is None or edge_count != index.edge_count + len(new_edges):
+        logger.info(
+            "RATED edges changed without a newer timestamp, rebuilding the full co-rating index"
+        )
+        index = build_co_rating_index()
+        return index, index.co_counts.shape[0]
+    if not new_edges:
+        logger.info("Co-rating index is up to date")
+        return index, 0
+    if any(edge["movie_id"] not in index.movie_index for edge in new_edges):
+        logger.info("New movies found, rebuilding the full co-rating index")
+        index = build_co_rating_index()
+        return index, index.co_counts.shape[0]
+
+    touched = [
+        (movie_id, rating)
+        for movie_id, rating in _touched_rows(index, new_edges)
+        if index.row(movie_id, rating) is not None
+    ]
+    rows_query = """
+    UNWIND $rows AS row
+    MATCH (m:Movie)<-[r:RATED]-(u:User)
+    WHERE elementId(m) = row.movie_id AND r.rating = row.rating
+    WITH DISTINCT row, u
+    MATCH (u)-[r:RATED]->(rec:Movie)
+    WHERE r.rating = 5.0
+    RETURN row.movie_id AS movie_id, row.rating AS rating, elementId(rec) AS rec_id, COUNT(u) AS user_count
+    """
+    new_rows, new_cols, new_counts = [], [], []
+    for start in range(0, len(touched), batch_size):
+        batch = [
+            {"movie_id": movie_id, "rating": rating}
+            for movie_id, rating in touched[start : start + batch_size]
+        ]
+        for row in run_cypher(get_driver(), rows_query, {"rows": batch}):
+            col = index.movie_index.get(row["rec_id"])
+            if col is None:
+                logger.info("New movies found, rebuilding the full co-rating index")
+                index = build_co_rating_index()
+                return index, index.co_counts.shape[0]
+            new_rows.append(index.row(row["movie_id"], row["rating"]))
+            new_cols.append(col)
+            new_counts.append(row["user_count"])
+
+    shape = index.co_counts.shape
+    keep = np.ones(shape[0], dtype=np.int32)
+    keep[[index.row(movie_id, rating) for movie_id, rating in touched]] = 0
+    replacement = sp.csr_matrix(
+        (np.asarray(new_counts, dtype=np.int32), (new_rows, new_cols)), shape=shape
+    )
+    index.co_counts = (
+        sp.diags(keep, dtype=np.int32) @ index.co_counts + replacement
+    ).tocsr()
+    index.co_counts.eliminate_zeros()
+    index.watermark = max(edge["timestamp"] for edge in new_edges)
+    index.edge_count = edge_count
+    logger.info(
+        f"Co-rating index refreshed: {len(touched)} rows recomputed from {len(new_edges)} new ratings"
+    )
+    return index, len(touched)
+
+
+_co_rating_index = None
+_co_rating_index_lock = threading.Lock()
+
+
+def get_co_rating_index(path=CO_RATING_INDEX_PATH):
+    """
+    Returns the process-wide co-rating index, loading it from disk on first use
+    Returns None if the index has not been built yet, except on the local backend,
+    which builds it in memory from the exported rating matrix
+    """
+    global _co_rating_index
+    with _co_rating_index_lock:
+        if _co_rating_index is None:
+            if os.path.exists(path):
+                _co_rating_index = CoRatingIndex.load(path)
+                logger.info(f"Co-rating index loaded from {path}")
+            elif RECSYS_BACKEND == "local":
+                _co_rating_index = build_co_rating_index()
+                logger.info("Co-rating index built from the local rating matrix")
+        return _co_rating_index
+
+
+def reset_co_rating_index():
+    global _co_rating_index
+    with _co_rating_index_lock:
+        _co_rating_index = None
+
+
+# the index is derived from the graph, the next query reloads it
+QUERY_CACHE.add_invalidation_listener(reset_co_rating_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the item-item co-rating index"
+    )
+    parser.add_argument("command", choices=["build", "refresh"])
+    parser.add_argument("--path", default=CO_RATING_INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build" or not os.path.exists(args.path):
+        index = build_co_rating_index()
+    else:
+        index, _ = refresh_co_rating_index(CoRatingIndex.load(args.path))
+    index.save(args.path)
+
+
+if __name__ == "__main__":
+    main()
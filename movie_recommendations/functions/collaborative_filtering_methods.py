@@ -1,43 +1,49 @@
-from functions.connections import NEO4J_DRIVER
+from functions.connections import get_driver, RECSYS_BACKEND
 from functions.helper_functions.cypher import run_cypher
+from functions.general import (
+    fetch_movies_by_id,
+    display_projection,
+    to_display_frame,
+    DISPLAY_PROPERTIES,
+)
+from functions.co_rating_index import get_co_rating_index
+from functions.rating_neighbours import get_rating_neighbours, RATING_TOLERANCE
+from functions.als_model import get_als_model, has_liked_seed, LIKED_RATING
+from functions.content_filtering_methods import (
+    FULL_RECOMMENDATION_RETURN,
+    DISPLAY_RECOMMENDATION_RETURN,
+    precomputed_similarity_batch,
+)
+from functions.graph_embeddings import (
+    FASTRP_INDEX,
+    FASTRP_PROPERTY,
+    NODE_SIMILARITY_RELATIONSHIP,
+)
+from functions.helper_functions.logging_config import get_logger
 import os
-from dotenv import load_dotenv
-import neo4j
 
-print(load_dotenv(".env"))
+logger = get_logger(__name__, "CONTENT_FILTERING_QUERY_LOG_FILE_PATH")
 
-import logging
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# "cypher" expands the two-hop traversal per request, "index" reads the precomputed co-rating index
+CO_RATING_ENGINE = os.getenv("CO_RATING_ENGINE", "cypher")
+# "neighbours" aggregates the ratings of similar users, "als" folds the ratings into the ALS model
+MULTI_SEED_ENGINE = os.getenv("MULTI_SEED_ENGINE", "neighbours")
+# "fastrp" looks up the movieStructure vector index, "node_similarity" reads the SIMILAR_RATERS relationships,
+# both written by functions.graph_embeddings
+STRUCTURAL_SIMILARITY_ENGINE = os.getenv("STRUCTURAL_SIMILARITY_ENGINE", "fastrp")
 
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
 
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-
-# add the console handler to the logger
-logger.addHandler(ch)
-
-log_file_path = os.getenv("CONTENT_FILTERING_QUERY_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
-
-logger.addHandler(fh)
-
-
-def movie_user_recommendations_singular(id, rating):
-    """
-    id: movie node id
-    Idea is, if a user has rated a movie highly (5.0), then find similar users who have rated the same movie highly, and recommend movies that they have rated highly
-    If a user has rated a movie poorly (0.5), then find similar users who have rated the same movie poorly, and recommend movies that they have rated highly
-    """
-    query = """
+def co_rating_query(slim=False, by_user_count=False):
+    recommendation = (
+        "rec {" + ", ".join(f".{prop}" for prop in DISPLAY_PROPERTIES) + "}"
+        if slim
+        else "rec"
+    )
+    order = (
+        "user_count DESC, rec.imdbVotes DESC" if by_user_count else "rec.imdbVotes DESC"
+    )
+    return f"""
     MATCH (m:Movie)
     WHERE elementId(m) = $id
     WITH m
@@ -47,8 +53,246 @@ def movie_user_recommendations_singular(id, rating):
     MATCH (u)-[r:RATED]->(rec:Movie)
     WHERE r.rating = 5.0
     WITH DISTINCT rec, COUNT(u) AS user_count
-    RETURN elementID(rec) as rec_id, rec as recommendation, user_count
-    ORDER BY rec.imdbVotes DESC LIMIT 5
+    RETURN elementID(rec) as rec_id, {recommendation} as recommendation, user_count
+    ORDER BY {order} LIMIT $k
+    """
+
+
+def movie_user_recommendations_singular(
+    id, rating, k=5, engine=None, slim=False, by_user_count=False
+):
+    """
+    id: movie node id
+    Idea is, if a user has rated a movie highly (5.0), then find similar users who have rated the same movie highly, and recommend movies that they have rated highly
+    If a user has rated a movie poorly (0.5), then find similar users who have rated the same movie poorly, and recommend movies that they have rated highly
+    slim=True returns only the display properties of each recommendation instead of the full node
+    Recommendations are ordered by IMDb votes, by_user_count=True orders them by how many users
+    they share with the movie instead, ties broken by votes
     """
-    result = run_cypher(NEO4J_DRIVER, query, {"id": id, "rating": rating})
+    engine = engine or CO_RATING_ENGINE
+    if RECSYS_BACKEND == "local":
+        # the local backend builds the co-rating index from the exported rating matrix
+        engine = "index"
+    if engine == "index":
+        index = get_co_rating_index()
+        if index is not None:
+            return movie_user_recommendations_singular_index(
+                index, id, rating, k, slim, by_user_count
+            )
+        logger.warning("Co-rating index has not been built, falling back to Cypher")
+
+    query = co_rating_query(slim, by_user_count)
+    result = run_cypher(get_driver(), query, {"id": id, "rating": rating, "k": k})
     return result
+
+
+def movie_user_recommendations_singular_index(
+    index, id, rating, k=5, slim=False, by_user_count=False
+):
+    """
+    Same result as movie_user_recommendations_singular, read from one row of the co-rating index
+    """
+    top = index.top_k(id, rating, k, by_user_count)
+    if not top:
+        return []
+    movies = fetch_movies_by_id(
+        [rec_id for rec_id, _ in top], include_embeddings=not slim
+    )
+    if slim:
+        movies = {rec_id: display_projection(movie) for rec_id, movie in movies.items()}
+    return [
+        {"rec_id": rec_id, "recommendation": movies[rec_id], "user_count": user_count}
+        for rec_id, user_count in top
+        if rec_id in movies
+    ]
+
+
+def co_rating_similarity(id, k=5, slim=False):
+    """
+    Movies liked by the same users as this one, whatever the rating, one hop over the co_rating
+    SIMILAR relationships written by functions.neighbour_tables
+    Same rows as plot_embedding_similarity_genre, best similarity first
+    """
+    return precomputed_similarity_batch([id], "co_rating", k, slim)
+
+
+def movie_user_recommendations_display(id, rating, k=5, engine=None):
+    """
+    Slim co-rating recommendations for the bipartite graph page, as an Arrow-backed DataFrame
+    with MovieID, one Movie.<property> column per display property and user_count, ordered by IMDb votes
+    """
+    rows = movie_user_recommendations_singular(id, rating, k, engine, slim=True)
+    return co_rating_display_frame(rows)
+
+
+def co_rating_display_frame(rows):
+    """
+    Flattens slim co-rating rows into the DataFrame of movie_user_recommendations_display
+    """
+    flat = [
+        {
+            "MovieID": row["rec_id"],
+            **{
+                f"Movie.{prop}": row["recommendation"].get(prop)
+                for prop in DISPLAY_PROPERTIES
+            },
+            "user_count": row["user_count"],
+        }
+        for row in rows
+    ]
+    columns = (
+        ["MovieID"] + [f"Movie.{prop}" for prop in DISPLAY_PROPERTIES] + ["user_count"]
+    )
+    return to_display_frame(flat, columns)
+
+
+def movie_user_recommendations(
+    seeds, k=5, tolerance=RATING_TOLERANCE, slim=False, engine=None
+):
+    """
+    seeds: [(movie id, rating), ...], any number of rated movies
+    "neighbours" finds the users who rated the seeds within tolerance stars of the given ratings and recommends
+    the movies they rated highest, weighted by how closely they agree, from the in-process rating matrix
+    "als" folds the seeds into the ALS model as a new user and ranks movies by their predicted preference,
+    user_count is None then; it falls back to neighbours when the model is missing or no seed is liked
+    Returns [{"rec_id", "recommendation", "score", "user_count"}, ...], best score first
+    """
+    engine = engine or MULTI_SEED_ENGINE
+    top = None
+    if engine == "als":
+        model = get_als_model()
+        if model is None:
+            logger.warning("ALS model has not been trained, falling back to neighbours")
+        elif not has_liked_seed(seeds):
+            # neutral and low ratings fold in as the zero vector, the model would rank nothing
+            logger.warning(
+                "No seed is rated %s or above, falling back to neighbours", LIKED_RATING
+            )
+        else:
+            top = [(rec_id, score, None) for rec_id, score in model.recommend(seeds, k)]
+    if top is None:
+        top = get_rating_neighbours().recommend(seeds, k, tolerance)
+    if not top:
+        return []
+    movies = fetch_movies_by_id(
+        [rec_id for rec_id, _, _ in top], include_embeddings=not slim
+    )
+    if slim:
+        movies = {rec_id: display_projection(movie) for rec_id, movie in movies.items()}
+    return [
+        {
+            "rec_id": rec_id,
+            "recommendation": movies[rec_id],
+            "score": score,
+            "user_count": user_count,
+        }
+        for rec_id, score, user_count in top
+        if rec_id in movies
+    ]
+
+
+def movie_user_recommendations_multi_display(
+    seeds, k=5, tolerance=RATING_TOLERANCE, engine=None
+):
+    """
+    Slim multi-seed recommendations for the bipartite graph page, as an Arrow-backed DataFrame
+    with MovieID, one Movie.<property> column per display property, score and user_count, best score first
+    """
+    rows = movie_user_recommendations(seeds, k, tolerance, slim=True, engine=engine)
+    return neighbour_display_frame(rows)
+
+
+def neighbour_display_frame(rows):
+    """
+    Flattens slim multi-seed rows into the DataFrame of movie_user_recommendations_multi_display
+    """
+    flat = [
+        {
+            "MovieID": row["rec_id"],
+            **{
+                f"Movie.{prop}": row["recommendation"].get(prop)
+                for prop in DISPLAY_PROPERTIES
+            },
+            "score": row["score"],
+            "user_count": row["user_count"],
+        }
+        for row in rows
+    ]
+    columns = (
+        ["MovieID"]
+        + [f"Movie.{prop}" for prop in DISPLAY_PROPERTIES]
+        + ["score", "user_count"]
+    )
+    return to_display_frame(flat, columns)
+
+
+def structural_similarity_query(engine="fastrp", slim=False):
+    recommendation = (
+        DISPLAY_RECOMMENDATION_RETURN if slim else FULL_RECOMMENDATION_RETURN
+    )
+    if engine == "node_similarity":
+        return f"""
+        MATCH (source:Movie)-[s:{NODE_SIMILARITY_RELATIONSHIP}]->(target:Movie)
+        WHERE elementId(source) = $id
+        WITH source, target, s.score AS similarity
+        RETURN {recommendation}
+        ORDER BY similarity DESC
+        LIMIT $k
+        """
+    # one vector index lookup, scores mapped back from (1 + cosine) / 2 like the other vector index queries
+    return f"""
+    MATCH (source:Movie)
+    WHERE elementId(source) = $id AND source.{FASTRP_PROPERTY} IS NOT NULL
+    CALL db.index.vector.queryNodes('{FASTRP_INDEX}', $k + 1, source.{FASTRP_PROPERTY})
+    YIELD node AS target, score
+    WHERE target <> source
+    WITH source, target, 2 * score - 1 AS similarity
+    RETURN {recommendation}
+    ORDER BY similarity DESC
+    LIMIT $k
+    """
+
+
+def structural_similarity(id, k=5, engine=None, slim=False):
+    """
+    Movies close to this one in the User / Movie / Genre / Person graph: nearest FastRP embeddings
+    or the most similar movies by shared raters (engine="node_similarity")
+    Same rows as plot_embedding_similarity_genre
+    The local backend has no GDS, it ranks by the cosine of the ALS item factors instead
+    """
+    engine = engine or STRUCTURAL_SIMILARITY_ENGINE
+    if RECSYS_BACKEND == "local":
+        return structural_similarity_als(id, k, slim)
+    query = structural_similarity_query(engine, slim)
+    return run_cypher(get_driver(), query, {"id": id, "k": k})
+
+
+def structural_similarity_als(id, k=5, slim=False):
+    model = get_als_model()
+    if model is None:
+        logger.warning("ALS model has not been trained, no structural neighbours")
+        return []
+    neighbours = model.similar_movies(id, k)
+    if not neighbours:
+        return []
+    movies = fetch_movies_by_id(
+        [id] + [target_id for target_id, _ in neighbours], include_embeddings=not slim
+    )
+    if id not in movies:
+        return []
+    if slim:
+        movies = {
+            movie_id: display_projection(movie) for movie_id, movie in movies.items()
+        }
+        movies[id] = {"title": movies[id].get("title")}
+    return [
+        {
+            "source_id": id,
+            "source": movies[id],
+            "target_id": target_id,
+            "target": movies[target_id],
+            "similarity": similarity,
+        }
+        for target_id, similarity in neighbours
+        if target_id in movies
+    ]
@@ -1,52 +1,49 @@
 import os
-from dotenv import load_dotenv
-import neo4j
+import threading
+from functions.helper_functions.logging_config import get_logger
 
-print(load_dotenv(".env"))
+logger = get_logger(__name__, "CONNECTIONS_LOG_FILE_PATH")
 
-import logging
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+def driver_settings():
+    """
+    URI, auth and connection pool settings shared by the sync and async drivers
+    """
+    # local
+    URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+    user = os.getenv("NEO4J_USER", "neo4j")
+    password = os.getenv("NEO4J_PASSWORD", "password")
 
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+    # # deployed
+    # URI = os.getenv("NEO4j_URI_DPLY", "bolt://localhost:7687")
+    # user = os.getenv("NEO4J_USER_DPLY", "neo4j")
+    # password = os.getenv("NEO4J_PASSWORD_DPLY", "abcd1234")
 
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
+    AUTH = (user, password)
 
-# add the console handler to the logger
-logger.addHandler(ch)
+    # connection pool settings, sessions borrow connections from this pool
+    max_pool_size = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "50"))
+    acquisition_timeout = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "60"))
+    # how long managed transactions (execute_read / execute_write) keep retrying
+    max_retry_time = float(os.getenv("NEO4J_MAX_TRANSACTION_RETRY_TIME", "15"))
 
-log_file_path = os.getenv("CONNECTIONS_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
-
-logger.addHandler(fh)
+    return URI, {
+        "auth": AUTH,
+        "max_connection_pool_size": max_pool_size,
+        "connection_acquisition_timeout": acquisition_timeout,
+        "max_transaction_retry_time": max_retry_time,
+    }
 
 
 # Connect to Neo4j
 def connect_to_neo4j():
-    try:
-        # local
-        URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-        user = os.getenv("NEO4J_USER", "neo4j")
-        password = os.getenv("NEO4J_PASSWORD", "password")
-
-        # # deployed
-        # URI = os.getenv("NEO4j_URI_DPLY", "bolt://localhost:7687")
-        # user = os.getenv("NEO4J_USER_DPLY", "neo4j")
-        # password = os.getenv("NEO4J_PASSWORD_DPLY", "abcd1234")
-
-        AUTH = (user, password)
-
-        logger.info(f"Connecting to Neo4j at {URI} with user {user}")
+    # imported here so that importing the query modules does not pay for the driver package
+    import neo4j
 
-        driver = neo4j.GraphDatabase.driver(URI, auth=AUTH)
+    try:
+        URI, settings = driver_settings()
+        logger.info(f"Connecting to Neo4j at {URI} with user {settings['auth'][0]}")
+        driver = neo4j.GraphDatabase.driver(URI, **settings)
         driver.verify_connectivity()
 
         # driver = neo4j.GraphDatabase.driver(uri, auth=(user, password))
@@ -56,4 +53,46 @@ def connect_to_neo4j():
         return None
 
 
-NEO4J_DRIVER = connect_to_neo4j()
+async def connect_to_neo4j_async():
+    """
+    neo4j.AsyncGraphDatabase driver with the same settings as connect_to_neo4j, None if the connection failed
+    Async drivers are bound to the event loop that created them, see functions.helper_functions.async_cypher
+    """
+    import neo4j
+
+    try:
+        URI, settings = driver_settings()
+        logger.info(f"Connecting async driver to Neo4j at {URI}")
+        driver = neo4j.AsyncGraphDatabase.driver(URI, **settings)
+        await driver.verify_connectivity()
+        return driver
+    except Exception as e:
+        logger.error(f"Failed to connect the async driver to Neo4j: {e}")
+        return None
+
+
+# "neo4j" serves every query from the database, "local" from the files exported by functions.local_graph
+RECSYS_BACKEND = os.getenv("RECSYS_BACKEND", "neo4j")
+
+_driver = None
+_driver_lock = threading.Lock()
+
+
+def get_driver():
+    """
+    Returns the process-wide Neo4j driver, connecting on first use instead of at import
+    Returns None on the local backend, or if the connection failed (the next call retries)
+    """
+    global _driver
+    if _driver is None and RECSYS_BACKEND == "neo4j":
+        with _driver_lock:
+            if _driver is None:
+                _driver = connect_to_neo4j()
+    return _driver
+
+
+def __getattr__(name):
+    # NEO4J_DRIVER used to be created at import, keep it working as a lazy alias of get_driver()
+    if name == "NEO4J_DRIVER":
+        return get_driver()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,51 +1,495 @@
-from functions.connections import NEO4J_DRIVER
+from functions.connections import get_driver, RECSYS_BACKEND
 from functions.helper_functions.cypher import run_cypher
+from functions.embedding_index import get_plot_index
+from functions.ann_index import get_ann_index
+from functions.local_graph import get_local_graph
+from functions.neighbour_tables import get_neighbour_table, SIMILAR_RELATIONSHIP
+from functions.general import (
+    fetch_movies_by_id,
+    display_projection,
+    to_display_frame,
+    DISPLAY_PROPERTIES,
+)
+from functions.helper_functions.logging_config import get_logger
 import os
-from dotenv import load_dotenv
-import neo4j
+import numpy as np
 
-print(load_dotenv(".env"))
+logger = get_logger(__name__, "CONTENT_FILTERING_QUERY_LOG_FILE_PATH")
 
-import logging
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# "cypher" runs gds.similarity.cosine inside Neo4j, "numpy" uses the in-process embedding index,
+# "vector_index" asks the moviePlots vector index for approximate neighbours and keeps the same-genre ones,
+# "ivf" probes the in-process IVF index of functions.ann_index,
+# "precomputed" reads the SIMILAR relationships written by functions.neighbour_tables
+PLOT_SIMILARITY_ENGINE = os.getenv("PLOT_SIMILARITY_ENGINE", "cypher")
+# "vector_index" queries the moviePosters vector index, "ivf" the in-process IVF index,
+# "precomputed" the SIMILAR relationships
+POSTER_SIMILARITY_ENGINE = os.getenv("POSTER_SIMILARITY_ENGINE", "vector_index")
+# how many approximate neighbours to request per recommendation before the genre post-filter
+PLOT_ANN_OVERSAMPLING = int(os.getenv("PLOT_ANN_OVERSAMPLING", "10"))
+# similar people looked up per cast member for cast_bio_similarity
+CAST_SIMILAR_PEOPLE = int(os.getenv("CAST_SIMILAR_PEOPLE", "10"))
 
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+# RETURN items of the batched plot recommenders, full node maps or only what the pages display
+FULL_RECOMMENDATION_RETURN = "elementId(source) as source_id, source, elementId(target) as target_id, target, similarity"
+DISPLAY_RECOMMENDATION_RETURN = (
+    "elementId(source) as source_id, source {.title} AS source, elementId(target) as target_id, "
+    + "target {"
+    + ", ".join(f".{prop}" for prop in DISPLAY_PROPERTIES)
+    + "} AS target, similarity"
+)
 
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
 
-# add the console handler to the logger
-logger.addHandler(ch)
+PLOT_SIMILARITY_GENRE_QUERY = """
+MATCH (source:Movie)
+WHERE elementId(source) = $id
+WITH source, source.plotEmbedding AS sourceVec
+MATCH (target:Movie)-[:IN_GENRE]->(g:Genre)<-[:IN_GENRE]-(source)
+WHERE target.plotEmbedding IS NOT NULL
+WITH source, target, g, gds.similarity.cosine(sourceVec, target.plotEmbedding) AS similarity
+RETURN DISTINCT elementId(source) as source_id, source, elementId(target) as target_id, target, similarity
+ORDER BY similarity DESC
+LIMIT $k
+"""
 
-log_file_path = os.getenv("CONTENT_FILTERING_QUERY_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
 
-logger.addHandler(fh)
-
-
-def plot_embedding_similarity_genre(id):
+def plot_embedding_similarity_genre(id, k=5, engine=None):
     """
     Leveraging plot embeddings to find similar movies in the same genre, ranking using cosine similarity score
     Uses the moviePlots index to find similar movies
     """
+    engine = engine or PLOT_SIMILARITY_ENGINE
+    if RECSYS_BACKEND == "local" and engine not in ["ivf", "precomputed"]:
+        # there is no Cypher locally, the numpy engine returns the same rows
+        engine = "numpy"
+    if engine == "numpy":
+        return plot_embedding_similarity_genre_numpy(id, k)
+    if engine == "precomputed":
+        return precomputed_similarity_batch([id], "plot", k)
+    if engine == "ivf":
+        return plot_embedding_similarity_genre_batch_ivf([id], k)
+    if engine == "vector_index":
+        return plot_embedding_similarity_genre_ann(id, k)
+
+    result = run_cypher(get_driver(), PLOT_SIMILARITY_GENRE_QUERY, {"id": id, "k": k})
+    return result
+
+
+def cosine_similarity(a, b):
+    """
+    Float64 cosine similarity, same definition as gds.similarity.cosine
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    if norm == 0:
+        return 0.0
+    return float(np.dot(a, b) / norm)
+
+
+def rescore_plot_candidates(candidates, movies, k, store=None):
+    """
+    candidates: {source_id: [target_id, ...]} shortlisted by the embedding index
+    movies: {id: movie} for every source and target
+    store: plot EmbeddingStore to read the vectors from, otherwise they are read from the movie maps
+    Re-scores each shortlist in float64 and returns the top k rows per source, grouped by source
+    """
+
+    def plot_vector(id):
+        if store is not None:
+            return store.vector(id)
+        return movies[id]["plotEmbedding"]
+
+    result = []
+    for source_id, target_ids in candidates.items():
+        source = movies.get(source_id)
+        if source is None:
+            continue
+        rows = []
+        for target_id in target_ids:
+            target = movies.get(target_id)
+            if target is None:
+                continue
+            rows.append(
+                {
+                    "source_id": source_id,
+                    "source": source,
+                    "target_id": target_id,
+                    "target": target,
+                    "similarity": cosine_similarity(
+                        plot_vector(source_id), plot_vector(target_id)
+                    ),
+                }
+            )
+        rows.sort(key=lambda row: row["similarity"], reverse=True)
+        result.extend(rows[:k])
+    return result
+
+
+def plot_embedding_similarity_genre_numpy(id, k=5):
+    """
+    Same result as plot_embedding_similarity_genre, but ranks the candidates with the in-process embedding index
+    The index shortlists 2k candidates in float32, which are then re-scored in float64
+    so the similarity values and ordering match the Cypher path
+    When the index is backed by the embedding store, vectors are read from the memory-mapped file
+    and the fetched nodes leave their embeddings out
+    """
+    index = get_plot_index()
+    target_ids = [target_id for target_id, _ in index.top_k_same_genre(id, 2 * k)]
+    if not target_ids:
+        return []
+    movies = fetch_movies_by_id(
+        [id] + target_ids, include_embeddings=index.store is None
+    )
+    return rescore_plot_candidates({id: target_ids}, movies, k, index.store)
+
+
+def plot_similarity_batch_query(slim=False):
+    returns = DISPLAY_RECOMMENDATION_RETURN if slim else FULL_RECOMMENDATION_RETURN
+    return f"""
+    UNWIND range(0, size($ids) - 1) AS position
+    MATCH (source:Movie)
+    WHERE elementId(source) = $ids[position]
+    CALL {{
+        WITH source
+        MATCH (target:Movie)-[:IN_GENRE]->(:Genre)<-[:IN_GENRE]-(source)
+        WHERE target.plotEmbedding IS NOT NULL
+        WITH DISTINCT source, target
+        WITH target, gds.similarity.cosine(source.plotEmbedding, target.plotEmbedding) AS similarity
+        ORDER BY similarity DESC
+        LIMIT $k
+        RETURN target, similarity
+    }}
+    RETURN {returns}
+    ORDER BY position, similarity DESC
+    """
+
+
+def plot_embedding_similarity_genre_batch(ids, k=5, engine=None, slim=False):
+    """
+    Batched plot_embedding_similarity_genre for several source movies in one round trip
+    Returns the same rows as the single-movie version, grouped by source in the order of ids,
+    each group ordered by similarity descending
+    slim=True returns only the source title and the target's display properties instead of full nodes
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    engine = engine or PLOT_SIMILARITY_ENGINE
+    if RECSYS_BACKEND == "local" and engine not in ["ivf", "precomputed"]:
+        # there is no Cypher locally, the numpy engine returns the same rows
+        engine = "numpy"
+    if engine == "numpy":
+        return plot_embedding_similarity_genre_batch_numpy(ids, k, slim)
+    if engine == "precomputed":
+        return precomputed_similarity_batch(ids, "plot", k, slim)
+    if engine == "ivf":
+        return plot_embedding_similarity_genre_batch_ivf(ids, k, slim)
+    if engine == "vector_index":
+        return plot_embedding_similarity_genre_batch_ann(ids, k, slim)
+
+    query = plot_similarity_batch_query(slim)
+    result = run_cypher(get_driver(), query, {"ids": ids, "k": k})
+    return result
+
+
+def plot_embedding_similarity_genre_batch_numpy(ids, k=5, slim=False):
+    """
+    Numpy engine for plot_embedding_similarity_genre_batch, one matrix-matrix product for all sources
+    and one round trip to fetch the source and target nodes
+    """
+    index = get_plot_index()
+    shortlists = index.top_k_same_genre_batch(ids, 2 * k)
+    candidates = {
+        id: [target_id for target_id, _ in shortlists[id]]
+        for id in ids
+        if shortlists.get(id)
+    }
+    logger.debug(f"Numpy batch plot similarity scored {len(candidates)} sources")
+    return rescore_plot_shortlists(candidates, k, slim, index.store)
+
+
+def rescore_plot_shortlists(candidates, k, slim=False, store=None):
+    """
+    Fetches the source and target nodes of the shortlists in one round trip and re-scores them
+    with rescore_plot_candidates, vectors come from store when given (anything with a vector(id) method)
+    """
+    if not candidates:
+        return []
+    movie_ids = set(candidates)
+    for target_ids in candidates.values():
+        movie_ids.update(target_ids)
+    movies = fetch_movies_by_id(movie_ids, include_embeddings=store is None)
+    result = rescore_plot_candidates(candidates, movies, k, store)
+    return slim_similarity_rows(result) if slim else result
+
+
+def plot_embedding_similarity_genre_batch_ivf(ids, k=5, slim=False):
+    """
+    IVF engine for plot_embedding_similarity_genre_batch, approximate same-genre shortlists of 2k
+    movies per source from the plot IVF index, re-scored like the numpy engine
+    Falls back to the numpy engine when the IVF index has not been built
+    """
+    index = get_ann_index("plot")
+    if index is None:
+        logger.warning("Plot IVF index has not been built, falling back to numpy")
+        return plot_embedding_similarity_genre_batch_numpy(ids, k, slim)
+    candidates = {}
+    for id in ids:
+        target_ids = [target_id for target_id, _ in index.search_similar(id, 2 * k)]
+        if target_ids:
+            candidates[id] = target_ids
+    return rescore_plot_shortlists(candidates, k, slim, index)
+
+
+def plot_recommendations_display(ids, k=5, engine=None):
+    """
+    Slim plot recommendations for the plot embeddings page, as an Arrow-backed DataFrame
+    with source_id, source.title, target_id, one target.<property> column per display property and similarity,
+    grouped by source in the order of ids
+    """
+    rows = plot_embedding_similarity_genre_batch(ids, k, engine, slim=True)
+    return plot_display_frame(rows)
+
+
+def plot_display_frame(rows):
+    """
+    Flattens slim plot recommendation rows into the DataFrame of plot_recommendations_display
+    """
+    columns = (
+        ["source_id", "source.title", "target_id"]
+        + [f"target.{prop}" for prop in DISPLAY_PROPERTIES]
+        + ["similarity"]
+    )
+    flat = [
+        {
+            "source_id": row["source_id"],
+            "source.title": row["source"]["title"],
+            "target_id": row["target_id"],
+            **{
+                f"target.{prop}": row["target"].get(prop) for prop in DISPLAY_PROPERTIES
+            },
+            "similarity": row["similarity"],
+        }
+        for row in rows
+    ]
+    return to_display_frame(flat, columns)
+
+
+# Neo4j vector indexes score cosine as (1 + cosine) / 2, the recommenders below map it back with 2 * score - 1
+# so their similarity is on the same scale as gds.similarity.cosine
+
+
+def plot_embedding_similarity_genre_ann(id, k=5):
+    """
+    Approximate version of plot_embedding_similarity_genre using the moviePlots vector index
+    Requests k * PLOT_ANN_OVERSAMPLING neighbours and keeps the ones sharing a genre with the source,
+    so it can return fewer than k rows for movies in small genres
+    """
+    query = """
+    MATCH (source:Movie)
+    WHERE elementId(source) = $id AND source.plotEmbedding IS NOT NULL
+    CALL db.index.vector.queryNodes('moviePlots', $candidates, source.plotEmbedding)
+    YIELD node AS target, score
+    WHERE target <> source AND EXISTS { (target)-[:IN_GENRE]->(:Genre)<-[:IN_GENRE]-(source) }
+    RETURN elementId(source) as source_id, source, elementId(target) as target_id, target, 2 * score - 1 AS similarity
+    ORDER BY similarity DESC
+    LIMIT $k
+    """
+    parameters = {"id": id, "k": k, "candidates": k * PLOT_ANN_OVERSAMPLING + 1}
+    result = run_cypher(get_driver(), query, parameters)
+    return result
+
+
+def plot_similarity_batch_ann_query(slim=False):
+    returns = DISPLAY_RECOMMENDATION_RETURN if slim else FULL_RECOMMENDATION_RETURN
+    return f"""
+    UNWIND range(0, size($ids) - 1) AS position
+    MATCH (source:Movie)
+    WHERE elementId(source) = $ids[position] AND source.plotEmbedding IS NOT NULL
+    CALL {{
+        WITH source
+        CALL db.index.vector.queryNodes('moviePlots', $candidates, source.plotEmbedding)
+        YIELD node AS target, score
+        WHERE target <> source AND EXISTS {{ (target)-[:IN_GENRE]->(:Genre)<-[:IN_GENRE]-(source) }}
+        WITH target, 2 * score - 1 AS similarity
+        ORDER BY similarity DESC
+        LIMIT $k
+        RETURN target, similarity
+    }}
+    RETURN {returns}
+    ORDER BY position, similarity DESC
+    """
+
+
+def plot_embedding_similarity_genre_batch_ann(ids, k=5, slim=False):
+    """
+    Vector index engine for plot_embedding_similarity_genre_batch
+    """
+    query = plot_similarity_batch_ann_query(slim)
+    parameters = {"ids": ids, "k": k, "candidates": k * PLOT_ANN_OVERSAMPLING + 1}
+    result = run_cypher(get_driver(), query, parameters)
+    return result
+
+
+def poster_similarity_query(slim=False):
+    returns = DISPLAY_RECOMMENDATION_RETURN if slim else FULL_RECOMMENDATION_RETURN
+    return f"""
+    MATCH (source:Movie)
+    WHERE elementId(source) = $id AND source.posterEmbedding IS NOT NULL
+    CALL db.index.vector.queryNodes('moviePosters', $k + 1, source.posterEmbedding)
+    YIELD node AS target, score
+    WHERE target <> source
+    WITH source, target, 2 * score - 1 AS similarity
+    RETURN {returns}
+    ORDER BY similarity DESC
+    LIMIT $k
+    """
+
+
+def slim_similarity_rows(rows):
+    """
+    Trims similarity rows to the source title and the target's display properties, like slim=True queries
+    """
+    for row in rows:
+        row["source"] = {"title": row["source"].get("title")}
+        row["target"] = display_projection(row["target"])
+    return rows
+
+
+def poster_embedding_similarity(id, k=5, engine=None, slim=False):
+    """
+    Movies whose posters look like this movie's poster, approximate kNN on the moviePosters vector index
+    or on the poster IVF index (engine="ivf")
+    Same rows as plot_embedding_similarity_genre, slim=True keeps only the display properties
+    """
+    engine = engine or POSTER_SIMILARITY_ENGINE
+    if engine == "precomputed":
+        return precomputed_similarity_batch([id], "poster", k, slim)
+    if engine == "ivf":
+        index = get_ann_index("poster")
+        if index is not None:
+            rows = poster_embedding_similarity_ivf(index, id, k)
+            return slim_similarity_rows(rows) if slim else rows
+        logger.warning("Poster IVF index has not been built, falling back")
+    if RECSYS_BACKEND == "local":
+        rows = get_local_graph().poster_embedding_similarity(id, k)
+        return slim_similarity_rows(rows) if slim else rows
+    query = poster_similarity_query(slim)
+    result = run_cypher(get_driver(), query, {"id": id, "k": k})
+    return result
+
+
+def poster_embedding_similarity_ivf(index, id, k=5):
+    """
+    IVF engine for poster_embedding_similarity, over every movie regardless of genre
+    """
+    neighbours = index.search_similar(id, k, same_genre=False)
+    if not neighbours:
+        return []
+    movies = fetch_movies_by_id(
+        [id] + [target_id for target_id, _ in neighbours], include_embeddings=False
+    )
+    if id not in movies:
+        return []
+    return [
+        {
+            "source_id": id,
+            "source": movies[id],
+            "target_id": target_id,
+            "target": movies[target_id],
+            "similarity": similarity,
+        }
+        for target_id, similarity in neighbours
+        if target_id in movies
+    ]
+
+
+def precomputed_similarity_query(slim=False):
+    returns = DISPLAY_RECOMMENDATION_RETURN if slim else FULL_RECOMMENDATION_RETURN
+    return f"""
+    UNWIND range(0, size($ids) - 1) AS position
+    MATCH (source:Movie)
+    WHERE elementId(source) = $ids[position]
+    CALL {{
+        WITH source
+        MATCH (source)-[s:{SIMILAR_RELATIONSHIP}]->(target:Movie)
+        WHERE s.method = $method
+        WITH target, s.score AS similarity
+        ORDER BY similarity DESC
+        LIMIT $k
+        RETURN target, similarity
+    }}
+    RETURN {returns}
+    ORDER BY position, similarity DESC
+    """
+
+
+def precomputed_similarity_batch(ids, method, k=5, slim=False):
+    """
+    Neighbours of several source movies precomputed by functions.neighbour_tables, one relationship hop
+    per source in one round trip. method is plot, poster or co_rating
+    Same rows as plot_embedding_similarity_genre_batch, at most NEIGHBOUR_TOP_K per source
+    The local backend reads the neighbour table itself
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    if RECSYS_BACKEND == "local":
+        return precomputed_similarity_table(get_neighbour_table(method), ids, k, slim)
+    query = precomputed_similarity_query(slim)
+    return run_cypher(get_driver(), query, {"ids": ids, "method": method, "k": k})
+
+
+def precomputed_similarity_table(table, ids, k=5, slim=False):
+    neighbours = {id: table.neighbours(id, k) for id in ids}
+    movie_ids = set(ids)
+    for rows in neighbours.values():
+        movie_ids.update(target_id for target_id, _ in rows)
+    movies = fetch_movies_by_id(movie_ids, include_embeddings=not slim)
+    result = []
+    for id in ids:
+        if id not in movies:
+            continue
+        source = {"title": movies[id].get("title")} if slim else movies[id]
+        for target_id, similarity in neighbours[id]:
+            if target_id not in movies:
+                continue
+            target = movies[target_id]
+            result.append(
+                {
+                    "source_id": id,
+                    "source": source,
+                    "target_id": target_id,
+                    "target": display_projection(target) if slim else target,
+                    "similarity": similarity,
+                }
+            )
+    return result
+
+
+def cast_bio_similarity(id, k=5):
+    """
+    Movies featuring people similar to this movie's cast and directors
+    For every cast member, looks up the CAST_SIMILAR_PEOPLE most similar people on the personBio vector index
+    (leaving out anyone who worked on the source movie), then ranks their other movies by the best person match
+    Same rows as plot_embedding_similarity_genre
+    """
     query = """
     MATCH (source:Movie)
     WHERE elementId(source) = $id
-    WITH source, source.plotEmbedding AS sourceVec
-    MATCH (target:Movie)-[:IN_GENRE]->(g:Genre)<-[:IN_GENRE]-(source)
-    WHERE target.plotEmbedding IS NOT NULL
-    WITH source, target, g, gds.similarity.cosine(sourceVec, target.plotEmbedding) AS similarity
-    RETURN DISTINCT elementId(source) as source_id, source, elementId(target) as target_id, target, similarity
+    MATCH (source)<-[:ACTED_IN|DIRECTED]-(cast:Person)
+    WHERE cast.bioEmbedding IS NOT NULL
+    CALL db.index.vector.queryNodes('personBio', $people, cast.bioEmbedding)
+    YIELD node AS similar, score
+    WHERE NOT (similar)-[:ACTED_IN|DIRECTED]->(source)
+    MATCH (similar)-[:ACTED_IN|DIRECTED]->(target:Movie)
+    WHERE target <> source
+    WITH source, target, max(2 * score - 1) AS similarity
+    RETURN elementId(source) as source_id, source, elementId(target) as target_id, target, similarity
     ORDER BY similarity DESC
-    LIMIT 5
+    LIMIT $k
     """
-    result = run_cypher(NEO4J_DRIVER, query, {"id": id})
+    parameters = {"id": id, "k": k, "people": CAST_SIMILAR_PEOPLE + 1}
+    result = run_cypher(get_driver(), query, parameters)
     return result
@@ -1,36 +1,27 @@
 import os
-from dotenv import load_dotenv
-import logging
-from functions.connections import NEO4J_DRIVER
+import time
+import argparse
+from functions.connections import get_driver
+from functions.helper_functions.query_cache import invalidate_query_cache
+from functions.embedding_ingest import (
+    EMBEDDINGS_DIR,
+    EMBEDDING_FILES,
+    ingest_embedding_file,
+    clear_checkpoints,
+)
+from functions.helper_functions.logging_config import get_logger
 
-# Load environment variables
-load_dotenv(".env")
-
-# Configure logging
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# Create console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-# Create file handler
-log_file_path = os.getenv("DATA_PREPARATION_LOG_FILE_PATH", "app.log")
-file_handler = logging.FileHandler(log_file_path)
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+logger = get_logger(__name__, "DATA_PREPARATION_LOG_FILE_PATH")
 
 
 def pre_created_embeddings_load(force=False):
     """
     Loads embeddings from CSV files into the Neo4j database and creates vector indexes.
+    Files mirrored into EMBEDDINGS_DIR are loaded in parallel, checkpointed batches, so a failed run resumes
+    where it stopped; missing files fall back to LOAD CSV from data.neo4j.com.
     """
     if force is False:
-        with NEO4J_DRIVER.session() as session:
+        with get_driver().session() as session:
             result = session.run("SHOW INDEXES")
             indexes = [record["name"] for record in result]
             if (
@@ -40,7 +31,8 @@ def pre_created_embeddings_load(force=False):
             ):
                 logger.info("Embeddings already loaded and indexes created.")
                 return True
-    queries = {
+    # fallback used when a file has not been mirrored locally into EMBEDDINGS_DIR
+    remote_load_queries = {
         "bio_embedding": """
         LOAD CSV WITH HEADERS
         FROM 'https://data.neo4j.com/rec-embed/person-bio-embeddings.csv'
@@ -61,6 +53,9 @@ def pre_created_embeddings_load(force=False):
         MATCH (m:Movie {movieId: row.movieId})
         CALL db.create.setNodeVectorProperty(m, 'posterEmbedding', apoc.convert.fromJsonList(row.posterEmbedding))
         """,
+    }
+    # vector indexes are only built once every embedding is loaded
+    index_queries = {
         "person_bio_index": """
         CREATE VECTOR INDEX personBio IF NOT EXISTS
         FOR (p:Person)
@@ -95,56 +90,163 @@ def pre_created_embeddings_load(force=False):
     }
 
     try:
-        with NEO4J_DRIVER.session() as session:
-            for key, query in queries.items():
+        for key, spec in EMBEDDING_FILES.items():
+            path = os.path.join(EMBEDDINGS_DIR, spec["file"])
+            if os.path.exists(path):
+                logger.debug(f"Loading {key} from {path}")
+                ingest_embedding_file(key, path, spec)
+            else:
+                logger.warning(f"{path} not found, loading {key} with LOAD CSV")
+                with get_driver().session() as session:
+                    session.run(remote_load_queries[key]).consume()
+        with get_driver().session() as session:
+            for key, query in index_queries.items():
                 logger.debug(f"Running query: {key}")
                 session.run(query)
+        clear_checkpoints()
+        invalidate_query_cache()
         logger.info("Embeddings loaded and indexes created successfully.")
         return True
     except Exception as e:
+        # some of the queries may have committed before the failure
+        invalidate_query_cache()
         logger.error(f"Error in pre_created_embeddings_load: {e}")
         return False
 
 
-def drop_missing():
+# drop_missing rules, a node matching any rule of its label is deleted
+MOVIE_DROP_RULES = {
+    "plot_drop": "n.plotEmbedding IS NULL OR size(n.plotEmbedding) <> 1536",
+    "poster_drop": "n.posterEmbedding IS NULL OR size(n.posterEmbedding) <> 512",
+    "year_drop": "n.year IS NULL",
+    "imdbRating_drop": "n.imdbRating IS NULL",
+}
+PERSON_DROP_RULES = {
+    "bio_drop": "n.bioEmbedding IS NULL OR size(n.bioEmbedding) <> 1536",
+}
+DROP_RULES = {"Movie": MOVIE_DROP_RULES, "Person": PERSON_DROP_RULES}
+DROP_BATCH_SIZE = int(os.getenv("DROP_MISSING_BATCH_SIZE", "1000"))
+
+
+def _any_rule(rules):
+    return " OR ".join(f"({predicate})" for predicate in rules.values())
+
+
+def count_missing():
     """
-    Drops nodes that do not have embeddings of the correct dimensions.
+    Dry run of drop_missing, one scan per label evaluating every rule
+    Returns {rule: nodes matching it, ..., "Movie": movies to delete, "Person": people to delete},
+    a node matching several rules is counted once per rule but once in its label total
     """
-    queries = {
-        "plot_drop": """
-        MATCH (m:Movie)
-        WHERE m.plotEmbedding IS NULL OR size(m.plotEmbedding) <> 1536
-        DETACH DELETE m
-        """,
-        "bio_drop": """
-        MATCH (p:Person)
-        WHERE p.bioEmbedding IS NULL OR size(p.bioEmbedding) <> 1536
-        DETACH DELETE p
-        """,
-        "poster_drop": """
-        MATCH (m:Movie)
-        WHERE m.posterEmbedding IS NULL OR size(m.posterEmbedding) <> 512
-        DETACH DELETE m
-        """,
-        "year_drop": """
-        MATCH (m:Movie)
-        WHERE m.year IS NULL
-        DETACH DELETE m
-        """,
-        "imdbRating_drop": """
-        MATCH (m:Movie)
-        WHERE m.imdbRating IS NULL
-        DETACH DELETE m
-        """,
-    }
+    counts = {}
+    for label, rules in DROP_RULES.items():
+        sums = ", ".join(
+            f"sum(CASE WHEN {predicate} THEN 1 ELSE 0 END) AS {rule}"
+            for rule, predicate in rules.items()
+        )
+        query = f"""
+        MATCH (n:{label})
+        RETURN {sums}, sum(CASE WHEN {_any_rule(rules)} THEN 1 ELSE 0 END) AS total
+        """
+        with get_driver().session() as session:
+            record = session.run(query).single()
+        counts.update({rule: record[rule] for rule in rules})
+        counts[label] = record["total"]
+    return counts
+
+
+def drop_missing(dry_run=False, batch_size=DROP_BATCH_SIZE):
+    """
+    Drops nodes that do not have embeddings of the correct dimensions, or miss year / imdbRating.
+    Every rule of a label is checked in one scan and matching nodes are deleted in
+    CALL { } IN TRANSACTIONS batches of batch_size, so no single transaction holds the whole delete.
+    dry_run=True deletes nothing and returns the per-rule counts of count_missing.
+    """
+    if dry_run:
+        counts = count_missing()
+        logger.info(f"drop_missing dry run: {counts}")
+        return counts
 
     try:
-        with NEO4J_DRIVER.session() as session:
-            for key, query in queries.items():
-                logger.debug(f"Running query: {key}")
-                session.run(query)
+        for label, rules in DROP_RULES.items():
+            # CALL { } IN TRANSACTIONS must run in an auto-commit transaction, hence session.run
+            query = f"""
+            MATCH (n:{label})
+            WHERE {_any_rule(rules)}
+            CALL {{
+                WITH n
+                DETACH DELETE n
+            }} IN TRANSACTIONS OF $batch_size ROWS
+            RETURN count(*) AS deleted
+            """
+            logger.debug(f"Dropping {label} nodes matching {', '.join(rules)}")
+            start = time.perf_counter()
+            with get_driver().session() as session:
+                deleted = session.run(query, batch_size=batch_size).single()["deleted"]
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"Dropped {deleted} {label} nodes in {elapsed:.1f} s ({deleted / max(elapsed, 1e-9):.0f} nodes/sec)"
+            )
+        invalidate_query_cache()
         logger.info("Nodes with missing or incorrect embeddings dropped successfully.")
         return True
     except Exception as e:
+        # the batches committed before the failure stay deleted
+        invalidate_query_cache()
         logger.error(f"Error in drop_missing: {e}")
         return False
+
+
+# indexes behind the paginated catalogue of functions.general: the keyset order and the title search
+CATALOGUE_INDEX_QUERIES = {
+    "movie_votes_index": """
+    CREATE INDEX movieVotes IF NOT EXISTS
+    FOR (m:Movie)
+    ON (m.imdbVotes)
+    """,
+    "movie_titles_index": """
+    CREATE FULLTEXT INDEX movieTitles IF NOT EXISTS
+    FOR (m:Movie)
+    ON EACH [m.title]
+    """,
+    "rated_timestamp_index": """
+    CREATE INDEX ratedTimestamp IF NOT EXISTS
+    FOR ()-[r:RATED]-()
+    ON (r.timestamp)
+    """,
+}
+
+
+def create_catalogue_indexes():
+    """
+    Creates the range and full-text indexes of the paginated catalogue and the title search query,
+    and the RATED timestamp index the co-rating refresh seeks its new edges with
+    """
+    try:
+        with get_driver().session() as session:
+            for key, query in CATALOGUE_INDEX_QUERIES.items():
+                logger.debug(f"Running query: {key}")
+                session.run(query).consume()
+        logger.info("Catalogue indexes created successfully.")
+        return True
+    except Exception as e:
+        logger.error(f"Error in create_catalogue_indexes: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graph data preparation")
+    parser.add_argument("command", choices=["drop-missing"])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only count the nodes each rule matches"
+    )
+    parser.add_argument("--batch-size", type=int, default=DROP_BATCH_SIZE)
+    args = parser.parse_args()
+    result = drop_missing(dry_run=args.dry_run, batch_size=args.batch_size)
+    if args.dry_run:
+        for name, count in result.items():
+            print(f"{name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
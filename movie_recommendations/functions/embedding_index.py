@@ -0,0 +1,208 @@
+from functions.connections import get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import run_cypher
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.embedding_store import open_embedding_store, STORE_SPECS
+from functions.helper_functions.logging_config import get_logger
+import threading
+import numpy as np
+
+logger = get_logger(__name__, "EMBEDDING_INDEX_LOG_FILE_PATH")
+
+
+class EmbeddingIndex:
+    """
+    In-process cosine index over one Movie embedding property.
+    Vectors are held as a contiguous, L2-normalized float32 matrix (one row per movie),
+    alongside a genre -> row bitmap so a same-genre query is one masked mat-vec product.
+    When built from the embedding store the matrix is the raw memory-mapped file instead,
+    and scores are divided by the stored row norms so nothing is copied.
+    """
+
+    def __init__(self, ids, vectors, genres, norms=None):
+        """
+        ids: element ids of the movies, one per row
+        vectors: embeddings, one per row
+        genres: list of genre ids per row
+        norms: L2 norm of each row, when given vectors are used as-is (e.g. a memory-mapped array)
+        """
+        self.ids = list(ids)
+        self.row_of = {movie_id: row for row, movie_id in enumerate(self.ids)}
+
+        if norms is None:
+            matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1)
+            # gds.similarity.cosine returns 0 for a zero vector, keep those rows at 0
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms[:, None]
+            self.inv_norms = None
+        else:
+            norms = np.asarray(norms, dtype=np.float32).copy()
+            norms[norms == 0] = 1.0
+            self.matrix = vectors
+            self.inv_norms = 1.0 / norms
+
+        self.genre_ids = sorted(
+            {genre for row_genres in genres for genre in row_genres}
+        )
+        genre_row = {genre: i for i, genre in enumerate(self.genre_ids)}
+        self.genre_bitmap = np.zeros((len(self.genre_ids), len(self.ids)), dtype=bool)
+        self.row_genres = []
+        for row, row_genres in enumerate(genres):
+            genre_rows = [genre_row[genre] for genre in row_genres]
+            self.genre_bitmap[genre_rows, row] = True
+            self.row_genres.append(genre_rows)
+
+    def unit_vectors(self, rows):
+        """
+        L2-normalized float32 copies of the given rows
+        """
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32)
+        if self.inv_norms is not None:
+            vectors = vectors * self.inv_norms[rows, None]
+        return vectors
+
+    def cosine_scores(self, queries, block_size=4096):
+        """
+        Cosine similarity of every row against each unit query vector, shape (queries, rows)
+        float16 matrices are scored block by block so only one float32 block is materialised at a time
+        """
+        if self.matrix.dtype == np.float32:
+            scores = queries @ self.matrix.T
+        else:
+            scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+            for start in range(0, len(self.ids), block_size):
+                block = np.asarray(
+                    self.matrix[start : start + block_size], dtype=np.float32
+                )
+                scores[:, start : start + block_size] = queries @ block.T
+        if self.inv_norms is not None:
+            scores *= self.inv_norms
+        return scores
+
+    def __len__(self):
+        return len(self.ids)
+
+    def same_genre_mask(self, row):
+        """
+        Rows sharing at least one genre with the given row, excluding the row itself
+        """
+        mask = self.genre_bitmap[self.row_genres[row]].any(axis=0)
+        mask[row] = False
+        return mask
+
+    def top_k_same_genre(self, id, k=5):
+        """
+        Returns [(target_id, similarity), ...] for the k most similar movies sharing a genre with id,
+        ordered by similarity descending
+        """
+        row = self.row_of.get(id)
+        if row is None or k <= 0:
+            return []
+        mask = self.same_genre_mask(row)
+        candidates = int(mask.sum())
+        if candidates == 0:
+            return []
+        scores = self.cosine_scores(self.unit_vectors([row]))[0]
+        scores = np.where(mask, scores, -np.inf)
+        k = min(k, candidates)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def top_k_same_genre_batch(self, ids, k=5):
+        """
+        Batched top_k_same_genre, scoring every seed with one matrix-matrix product
+        Returns {source_id: [(target_id, similarity), ...]}, unknown ids are skipped
+        """
+        seeds = [
+            (id, self.row_of[id]) for id in dict.fromkeys(ids) if id in self.row_of
+        ]
+        if not seeds or k <= 0:
+            return {}
+        rows = [row for _, row in seeds]
+        masks = np.stack([self.same_genre_mask(row) for row in rows])
+        scores = np.where(masks, self.cosine_scores(self.unit_vectors(rows)), -np.inf)
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        result = {}
+        for i, (id, _) in enumerate(seeds):
+            row_top = top[i][np.argsort(-scores[i, top[i]], kind="stable")]
+            # seeds with fewer than k same-genre movies pick up masked rows, drop them
+            result[id] = [
+                (self.ids[j], float(scores[i, j])) for j in row_top if masks[i, j]
+            ]
+        return result
+
+
+def load_embedding_index(name):
+    """
+    Builds the EmbeddingIndex of one embedding store (plot or poster) from the memory-mapped store
+    when it has been exported, otherwise pulls every embedding and the movie's genres out of Neo4j
+    """
+    store = open_embedding_store(name)
+    if store is not None:
+        index = EmbeddingIndex(
+            store.ids, store.vectors, store.genres, norms=store.norms
+        )
+        index.store = store
+        logger.info(
+            f"{name} embedding index mapped from the store with {len(index)} movies"
+        )
+        return index
+    if RECSYS_BACKEND == "local":
+        raise FileNotFoundError(
+            f"The local backend needs the {name} embedding store, export it with functions.local_graph"
+        )
+
+    prop = STORE_SPECS[name]["property"]
+    query = f"""
+    MATCH (m:Movie)
+    WHERE m.{prop} IS NOT NULL
+    OPTIONAL MATCH (m)-[:IN_GENRE]->(g:Genre)
+    // aggregate first, grouping on the embedding would hash every vector
+    WITH m, collect(elementId(g)) AS genres
+    RETURN elementId(m) AS id, m.{prop} AS embedding, genres
+    """
+    logger.info(f"Loading {name} embeddings into the in-process index")
+    ids, vectors, genres = [], [], []
+    for row in run_cypher(get_driver(), query, stream=True):
+        ids.append(row["id"])
+        vectors.append(row["embedding"])
+        genres.append(row["genres"])
+    index = EmbeddingIndex(ids, vectors, genres)
+    index.store = None
+    logger.info(f"{name} embedding index loaded with {len(index)} movies")
+    return index
+
+
+def load_plot_index():
+    return load_embedding_index("plot")
+
+
+_plot_index = None
+_plot_index_lock = threading.Lock()
+
+
+def get_plot_index(refresh=False):
+    """
+    Returns the process-wide plot embedding index, loading it on first use
+    """
+    global _plot_index
+    with _plot_index_lock:
+        if _plot_index is None or refresh:
+            _plot_index = load_plot_index()
+        return _plot_index
+
+
+def reset_plot_index():
+    """
+    Drops the loaded plot embedding index, the next query reloads it from the graph
+    """
+    global _plot_index
+    with _plot_index_lock:
+        _plot_index = None
+
+
+# the index is derived from the graph, so drop it whenever the graph is mutated
+QUERY_CACHE.add_invalidation_listener(reset_plot_index)
@@ -0,0 +1,167 @@
+import os
+import csv
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functions.connections import get_driver
+from functions.helper_functions.cypher import QueryExecutor
+from functions.helper_functions.logging_config import get_logger
+
+logger = get_logger(__name__, "DATA_PREPARATION_LOG_FILE_PATH")
+
+# local mirror of https://data.neo4j.com/rec-embed/
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "data/embeddings")
+CHECKPOINT_DIR = os.getenv(
+    "EMBEDDINGS_CHECKPOINT_DIR", os.path.join(EMBEDDINGS_DIR, "checkpoints")
+)
+INGEST_CHUNK_SIZE = int(os.getenv("EMBEDDINGS_INGEST_CHUNK_SIZE", "500"))
+INGEST_WORKERS = int(os.getenv("EMBEDDINGS_INGEST_WORKERS", "4"))
+
+# one embedding vector per row is far larger than the csv module's default field limit
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+EMBEDDING_FILES = {
+    "bio_embedding": {
+        "file": "person-bio-embeddings.csv",
+        "key_column": "tmdbId",
+        "embedding_column": "bio_embedding",
+        "query": """
+        UNWIND $rows AS row
+        MATCH (p:Person {tmdbId: row.key})
+        CALL db.create.setNodeVectorProperty(p, 'bioEmbedding', row.embedding)
+        """,
+    },
+    "plot_embedding": {
+        "file": "movie-plot-embeddings.csv",
+        "key_column": "movieId",
+        "embedding_column": "embedding",
+        "query": """
+        UNWIND $rows AS row
+        MATCH (m:Movie {movieId: row.key})
+        CALL db.create.setNodeVectorProperty(m, 'plotEmbedding', row.embedding)
+        """,
+    },
+    "poster_embedding": {
+        "file": "movie-poster-embeddings.csv",
+        "key_column": "movieId",
+        "embedding_column": "posterEmbedding",
+        "query": """
+        UNWIND $rows AS row
+        MATCH (m:Movie {movieId: row.key})
+        CALL db.create.setNodeVectorProperty(m, 'posterEmbedding', row.embedding)
+        """,
+    },
+}
+
+
+def read_embedding_chunks(path, key_column, embedding_column, chunk_size):
+    """
+    Streams an embedding CSV as (chunk number, rows) without reading the whole file,
+    each row is {"key": ..., "embedding": [floats]}
+    """
+    with open(path, newline="") as f:
+        chunk = []
+        chunk_number = 0
+        for row in csv.DictReader(f):
+            chunk.append(
+                {
+                    "key": row[key_column],
+                    "embedding": json.loads(row[embedding_column]),
+                }
+            )
+            if len(chunk) == chunk_size:
+                yield chunk_number, chunk
+                chunk = []
+                chunk_number += 1
+        if chunk:
+            yield chunk_number, chunk
+
+
+def checkpoint_path(name):
+    return os.path.join(CHECKPOINT_DIR, f"{name}.json")
+
+
+def load_checkpoint(name, chunk_size):
+    """
+    Chunk numbers already written for this file, empty if there is no checkpoint
+    or it was recorded with a different chunk size
+    """
+    path = checkpoint_path(name)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("chunk_size") != chunk_size:
+        logger.warning(f"Ignoring {name} checkpoint recorded with another chunk size")
+        return set()
+    return set(checkpoint["done"])
+
+
+def save_checkpoint(name, chunk_size, done):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = checkpoint_path(name)
+    # write then rename, so a crash mid-write never leaves a corrupt checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump({"chunk_size": chunk_size, "done": sorted(done)}, f)
+    os.replace(path + ".tmp", path)
+
+
+def clear_checkpoints():
+    for name in EMBEDDING_FILES:
+        path = checkpoint_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def ingest_embedding_file(
+    name, path, spec, chunk_size=INGEST_CHUNK_SIZE, workers=INGEST_WORKERS
+):
+    """
+    Writes one embedding CSV into Neo4j as UNWIND $rows batches across a thread pool.
+    Every finished chunk is checkpointed, so a rerun skips the chunks already written.
+    Returns the number of rows written in this run.
+    """
+    executor = QueryExecutor(get_driver())
+    done = load_checkpoint(name, chunk_size)
+    lock = threading.Lock()
+    written = 0
+    start = time.perf_counter()
+
+    def write_chunk(chunk_number, rows):
+        executor.write(spec["query"], {"rows": rows})
+        return chunk_number, len(rows)
+
+    def record(future):
+        nonlocal written
+        chunk_number, count = future.result()
+        with lock:
+            done.add(chunk_number)
+            written += count
+            save_checkpoint(name, chunk_size, done)
+
+    if done:
+        logger.info(f"Resuming {name}, {len(done)} chunks already written")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        chunks = read_embedding_chunks(
+            path, spec["key_column"], spec["embedding_column"], chunk_size
+        )
+        for chunk_number, rows in chunks:
+            if chunk_number in done:
+                continue
+            # bound the chunks held in memory to a couple per worker
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future)
+            pending.add(pool.submit(write_chunk, chunk_number, rows))
+        for future in wait(pending).done:
+            record(future)
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Loaded {written} {name} rows in {elapsed:.1f} s ({written / max(elapsed, 1e-9):.0f} rows/sec)"
+    )
+    return written
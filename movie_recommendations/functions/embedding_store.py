@@ -0,0 +1,219 @@
+from functions.connections import get_driver
+from functions.helper_functions.cypher import run_cypher, QueryExecutor
+from functions.helper_functions.logging_config import get_logger
+import os
+import json
+import argparse
+import numpy as np
+
+logger = get_logger(__name__, "EMBEDDING_STORE_LOG_FILE_PATH")
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "data/embedding_store")
+
+# key_property is the natural key used to write the vectors back, element ids change between databases
+STORE_SPECS = {
+    "plot": {
+        "label": "Movie",
+        "property": "plotEmbedding",
+        "key_property": "movieId",
+        "dimensions": 1536,
+        "with_genres": True,
+    },
+    "poster": {
+        "label": "Movie",
+        "property": "posterEmbedding",
+        "key_property": "movieId",
+        "dimensions": 512,
+        "with_genres": True,
+    },
+    "bio": {
+        "label": "Person",
+        "property": "bioEmbedding",
+        "key_property": "tmdbId",
+        "dimensions": 1536,
+        "with_genres": False,
+    },
+}
+
+
+def store_paths(name, directory=EMBEDDING_STORE_DIR):
+    return {
+        "vectors": os.path.join(directory, f"{name}.npy"),
+        "norms": os.path.join(directory, f"{name}.norms.npy"),
+        "ids": os.path.join(directory, f"{name}.ids.json"),
+    }
+
+
+class EmbeddingStore:
+    """
+    One embedding property exported to a memory-mapped .npy file plus its id map.
+    vectors is opened read-only with mmap_mode="r", so every process reading the same file
+    shares the OS page cache instead of holding its own copy.
+    """
+
+    def __init__(self, name, vectors, norms, ids, keys, genres=None):
+        self.name = name
+        self.vectors = vectors
+        self.norms = norms
+        self.ids = ids
+        self.keys = keys
+        self.genres = genres
+        self.row_of = {id: row for row, id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vector(self, id):
+        """
+        Zero-copy view of one node's vector, None if the node is not in the store
+        """
+        row = self.row_of.get(id)
+        if row is None:
+            return None
+        return self.vectors[row]
+
+
+def open_embedding_store(name, directory=EMBEDDING_STORE_DIR):
+    """
+    Opens an exported store, returns None if it has not been exported yet
+    """
+    paths = store_paths(name, directory)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    with open(paths["ids"]) as f:
+        id_map = json.load(f)
+    return EmbeddingStore(
+        name,
+        np.load(paths["vectors"], mmap_mode="r"),
+        np.load(paths["norms"]),
+        id_map["ids"],
+        id_map["keys"],
+        id_map.get("genres"),
+    )
+
+
+def export_embeddings(name, dtype="float32", directory=EMBEDDING_STORE_DIR):
+    """
+    Streams one embedding property out of Neo4j into <name>.npy (float32 or float16),
+    with the row norms in <name>.norms.npy and element ids / natural keys in <name>.ids.json
+    """
+    spec = STORE_SPECS[name]
+    label, prop = spec["label"], spec["property"]
+    count_query = f"""
+    MATCH (n:{label})
+    WHERE n.{prop} IS NOT NULL
+    RETURN count(n) AS count
+    """
+    # genres are aggregated before the embedding is read, so the rows are never grouped on the vector
+    genres = (
+        "OPTIONAL MATCH (n)-[:IN_GENRE]->(g:Genre)\n    WITH n, collect(elementId(g)) AS genres"
+        if spec["with_genres"]
+        else "WITH n, [] AS genres"
+    )
+    export_query = f"""
+    MATCH (n:{label})
+    WHERE n.{prop} IS NOT NULL
+    {genres}
+    RETURN elementId(n) AS id, n.{spec["key_property"]} AS key, n.{prop} AS embedding, genres
+    """
+    count = run_cypher(get_driver(), count_query)[0]["count"]
+    os.makedirs(directory, exist_ok=True)
+    paths = store_paths(name, directory)
+
+    vectors = np.lib.format.open_memmap(
+        paths["vectors"] + ".tmp",
+        mode="w+",
+        dtype=np.dtype(dtype),
+        shape=(count, spec["dimensions"]),
+    )
+    norms = np.zeros(count, dtype=np.float32)
+    ids, keys, row_genres = [], [], []
+    for row in run_cypher(get_driver(), export_query, stream=True):
+        i = len(ids)
+        if i == count:
+            logger.warning(f"{name} gained nodes during the export, they are skipped")
+            break
+        embedding = np.asarray(row["embedding"], dtype=np.float32)
+        vectors[i] = embedding
+        norms[i] = np.linalg.norm(embedding)
+        ids.append(row["id"])
+        keys.append(row["key"])
+        row_genres.append(row["genres"])
+    vectors.flush()
+    del vectors
+
+    if len(ids) < count:
+        # nodes were deleted during the export, trim the unused rows
+        logger.warning(f"{name} lost nodes during the export, trimming the store")
+        full = np.load(paths["vectors"] + ".tmp", mmap_mode="r")
+        np.save(paths["vectors"] + ".trim", full[: len(ids)])
+        del full
+        os.replace(paths["vectors"] + ".trim.npy", paths["vectors"] + ".tmp")
+        norms = norms[: len(ids)]
+
+    id_map = {"ids": ids, "keys": keys, "key_property": spec["key_property"]}
+    if spec["with_genres"]:
+        id_map["genres"] = row_genres
+    # every file is written to .tmp first and renamed, a reader never sees a half-written file,
+    # the vectors go last so the new ids and norms are in place once they are
+    with open(paths["ids"] + ".tmp", "w") as f:
+        json.dump(id_map, f)
+    with open(paths["norms"] + ".tmp", "wb") as f:
+        np.save(f, norms)
+    for part in ["ids", "norms", "vectors"]:
+        os.replace(paths[part] + ".tmp", paths[part])
+    logger.info(f"Exported {len(ids)} {name} embeddings as {dtype} to {directory}")
+    return len(ids)
+
+
+def import_embeddings(name, directory=EMBEDDING_STORE_DIR, batch_size=500):
+    """
+    Writes an exported store back into Neo4j, matching nodes on their natural key
+    """
+    spec = STORE_SPECS[name]
+    store = open_embedding_store(name, directory)
+    if store is None:
+        raise FileNotFoundError(f"No {name} embedding store in {directory}")
+    query = f"""
+    UNWIND $rows AS row
+    MATCH (n:{spec["label"]} {{{spec["key_property"]}: row.key}})
+    CALL db.create.setNodeVectorProperty(n, '{spec["property"]}', row.embedding)
+    """
+    executor = QueryExecutor(get_driver())
+    for start in range(0, len(store), batch_size):
+        rows = [
+            {"key": key, "embedding": vector.astype(np.float32).tolist()}
+            for key, vector in zip(
+                store.keys[start : start + batch_size],
+                store.vectors[start : start + batch_size],
+            )
+        ]
+        executor.write(query, {"rows": rows})
+    logger.info(f"Imported {len(store)} {name} embeddings from {directory}")
+    return len(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export / import embeddings to memory-mapped .npy files"
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument(
+        "names", nargs="*", help=f"any of {', '.join(STORE_SPECS)}, defaults to all"
+    )
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--dir", default=EMBEDDING_STORE_DIR)
+    args = parser.parse_args()
+    unknown = set(args.names) - set(STORE_SPECS)
+    if unknown:
+        parser.error(f"unknown embeddings: {', '.join(sorted(unknown))}")
+
+    for name in args.names or list(STORE_SPECS):
+        if args.command == "export":
+            export_embeddings(name, args.dtype, args.dir)
+        else:
+            import_embeddings(name, args.dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,369 @@
-from functions.connections import NEO4J_DRIVER
+from functions.connections import get_driver, RECSYS_BACKEND
 from functions.helper_functions.cypher import run_cypher
+from functions.helper_functions.query_cache import cached_run_cypher
+from functions.local_graph import get_local_graph, title_words
+from functions.helper_functions.logging_config import get_logger
 import os
-from dotenv import load_dotenv
+import pandas as pd
 
-print(load_dotenv(".env"))
+logger = get_logger(__name__, "GENERAL_QUERY_LOG_FILE_PATH")
 
-import logging
+# movies per page of the paginated catalogue
+CATALOGUE_PAGE_SIZE = int(os.getenv("CATALOGUE_PAGE_SIZE", "200"))
+# titles returned by the title search
+TITLE_SEARCH_LIMIT = int(os.getenv("TITLE_SEARCH_LIMIT", "25"))
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-
-# add the console handler to the logger
-logger.addHandler(ch)
-
-log_file_path = os.getenv("GENERAL_QUERY_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
-
-logger.addHandler(fh)
+LIST_ALL_GENRES_QUERY = """
+MATCH (g:Genre)
+RETURN PROPERTIES(g) as Genre, elementID(g) as GenreID
+ORDER BY Genre.name
+"""
 
 
 def list_all_genres():
     """
     Listing all genres in the database
     """
-    query = """
-    MATCH (g:Genre)
-    RETURN PROPERTIES(g) as Genre, elementID(g) as GenreID
-    ORDER BY Genre.name
-    """
+    if RECSYS_BACKEND == "local":
+        return get_local_graph().list_all_genres()
     parameters = {}
-    data = run_cypher(NEO4J_DRIVER, query, parameters)
+    data = cached_run_cypher(get_driver(), LIST_ALL_GENRES_QUERY, parameters)
     return data
 
 
+LIST_ALL_MOVIES_QUERY = """
+MATCH (m:Movie)
+RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID
+ORDER BY m.title, m.released
+"""
+
+
 def list_all_movies():
     """
     Listing all movies in the database
     """
-    query = """
-    MATCH (m:Movie)
-    RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID
-    ORDER BY m.title, m.released
-    """
+    if RECSYS_BACKEND == "local":
+        return get_local_graph().list_all_movies()
     parameters = {}
-    data = run_cypher(NEO4J_DRIVER, query, parameters)
+    data = cached_run_cypher(get_driver(), LIST_ALL_MOVIES_QUERY, parameters)
     return data
 
 
+SEARCH_MOVIES_BASED_GENRES_QUERY = """
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre)
+WHERE g.name IN $genres
+RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID, g.name as Genre, elementID(g) as GenreID, ID(g) as GenreNeo4jID
+ORDER BY m.title, m.released
+"""
+
+
 def search_movies_based_genres(genres):
     """
     Listing all movies based on genres
     """
     logger.debug(f"Searching Movies based on Genres: {genres}")
-    query = """
-    MATCH (m:Movie)-[:IN_GENRE]->(g:Genre)
-    WHERE g.name IN $genres
-    RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID, g.name as Genre, elementID(g) as GenreID, ID(g) as GenreNeo4jID
-    ORDER BY m.title, m.released
-    """
-    parameters = {"genres": genres}
-    data = run_cypher(NEO4J_DRIVER, query, parameters)
+    if RECSYS_BACKEND == "local":
+        return get_local_graph().search_movies_based_genres(genres)
+    # IN ignores order and duplicates, so normalize the list to share one cache entry
+    parameters = {"genres": sorted(set(genres))}
+    data = cached_run_cypher(get_driver(), SEARCH_MOVIES_BASED_GENRES_QUERY, parameters)
     logger.info("Search Movies based on Genres Completed")
     # logger.debug(f"Results from the query based on genres: {data}")
     return data
 
 
+DISPLAY_MOVIE_METADATA_QUERY = """
+MATCH (m:Movie)-[IN_GENRE]->(g:Genre)
+WHERE elementID(m) = $movie_id
+RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID, g.name as Genre, elementID(g) as GenreID, ID(g) as GenreNeo4jID
+"""
+
+
 def display_movie_metadata(movie_id):
     logger.debug(f"Displaying Movie Metadata for Movie ID: {movie_id}")
-    query = """
-    MATCH (m:Movie)-[IN_GENRE]->(g:Genre)
-    WHERE elementID(m) = $movie_id
-    RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, elementID(m) as MovieID, ID(m) as MovieNeo4jID, g.name as Genre, elementID(g) as GenreID, ID(g) as GenreNeo4jID
-    """
+    if RECSYS_BACKEND == "local":
+        return get_local_graph().display_movie_metadata(movie_id)
     parameters = {"movie_id": movie_id}
-    data = run_cypher(NEO4J_DRIVER, query, parameters)
+    data = cached_run_cypher(get_driver(), DISPLAY_MOVIE_METADATA_QUERY, parameters)
     logger.info("Displaying Movie Metadata Completed")
     # logger.debug(f"Results from the query of movie metadata: {data}")
     return data
+
+
+def fetch_movies_query(include_embeddings=True):
+    if include_embeddings:
+        movie = "m"
+    else:
+        movie = 'apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding"])'
+    return f"""
+    UNWIND $ids AS id
+    MATCH (m:Movie)
+    WHERE elementId(m) = id
+    RETURN id, {movie} AS movie
+    """
+
+
+def fetch_movies_by_id(ids, include_embeddings=True):
+    """
+    Fetches Movie nodes for a list of element ids in one round trip, returns {id: movie}
+    include_embeddings=False leaves the embedding properties out of the returned maps
+    """
+    if RECSYS_BACKEND == "local":
+        # the local catalogue never holds embeddings, they are read from the embedding store
+        return get_local_graph().fetch_movies_by_id(ids)
+    query = fetch_movies_query(include_embeddings)
+    data = run_cypher(get_driver(), query, {"ids": list(ids)})
+    return {row["id"]: row["movie"] for row in data}
+
+
+# Movie properties shown by the UI pages, in display order
+DISPLAY_PROPERTIES = [
+    "title",
+    "released",
+    "imdbRating",
+    "imdbVotes",
+    "plot",
+    "runtime",
+    "languages",
+    "poster",
+    "url",
+]
+# Cypher map projection returning only the display properties of m
+MOVIE_DISPLAY_MAP = "m {" + ", ".join(f".{prop}" for prop in DISPLAY_PROPERTIES) + "}"
+MOVIE_DISPLAY_COLUMNS = ["Genre"] + [f"Movie.{prop}" for prop in DISPLAY_PROPERTIES]
+
+
+def display_projection(movie):
+    """
+    Trims a full movie map down to the display properties
+    """
+    return {prop: movie.get(prop) for prop in DISPLAY_PROPERTIES}
+
+
+def to_display_frame(data, columns):
+    """
+    Builds an Arrow-backed DataFrame straight from the query rows, keeping only the given columns
+    """
+    frame = pd.DataFrame.from_records(data, columns=columns)
+    return frame.convert_dtypes(dtype_backend="pyarrow")
+
+
+def _display_return(movie="m"):
+    # RETURN items for the display columns, aliased to the column names the pages show
+    return ", ".join(f"{movie}.{prop} AS `Movie.{prop}`" for prop in DISPLAY_PROPERTIES)
+
+
+SEARCH_MOVIES_BASED_GENRES_DISPLAY_QUERY = f"""
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre)
+WHERE g.name IN $genres
+WITH m, collect(g.name) AS genres
+RETURN apoc.text.join(genres, ", ") AS Genre, {_display_return()}
+ORDER BY m.imdbVotes IS NULL, m.imdbVotes DESC, elementId(m)
+"""
+
+
+def search_movies_based_genres_display(genres):
+    """
+    Movies in any of the genres, one row per movie with its matching genres joined, ordered by IMDb votes,
+    movies without votes last
+    Returns a DataFrame with MOVIE_DISPLAY_COLUMNS
+    """
+    parameters = {"genres": sorted(set(genres))}
+    if RECSYS_BACKEND == "local":
+        data = get_local_graph().search_movies_based_genres_display(
+            genres, DISPLAY_PROPERTIES
+        )
+    else:
+        data = cached_run_cypher(
+            get_driver(), SEARCH_MOVIES_BASED_GENRES_DISPLAY_QUERY, parameters
+        )
+    return to_display_frame(data, MOVIE_DISPLAY_COLUMNS)
+
+
+DISPLAY_MOVIE_METADATA_DISPLAY_QUERY = f"""
+MATCH (m:Movie)
+WHERE elementId(m) = $movie_id
+OPTIONAL MATCH (m)-[:IN_GENRE]->(g:Genre)
+WITH m, collect(g.name) AS genres
+RETURN apoc.text.join(genres, ", ") AS Genre, {_display_return()}
+"""
+
+
+def display_movie_metadata_display(movie_id):
+    """
+    One movie with all of its genres joined, as a one row DataFrame with MOVIE_DISPLAY_COLUMNS
+    """
+    if RECSYS_BACKEND == "local":
+        data = get_local_graph().display_movie_metadata_display(
+            movie_id, DISPLAY_PROPERTIES
+        )
+    else:
+        data = cached_run_cypher(
+            get_driver(), DISPLAY_MOVIE_METADATA_DISPLAY_QUERY, {"movie_id": movie_id}
+        )
+    return to_display_frame(data, MOVIE_DISPLAY_COLUMNS)
+
+
+MOVIE_BULK_DISPLAY_COLUMNS = ["MovieID"] + MOVIE_DISPLAY_COLUMNS
+DISPLAY_MOVIE_METADATA_BULK_QUERY = f"""
+UNWIND range(0, size($ids) - 1) AS position
+MATCH (m:Movie)
+WHERE elementId(m) = $ids[position]
+OPTIONAL MATCH (m)-[:IN_GENRE]->(g:Genre)
+WITH position, m, collect(g.name) AS genres
+RETURN elementId(m) AS MovieID, apoc.text.join(genres, ", ") AS Genre, {_display_return()}
+ORDER BY position
+"""
+
+
+def display_movie_metadata_bulk(ids):
+    """
+    display_movie_metadata_display for several movies in one round trip
+    Returns a DataFrame with MovieID and MOVIE_DISPLAY_COLUMNS, one row per movie in the order of ids
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return to_display_frame([], MOVIE_BULK_DISPLAY_COLUMNS)
+    if RECSYS_BACKEND == "local":
+        data = get_local_graph().display_movie_metadata_bulk(ids, DISPLAY_PROPERTIES)
+    else:
+        data = cached_run_cypher(
+            get_driver(), DISPLAY_MOVIE_METADATA_BULK_QUERY, {"ids": ids}
+        )
+    return to_display_frame(data, MOVIE_BULK_DISPLAY_COLUMNS)
+
+
+# Keyset pagination over (imdbVotes DESC, elementId ASC): a page starts right after the last row of the
+# previous one, seeking the movieVotes index instead of skipping rows, so deep pages cost the same as the first.
+# Movies without imdbVotes follow all the others, in elementId order.
+LIST_MOVIES_PAGE_QUERY = """
+MATCH (m:Movie)
+WHERE m.imdbVotes <= $after_votes
+WITH m, elementId(m) AS id
+WHERE m.imdbVotes < $after_votes OR id > $after_id
+RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, id as MovieID, ID(m) as MovieNeo4jID, m.imdbVotes as votes
+ORDER BY votes DESC, id ASC
+LIMIT $page_size
+"""
+
+LIST_UNVOTED_MOVIES_PAGE_QUERY = """
+MATCH (m:Movie)
+WHERE m.imdbVotes IS NULL
+WITH m, elementId(m) AS id
+WHERE id > $after_id
+RETURN apoc.map.removeKeys(m, ["plotEmbedding", "posterEmbedding", "fastRPEmbedding", "tmdbId", "movieId", "countries", "budget", "revenue"]) as Movie, id as MovieID, ID(m) as MovieNeo4jID, null as votes
+ORDER BY id ASC
+LIMIT $page_size
+"""
+
+
+def _movies_page(after, page_size):
+    # after = (votes, id), votes None once the voted movies are exhausted
+    # one row past the page is fetched, so the last page comes back without a cursor
+    # pages are not cached, a full scan would evict everything else from the query cache
+    after_votes, after_id = after if after is not None else (float("inf"), "")
+    rows = []
+    if after_votes is not None:
+        rows = run_cypher(
+            get_driver(),
+            LIST_MOVIES_PAGE_QUERY,
+            {
+                "after_votes": after_votes,
+                "after_id": after_id,
+                "page_size": page_size + 1,
+            },
+        )
+        after_id = ""
+    if len(rows) <= page_size:
+        rows = rows + run_cypher(
+            get_driver(),
+            LIST_UNVOTED_MOVIES_PAGE_QUERY,
+            {"after_id": after_id, "page_size": page_size + 1 - len(rows)},
+        )
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, (rows[-1]["votes"], rows[-1]["MovieID"])
+    return rows, None
+
+
+def list_movies_page(after=None, page_size=CATALOGUE_PAGE_SIZE):
+    """
+    One page of the catalogue ordered by IMDb votes, rows shaped like list_all_movies
+    after: the cursor returned with the previous page, None for the first page
+    Returns (rows, cursor), cursor is None after the last page
+    """
+    if RECSYS_BACKEND == "local":
+        return get_local_graph().list_movies_page(after, page_size)
+    rows, cursor = _movies_page(after, page_size)
+    return [
+        {
+            "Movie": row["Movie"],
+            "MovieID": row["MovieID"],
+            "MovieNeo4jID": row["MovieNeo4jID"],
+        }
+        for row in rows
+    ], cursor
+
+
+def iter_all_movies(page_size=CATALOGUE_PAGE_SIZE):
+    """
+    Every movie ordered by IMDb votes, one page at a time, so at most one page is held in memory
+    """
+    cursor = None
+    while True:
+        rows, cursor = list_movies_page(cursor, page_size)
+        yield from rows
+        if cursor is None:
+            return
+
+
+MOVIE_TITLE_COLUMNS = ["MovieID", "Movie.title", "Movie.imdbVotes"]
+
+# Neo4j sorts nulls first on DESC, movies without imdbVotes are moved last explicitly like LIST_MOVIES_PAGE_QUERY
+TOP_MOVIE_TITLES_QUERY = """
+MATCH (m:Movie)
+WITH m, elementId(m) AS id
+RETURN id AS MovieID, m.title AS `Movie.title`, m.imdbVotes AS `Movie.imdbVotes`
+ORDER BY m.imdbVotes IS NULL, m.imdbVotes DESC, id
+LIMIT $limit
+"""
+
+SEARCH_MOVIE_TITLES_QUERY = """
+CALL db.index.fulltext.queryNodes('movieTitles', $search, {limit: $limit})
+YIELD node AS m, score
+RETURN elementId(m) AS MovieID, m.title AS `Movie.title`, m.imdbVotes AS `Movie.imdbVotes`
+ORDER BY score DESC, m.imdbVotes DESC
+"""
+
+
+def lucene_title_query(terms):
+    """
+    Full-text query matching every term as a prefix, or within one edit for terms of 4 letters or more
+    e.g. ["godfater", "pa"] -> (godfater* OR godfater~1) AND pa*
+    """
+    clauses = [
+        f"({term}* OR {term}~1)" if len(term) >= 4 else f"{term}*" for term in terms
+    ]
+    return " AND ".join(clauses)
+
+
+def search_movie_titles(text, limit=TITLE_SEARCH_LIMIT):
+    """
+    Movies whose title matches the words of text by prefix or a typo, best match first then IMDb votes,
+    the most voted movies for an empty text
+    Backed by the movieTitles full-text index, or the n-gram title index of the local backend
+    Returns a DataFrame with MovieID, Movie.title and Movie.imdbVotes
+    """
+    terms = title_words(text)
+    if RECSYS_BACKEND == "local":
+        data = get_local_graph().search_movie_titles(terms, limit)
+    elif not terms:
+        data = cached_run_cypher(get_driver(), TOP_MOVIE_TITLES_QUERY, {"limit": limit})
+    else:
+        data = cached_run_cypher(
+            get_driver(),
+            SEARCH_MOVIE_TITLES_QUERY,
+            {"search": lucene_title_query(terms), "limit": limit},
+        )
+    return to_display_frame(data, MOVIE_TITLE_COLUMNS)
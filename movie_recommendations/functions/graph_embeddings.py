@@ -0,0 +1,219 @@
+from functions.connections import get_driver
+from functions.helper_functions.cypher import run_cypher, WRITE
+from functions.helper_functions.query_cache import invalidate_query_cache
+from functions.helper_functions.logging_config import get_logger
+import os
+import argparse
+import threading
+
+logger = get_logger(__name__, "EMBEDDING_INDEX_LOG_FILE_PATH")
+
+# name of the in-memory graph in the GDS catalog, projected once and reused by every job
+GDS_GRAPH_NAME = os.getenv("GDS_GRAPH_NAME", "recsys")
+FASTRP_DIMENSIONS = int(os.getenv("FASTRP_DIMENSIONS", "128"))
+FASTRP_PROPERTY = "fastRPEmbedding"
+FASTRP_INDEX = "movieStructure"
+# relationship written by gds.nodeSimilarity between movies rated by the same users
+NODE_SIMILARITY_RELATIONSHIP = "SIMILAR_RATERS"
+NODE_SIMILARITY_TOP_K = int(os.getenv("NODE_SIMILARITY_TOP_K", "20"))
+
+# User, Movie, Genre and Person nodes, every relationship undirected so the embeddings of a movie
+# mix in its raters, genres and cast from both sides
+# FastRP weighs by rating, GDS needs the weight on every projected type, the others count as 1.0
+PROJECTION_QUERY = """
+CALL gds.graph.project(
+  $graph,
+  ['User', 'Movie', 'Genre', 'Person'],
+  {
+    RATED: {orientation: 'UNDIRECTED', properties: {rating: {defaultValue: 1.0}}},
+    IN_GENRE: {orientation: 'UNDIRECTED', properties: {rating: {defaultValue: 1.0}}},
+    ACTED_IN: {orientation: 'UNDIRECTED', properties: {rating: {defaultValue: 1.0}}},
+    DIRECTED: {orientation: 'UNDIRECTED', properties: {rating: {defaultValue: 1.0}}}
+  }
+)
+YIELD graphName, nodeCount, relationshipCount
+RETURN graphName, nodeCount, relationshipCount
+"""
+
+_projected = False
+_projection_lock = threading.Lock()
+
+
+def graph_exists(graph=GDS_GRAPH_NAME):
+    query = "CALL gds.graph.exists($graph) YIELD exists RETURN exists"
+    return run_cypher(get_driver(), query, {"graph": graph})[0]["exists"]
+
+
+def drop_projection(graph=GDS_GRAPH_NAME):
+    global _projected
+    with _projection_lock:
+        run_cypher(
+            get_driver(),
+            "CALL gds.graph.drop($graph, false) YIELD graphName RETURN graphName",
+            {"graph": graph},
+            access_mode=WRITE,
+        )
+        _projected = False
+    logger.info(f"GDS projection {graph} dropped")
+
+
+def ensure_projection(graph=GDS_GRAPH_NAME, refresh=False):
+    """
+    Projects the graph into the GDS catalog unless a projection with that name already exists,
+    refresh=True drops it and projects again, after the graph has changed
+    Returns True when a new projection was made
+    """
+    global _projected
+    if refresh:
+        drop_projection(graph)
+    with _projection_lock:
+        # checked once per process, the catalog keeps the projection until it is dropped or the server restarts
+        if _projected and not refresh:
+            return False
+        if graph_exists(graph):
+            logger.info(f"Reusing the GDS projection {graph}")
+            _projected = True
+            return False
+        result = run_cypher(
+            get_driver(), PROJECTION_QUERY, {"graph": graph}, access_mode=WRITE
+        )[0]
+        _projected = True
+    logger.info(
+        f"Projected {graph}: {result['nodeCount']} nodes, {result['relationshipCount']} relationships"
+    )
+    return True
+
+
+def write_fastrp_embeddings(
+    graph=GDS_GRAPH_NAME, dimensions=FASTRP_DIMENSIONS, refresh=False, seed=42
+):
+    """
+    Computes FastRP embeddings over the whole projection, writes the Movie ones back as
+    fastRPEmbedding and (re)creates the movieStructure vector index over them
+    The embeddings are mutated into the projection first, so only Movie nodes are written
+    """
+    ensure_projection(graph, refresh)
+    # a previous run left the property in the projection, mutate refuses to overwrite it
+    run_cypher(
+        get_driver(),
+        """
+        CALL gds.graph.nodeProperties.drop($graph, [$property], {failIfMissing: false})
+        YIELD propertiesRemoved RETURN propertiesRemoved
+        """,
+        {"graph": graph, "property": FASTRP_PROPERTY},
+        access_mode=WRITE,
+    )
+    mutated = run_cypher(
+        get_driver(),
+        """
+        CALL gds.fastRP.mutate($graph, {
+          embeddingDimension: $dimensions,
+          iterationWeights: [0.0, 1.0, 1.0, 0.5],
+          normalizationStrength: -0.5,
+          relationshipWeightProperty: 'rating',
+          randomSeed: $seed,
+          mutateProperty: $property
+        })
+        YIELD nodePropertiesWritten, computeMillis
+        RETURN nodePropertiesWritten, computeMillis
+        """,
+        {
+            "graph": graph,
+            "dimensions": dimensions,
+            "seed": seed,
+            "property": FASTRP_PROPERTY,
+        },
+        access_mode=WRITE,
+    )[0]
+    written = run_cypher(
+        get_driver(),
+        """
+        CALL gds.graph.nodeProperties.write($graph, [$property], ['Movie'])
+        YIELD propertiesWritten
+        RETURN propertiesWritten
+        """,
+        {"graph": graph, "property": FASTRP_PROPERTY},
+        access_mode=WRITE,
+    )[0]
+    # index options take no parameters, and a changed dimension needs a new index
+    with get_driver().session() as session:
+        session.run(f"DROP INDEX {FASTRP_INDEX} IF EXISTS").consume()
+        session.run(f"""
+            CREATE VECTOR INDEX {FASTRP_INDEX} IF NOT EXISTS
+            FOR (m:Movie)
+            ON m.{FASTRP_PROPERTY}
+            OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {int(dimensions)},
+            `vector.similarity_function`: 'cosine'
+            }}}}
+            """).consume()
+    invalidate_query_cache()
+    logger.info(
+        f"FastRP computed in {mutated['computeMillis']} ms, {written['propertiesWritten']} movie embeddings written"
+    )
+    return written["propertiesWritten"]
+
+
+def write_node_similarity(
+    graph=GDS_GRAPH_NAME, top_k=NODE_SIMILARITY_TOP_K, refresh=False
+):
+    """
+    Writes the top_k most similar movies of every movie by the Jaccard overlap of their raters
+    as (:Movie)-[:SIMILAR_RATERS {score}]->(:Movie), replacing the previous ones
+    """
+    ensure_projection(graph, refresh)
+    # CALL { } IN TRANSACTIONS must run in an auto-commit transaction, hence session.run
+    with get_driver().session() as session:
+        session.run(f"""
+            MATCH ()-[s:{NODE_SIMILARITY_RELATIONSHIP}]->()
+            CALL {{ WITH s DELETE s }} IN TRANSACTIONS OF 10000 ROWS
+            """).consume()
+    # users are compared too on the undirected projection, the filters keep movie pairs only
+    result = run_cypher(
+        get_driver(),
+        f"""
+        CALL gds.nodeSimilarity.filtered.write($graph, {{
+          nodeLabels: ['User', 'Movie'],
+          relationshipTypes: ['RATED'],
+          sourceNodeFilter: 'Movie',
+          targetNodeFilter: 'Movie',
+          topK: $top_k,
+          writeRelationshipType: '{NODE_SIMILARITY_RELATIONSHIP}',
+          writeProperty: 'score'
+        }})
+        YIELD nodesCompared, relationshipsWritten
+        RETURN nodesCompared, relationshipsWritten
+        """,
+        {"graph": graph, "top_k": top_k},
+        access_mode=WRITE,
+    )[0]
+    invalidate_query_cache()
+    logger.info(
+        f"Node similarity compared {result['nodesCompared']} nodes, wrote {result['relationshipsWritten']} relationships"
+    )
+    return result["relationshipsWritten"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Structural movie embeddings and similarities from the GDS projection"
+    )
+    parser.add_argument("command", choices=["fastrp", "node-similarity", "drop"])
+    parser.add_argument("--graph", default=GDS_GRAPH_NAME)
+    parser.add_argument("--dimensions", type=int, default=FASTRP_DIMENSIONS)
+    parser.add_argument("--top-k", type=int, default=NODE_SIMILARITY_TOP_K)
+    parser.add_argument(
+        "--refresh", action="store_true", help="project the graph again first"
+    )
+    args = parser.parse_args()
+
+    if args.command == "fastrp":
+        write_fastrp_embeddings(args.graph, args.dimensions, args.refresh)
+    elif args.command == "node-similarity":
+        write_node_similarity(args.graph, args.top_k, args.refresh)
+    else:
+        drop_projection(args.graph)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import threading
+from functions.connections import connect_to_neo4j_async, get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import READ, WRITE, _ACCESS_MODES, _query_label
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.query_metrics import (
+    QUERY_METRICS,
+    query_name,
+    payload_bytes,
+    server_ms,
+    profile_if_slow,
+)
+from functions.helper_functions.logging_config import get_logger
+
+logger = get_logger(__name__, "CYPHER_LOG_FILE_PATH")
+
+# Streamlit reruns the page script on its own thread for every session, so the async driver lives on
+# one background event loop shared by the process and the pages hand their coroutines to it
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+_async_driver = None
+_async_driver_lock = None
+
+
+def get_event_loop():
+    """
+    Returns the process-wide background event loop, starting its daemon thread on first use
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name="async-cypher", daemon=True
+            )
+            thread.start()
+            _loop, _loop_thread = loop, thread
+        return _loop
+
+
+def run_sync(coroutine, timeout=None):
+    """
+    Runs a coroutine on the background event loop and blocks until it returns
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("run_sync cannot be called from the background event loop")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+
+async def _gather(coroutines, return_exceptions):
+    return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+
+def gather(*coroutines, return_exceptions=False):
+    """
+    Sync entry point for the pages: runs independent query coroutines concurrently and returns
+    their results in order, so the wall time is close to the slowest one instead of the sum
+    return_exceptions=True returns the exception of a failed query in its place instead of raising
+    """
+    start = time.perf_counter()
+    results = run_sync(_gather(coroutines, return_exceptions))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.debug(f"gathered {len(coroutines)} queries in {elapsed_ms:.1f} ms")
+    return results
+
+
+async def get_async_driver():
+    """
+    Returns the async Neo4j driver of the background event loop, connecting on first use
+    Returns None on the local backend, or if the connection failed (the next call retries)
+    """
+    global _async_driver, _async_driver_lock
+    if RECSYS_BACKEND != "neo4j":
+        return None
+    if _async_driver_lock is None:
+        # created on the loop that uses it, every coroutine here runs on the same loop
+        _async_driver_lock = asyncio.Lock()
+    async with _async_driver_lock:
+        if _async_driver is None:
+            _async_driver = await connect_to_neo4j_async()
+    return _async_driver
+
+
+async def _fetch_all(tx, query, parameters):
+    # managed transaction functions can be retried, so the result must be fully consumed inside them
+    result = await tx.run(query, parameters)
+    data = await result.data()
+    return data, await result.consume()
+
+
+async def run_cypher_async(query, parameters=None, access_mode=READ, name=None):
+    """
+    Async run_cypher: runs the query in a managed transaction on the async driver,
+    returns every record as a dict
+    name: label of the query in the metrics, the calling function by default
+    """
+    name = name or query_name()
+    driver = await get_async_driver()
+    if driver is None:
+        QUERY_METRICS.record_error(name)
+        raise RuntimeError("Could not connect to Neo4j")
+    parameters = parameters or {}
+    database = os.getenv("NEO4J_DATABASE") or None
+    start = time.perf_counter()
+    try:
+        async with driver.session(
+            database=database,
+            default_access_mode=_ACCESS_MODES[access_mode],
+        ) as session:
+            if access_mode == WRITE:
+                data, summary = await session.execute_write(
+                    _fetch_all, query, parameters
+                )
+            else:
+                data, summary = await session.execute_read(
+                    _fetch_all, query, parameters
+                )
+    except Exception:
+        QUERY_METRICS.record_error(name)
+        raise
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    server = server_ms(summary)
+    size = payload_bytes(data)
+    QUERY_METRICS.record(name, elapsed_ms, server, len(data), size)
+    logger.debug(
+        f"{name}: async {access_mode} query took {elapsed_ms:.1f} ms (server {server} ms), "
+        f"{len(data)} rows, ~{size} bytes: {_query_label(query)}"
+    )
+    if access_mode == READ:
+        # profiled with the sync driver on the profiler thread, off the event loop
+        profile_if_slow(get_driver, database, name, query, parameters, elapsed_ms)
+    return data
+
+
+async def cached_run_cypher_async(query, parameters=None):
+    """
+    run_cypher_async backed by the shared QUERY_CACHE, hits are shared with cached_run_cypher
+    """
+    data = QUERY_CACHE.get(query, parameters)
+    if data is not None:
+        return data
+    data = await run_cypher_async(query, parameters)
+    QUERY_CACHE.put(query, parameters, data)
+    return data
@@ -1,5 +1,135 @@
-def run_cypher(driver, query, parameters={}):
-    with driver.session() as session:
-        result = session.run(query, parameters)
-        data = result.data()
+import os
+import time
+from functions.helper_functions.query_metrics import (
+    QUERY_METRICS,
+    query_name,
+    payload_bytes,
+    server_ms,
+    profile_if_slow,
+)
+from functions.helper_functions.logging_config import get_logger
+
+logger = get_logger(__name__, "CYPHER_LOG_FILE_PATH")
+
+READ = "read"
+WRITE = "write"
+# neo4j.READ_ACCESS / neo4j.WRITE_ACCESS, spelled out so importing this module does not load the driver package
+_ACCESS_MODES = {READ: "READ", WRITE: "WRITE"}
+
+
+def _fetch_all(tx, query, parameters):
+    # managed transaction functions can be retried, so the result must be fully consumed inside them
+    result = tx.run(query, parameters)
+    data = result.data()
+    return data, result.consume()
+
+
+def _query_label(query):
+    # first non-empty line of the query, enough to tell queries apart in the logs
+    for line in query.strip().splitlines():
+        if line.strip():
+            return line.strip()[:80]
+    return ""
+
+
+class QueryExecutor:
+    """
+    Runs Cypher through the driver's connection pool.
+    Reads and writes go through execute_read / execute_write managed transactions, so transient
+    failures (leader switch, dropped connection) are retried by the driver.
+    Every query is recorded in QUERY_METRICS under its name, the calling function by default.
+    """
+
+    def __init__(self, driver, database=None):
+        self.driver = driver
+        self.database = database or os.getenv("NEO4J_DATABASE") or None
+
+    def _session(self, access_mode):
+        default_access_mode = _ACCESS_MODES[access_mode]
+        return self.driver.session(
+            database=self.database, default_access_mode=default_access_mode
+        )
+
+    def run(self, query, parameters=None, access_mode=READ, name=None):
+        """
+        Runs the query in a managed transaction and returns every record as a dict
+        """
+        parameters = parameters or {}
+        name = name or query_name()
+        start = time.perf_counter()
+        try:
+            with self._session(access_mode) as session:
+                if access_mode == WRITE:
+                    data, summary = session.execute_write(_fetch_all, query, parameters)
+                else:
+                    data, summary = session.execute_read(_fetch_all, query, parameters)
+        except Exception:
+            QUERY_METRICS.record_error(name)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._record(name, query, parameters, access_mode, elapsed_ms, summary, data)
         return data
+
+    def _record(self, name, query, parameters, access_mode, elapsed_ms, summary, data):
+        server = server_ms(summary)
+        size = payload_bytes(data)
+        QUERY_METRICS.record(name, elapsed_ms, server, len(data), size)
+        logger.debug(
+            f"{name}: {access_mode} query took {elapsed_ms:.1f} ms (server {server} ms), "
+            f"{len(data)} rows, ~{size} bytes: {_query_label(query)}"
+        )
+        if access_mode == READ:
+            profile_if_slow(
+                self.driver, self.database, name, query, parameters, elapsed_ms
+            )
+
+    def read(self, query, parameters=None):
+        return self.run(query, parameters, READ)
+
+    def write(self, query, parameters=None):
+        return self.run(query, parameters, WRITE)
+
+    def stream(self, query, parameters=None, access_mode=READ, name=None):
+        """
+        Yields records one at a time as dicts instead of materialising the whole result.
+        Runs as an auto-commit transaction, so it is not retried once records have been yielded.
+        """
+        parameters = parameters or {}
+        name = name or query_name()
+        start = time.perf_counter()
+        count = 0
+        size = 0
+        with self._session(access_mode) as session:
+            try:
+                result = session.run(query, parameters)
+                for record in result:
+                    count += 1
+                    data = record.data()
+                    size += payload_bytes(data)
+                    yield data
+                summary = result.consume()
+            except Exception:
+                QUERY_METRICS.record_error(name)
+                raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        server = server_ms(summary)
+        QUERY_METRICS.record(name, elapsed_ms, server, count, size)
+        logger.debug(
+            f"{name}: {access_mode} stream took {elapsed_ms:.1f} ms (server {server} ms), "
+            f"{count} rows, ~{size} bytes: {_query_label(query)}"
+        )
+
+
+def run_cypher(
+    driver, query, parameters=None, access_mode=READ, stream=False, name=None
+):
+    """
+    Runs a query through a QueryExecutor on the given driver.
+    Returns a list of dicts, or a generator of dicts when stream is True.
+    name: label of the query in the metrics, the calling function by default
+    """
+    executor = QueryExecutor(driver)
+    name = name or query_name()
+    if stream:
+        return executor.stream(query, parameters, access_mode, name)
+    return executor.run(query, parameters, access_mode, name)
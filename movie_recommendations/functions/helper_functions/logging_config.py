@@ -0,0 +1,57 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_lock = threading.Lock()
+_environment_loaded = False
+_console_handler = None
+# one handler per log file, every logger writing to app.log shares the same open file
+_file_handlers = {}
+
+
+def load_environment():
+    """
+    Loads .env once per process, later calls are no-ops
+    """
+    global _environment_loaded
+    with _lock:
+        if not _environment_loaded:
+            load_dotenv(".env")
+            _environment_loaded = True
+
+
+def _shared_handlers(log_file_path):
+    global _console_handler
+    formatter = logging.Formatter(LOG_FORMAT)
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler()
+        _console_handler.setLevel(logging.DEBUG)
+        _console_handler.setFormatter(formatter)
+    file_handler = _file_handlers.get(log_file_path)
+    if file_handler is None:
+        file_handler = logging.FileHandler(log_file_path)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        _file_handlers[log_file_path] = file_handler
+    return _console_handler, file_handler
+
+
+def get_logger(name, log_file_env="APP_LOG_FILE_PATH"):
+    """
+    Returns the logger for a module, writing to the console and to the file named by the
+    log_file_env environment variable (app.log by default).
+    Safe to call on every Streamlit rerun, handlers are attached once per logger.
+    """
+    load_environment()
+    logger = logging.getLogger(name)
+    log_file_path = os.getenv(log_file_env, "app.log")
+    with _lock:
+        handlers = _shared_handlers(log_file_path)
+        logger.setLevel(logging.DEBUG)
+        for handler in handlers:
+            if handler not in logger.handlers:
+                logger.addHandler(handler)
+    return logger
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from cachetools import TTLCache
+from functions.helper_functions.cypher import run_cypher
+from functions.helper_functions.logging_config import get_logger
+
+logger = get_logger(__name__, "QUERY_CACHE_LOG_FILE_PATH")
+
+
+def normalize_parameters(parameters):
+    """
+    Turns query parameters into a stable string, so {"a": 1, "b": 2} and {"b": 2, "a": 1} share a cache entry
+    """
+    return json.dumps(parameters or {}, sort_keys=True, default=str)
+
+
+class QueryCache:
+    """
+    Size-bounded result cache with a time to live, least recently used entries are evicted first.
+    Entries are keyed by the query text plus its normalized parameters.
+    Cached results are shared between callers, so they must not be mutated.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query, parameters=None):
+        """
+        Cached result of the query, None on a miss
+        """
+        key = (query, normalize_parameters(parameters))
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self.hits += 1
+                return data
+            self.misses += 1
+        return None
+
+    def put(self, query, parameters, data):
+        key = (query, normalize_parameters(parameters))
+        with self._lock:
+            self._cache[key] = data
+
+    def get_or_run(self, driver, query, parameters=None):
+        data = self.get(query, parameters)
+        if data is not None:
+            return data
+        # run outside the lock so a slow query does not block cache hits on other keys
+        data = run_cypher(driver, query, parameters)
+        self.put(query, parameters, data)
+        return data
+
+    def add_invalidation_listener(self, listener):
+        """
+        Registers a callable to run whenever the cache is invalidated,
+        for other in-process state derived from the graph
+        """
+        self._listeners.append(listener)
+
+    def invalidate(self):
+        """
+        Drops every cached result, call after anything mutates the graph
+        """
+        with self._lock:
+            self._cache.clear()
+        for listener in self._listeners:
+            listener()
+        logger.info("Query cache invalidated")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+QUERY_CACHE = QueryCache(
+    maxsize=int(os.getenv("QUERY_CACHE_MAX_SIZE", "256")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300")),
+)
+
+
+def cached_run_cypher(driver, query, parameters=None):
+    """
+    run_cypher backed by the shared QUERY_CACHE
+    """
+    return QUERY_CACHE.get_or_run(driver, query, parameters)
+
+
+def invalidate_query_cache():
+    QUERY_CACHE.invalidate()
+
+
+def query_cache_stats():
+    return QUERY_CACHE.stats()
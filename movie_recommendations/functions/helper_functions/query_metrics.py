@@ -0,0 +1,331 @@
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from functions.helper_functions.logging_config import get_logger
+
+logger = get_logger(__name__, "CYPHER_LOG_FILE_PATH")
+
+# latest wall / server times kept per query for the percentiles
+QUERY_METRICS_WINDOW = int(os.getenv("QUERY_METRICS_WINDOW", "1000"))
+# read queries slower than this are run again with PROFILE in the background, 0 turns profiling off
+QUERY_PROFILE_THRESHOLD_MS = float(os.getenv("QUERY_PROFILE_THRESHOLD_MS", "0"))
+# each query is profiled at most once per cooldown
+QUERY_PROFILE_COOLDOWN_SECONDS = float(
+    os.getenv("QUERY_PROFILE_COOLDOWN_SECONDS", "300")
+)
+# when set, start_metrics_server serves the Prometheus metrics on this port
+QUERY_METRICS_PORT = os.getenv("QUERY_METRICS_PORT")
+# upper bounds of the Prometheus duration histogram, in seconds
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def query_name():
+    """
+    Stable name of the query: module.function of the first caller outside helper_functions,
+    e.g. functions.general.search_movie_titles
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith("functions.helper_functions"):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def payload_bytes(value):
+    """
+    Rough size of a query result as the driver decoded it, without serialising it again
+    Lists of numbers (embeddings) are counted as 8 bytes per item without walking them
+    """
+    if isinstance(value, dict):
+        return sum(len(str(key)) + payload_bytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (int, float)):
+            return 8 * len(value)
+        return sum(payload_bytes(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+def server_ms(summary):
+    """
+    Time the server spent planning, running and streaming the query, from a ResultSummary
+    """
+    if summary is None:
+        return None
+    available = summary.result_available_after or 0
+    consumed = summary.result_consumed_after or 0
+    return available + consumed
+
+
+class QueryStats:
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+        self.wall_ms_sum = 0.0
+        self.server_ms_sum = 0.0
+        self.server_count = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.wall_ms = deque(maxlen=window)
+        self.server_ms = deque(maxlen=window)
+        self.last_profiled = None
+
+
+def _percentiles(samples):
+    if not samples:
+        return [None, None, None]
+    return [float(value) for value in np.percentile(list(samples), [50, 95, 99])]
+
+
+class QueryMetrics:
+    """
+    Per-query counters and latency samples for every Cypher call made through run_cypher,
+    plus the PROFILE plans captured for slow queries.
+    One instance per process, shared by every Streamlit session.
+    """
+
+    def __init__(self, window=QUERY_METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slow_queries = deque(maxlen=50)
+
+    def _query(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = QueryStats(self.window)
+        return stats
+
+    def record(self, name, wall_ms, server_ms=None, rows=0, payload_bytes=0):
+        with self._lock:
+            stats = self._query(name)
+            stats.count += 1
+            stats.rows += rows
+            stats.bytes += payload_bytes
+            stats.wall_ms_sum += wall_ms
+            stats.wall_ms.append(wall_ms)
+            if server_ms is not None:
+                stats.server_ms_sum += server_ms
+                stats.server_count += 1
+                stats.server_ms.append(server_ms)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if wall_ms <= bound * 1000:
+                    stats.buckets[i] += 1
+
+    def record_error(self, name):
+        with self._lock:
+            self._query(name).errors += 1
+
+    def should_profile(self, name, wall_ms):
+        """
+        True once per cooldown for a query slower than QUERY_PROFILE_THRESHOLD_MS
+        """
+        if not QUERY_PROFILE_THRESHOLD_MS or wall_ms < QUERY_PROFILE_THRESHOLD_MS:
+            return False
+        now = time.time()
+        with self._lock:
+            stats = self._query(name)
+            if (
+                stats.last_profiled is not None
+                and now - stats.last_profiled < QUERY_PROFILE_COOLDOWN_SECONDS
+            ):
+                return False
+            stats.last_profiled = now
+            return True
+
+    def record_profile(self, profile):
+        with self._lock:
+            self.slow_queries.appendleft(profile)
+
+    def summary(self):
+        """
+        One dict per query, the slowest in total first, with p50 / p95 / p99 of the recent wall and server times
+        """
+        with self._lock:
+            rows = []
+            for name, stats in self._stats.items():
+                wall = _percentiles(stats.wall_ms)
+                server = _percentiles(stats.server_ms)
+                rows.append(
+                    {
+                        "query": name,
+                        "count": stats.count,
+                        "errors": stats.errors,
+                        "total_ms": stats.wall_ms_sum,
+                        "p50_ms": wall[0],
+                        "p95_ms": wall[1],
+                        "p99_ms": wall[2],
+                        "server_p50_ms": server[0],
+                        "server_p95_ms": server[1],
+                        "server_p99_ms": server[2],
+                        "rows": stats.rows,
+                        "bytes": stats.bytes,
+                    }
+                )
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def prometheus_text(self):
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP recsys_query_duration_seconds Wall time of Cypher queries",
+            "# TYPE recsys_query_duration_seconds histogram",
+        ]
+        with self._lock:
+            stats = sorted(self._stats.items())
+            for name, query in stats:
+                label = f'query="{name}"'
+                for bound, count in zip(DURATION_BUCKETS, query.buckets):
+                    lines.append(
+                        f'recsys_query_duration_seconds_bucket{{{label},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'recsys_query_duration_seconds_bucket{{{label},le="+Inf"}} {query.count}'
+                )
+                lines.append(
+                    f"recsys_query_duration_seconds_sum{{{label}}} {query.wall_ms_sum / 1000}"
+                )
+                lines.append(
+                    f"recsys_query_duration_seconds_count{{{label}}} {query.count}"
+                )
+            counters = [
+                (
+                    "server_seconds",
+                    "Server time reported by the result summaries",
+                    lambda q: q.server_ms_sum / 1000,
+                ),
+                ("rows", "Rows returned", lambda q: q.rows),
+                ("payload_bytes", "Approximate bytes returned", lambda q: q.bytes),
+                ("errors", "Failed queries", lambda q: q.errors),
+            ]
+            for metric, description, value in counters:
+                lines.append(f"# HELP recsys_query_{metric}_total {description}")
+                lines.append(f"# TYPE recsys_query_{metric}_total counter")
+                for name, query in stats:
+                    lines.append(
+                        f'recsys_query_{metric}_total{{query="{name}"}} {value(query)}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries.clear()
+
+
+QUERY_METRICS = QueryMetrics()
+
+# one worker, profiling runs queries again and must not compete with the pages for the pool
+_profiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-profile")
+
+
+def format_plan(plan, depth=0):
+    """
+    Indented operator tree of a PROFILE plan with the rows and db hits of every operator
+    """
+    lines = [
+        "  " * depth
+        + f"{plan.get('operatorType')} rows={plan.get('rows')} dbHits={plan.get('dbHits')}"
+    ]
+    for child in plan.get("children", []):
+        lines.extend(format_plan(child, depth + 1))
+    return lines
+
+
+def _total_db_hits(plan):
+    return (plan.get("dbHits") or 0) + sum(
+        _total_db_hits(child) for child in plan.get("children", [])
+    )
+
+
+def _profile(driver, database, name, query, parameters, wall_ms):
+    try:
+        with driver.session(database=database, default_access_mode="READ") as session:
+            result = session.run("PROFILE " + query, parameters)
+            summary = result.consume()
+        plan = summary.profile or {}
+        QUERY_METRICS.record_profile(
+            {
+                "query": name,
+                "wall_ms": wall_ms,
+                "captured_at": time.time(),
+                "db_hits": _total_db_hits(plan),
+                "plan": "\n".join(format_plan(plan)),
+                "cypher": query.strip(),
+            }
+        )
+        logger.info(f"Profiled slow query {name} ({wall_ms:.1f} ms)")
+    except Exception as e:
+        logger.warning(f"Profiling {name} failed: {e}")
+
+
+def profile_if_slow(driver, database, name, query, parameters, wall_ms):
+    """
+    Runs a slow read query again with PROFILE on a background thread and keeps its plan
+    in QUERY_METRICS.slow_queries, writes are never profiled
+    driver: the sync driver, or a function returning it so it is only connected when needed
+    """
+    if not QUERY_METRICS.should_profile(name, wall_ms):
+        return
+    if callable(driver):
+        driver = driver()
+    if driver is None:
+        return
+    _profiler.submit(_profile, driver, database, name, query, parameters, wall_ms)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = QUERY_METRICS.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the console
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=QUERY_METRICS_PORT):
+    """
+    Serves /metrics for Prometheus on a daemon thread, once per process
+    Does nothing unless QUERY_METRICS_PORT (or port) is set
+    """
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+            except OSError as e:
+                # another worker on the host already serves the port, do not try again
+                logger.warning(f"Query metrics server not started on {port}: {e}")
+                _metrics_server = False
+                return None
+            threading.Thread(
+                target=_metrics_server.serve_forever,
+                name="query-metrics",
+                daemon=True,
+            ).start()
+            logger.info(f"Serving query metrics on :{port}/metrics")
+        return _metrics_server or None
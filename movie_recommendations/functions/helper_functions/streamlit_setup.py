@@ -1,5 +1,37 @@
 import streamlit as st
+from functions.helper_functions.async_cypher import gather
+from functions.async_queries import search_movie_titles_async
 
 
 def page_config():
     st.set_page_config(layout="wide")
+
+
+def movie_picker(label, key, *queries, max_selections=10):
+    """
+    Title search box feeding a multiselect, so the page never loads the whole catalogue
+    The options are the search results plus the movies already selected, which stay selected
+    while the user searches for the next one
+    queries: other coroutines of the page, run concurrently with the title search
+    Returns ({movie_id: title} of the selected movies in the order they were picked, [results of queries])
+    """
+    titles = st.session_state.setdefault(f"{key}-titles", {})
+    selected = st.session_state.setdefault(f"{key}-selected", [])
+    search = st.text_input(
+        "Search movie titles", key=f"{key}-search", placeholder="e.g. godfather"
+    )
+    # the most voted movies while the box is empty, prefix and typo matches otherwise
+    results, *query_results = gather(search_movie_titles_async(search), *queries)
+    titles.update(zip(results["MovieID"], results["Movie.title"]))
+    options = selected + [
+        movie_id for movie_id in results["MovieID"] if movie_id not in selected
+    ]
+    selected = st.multiselect(
+        label,
+        options,
+        default=selected,
+        format_func=titles.get,
+        max_selections=max_selections,
+    )
+    st.session_state[f"{key}-selected"] = selected
+    return {movie_id: titles[movie_id] for movie_id in selected}, query_results
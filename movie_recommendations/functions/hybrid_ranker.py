@@ -0,0 +1,150 @@
+from functions.content_filtering_methods import (
+    plot_embedding_similarity_genre_batch,
+    poster_embedding_similarity,
+)
+from functions.collaborative_filtering_methods import (
+    movie_user_recommendations_singular,
+)
+from functions.helper_functions.logging_config import get_logger
+import os
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = get_logger(__name__, "HYBRID_RANKER_LOG_FILE_PATH")
+
+DEFAULT_WEIGHTS = {"plot": 0.4, "poster": 0.2, "co_rating": 0.3, "popularity": 0.1}
+# constant from the reciprocal rank fusion paper, dampens the weight of the very top ranks
+RRF_K = 60
+HYBRID_WORKERS = int(os.getenv("HYBRID_RANKER_WORKERS", "8"))
+# plot and poster neighbours of a seed say "more like this", only seeds rated at least this high feed them,
+# a low rating still feeds the co-rating source, which matches users who rated the seed the same way
+CONTENT_SEED_MIN_RATING = float(os.getenv("HYBRID_CONTENT_SEED_MIN_RATING", "3.5"))
+
+
+def plot_candidates(seeds, n):
+    rows = plot_embedding_similarity_genre_batch(list(seeds), n, slim=True)
+    return [(row["target_id"], row["target"], row["similarity"]) for row in rows]
+
+
+def poster_candidates(seed, n):
+    rows = poster_embedding_similarity(seed, n, slim=True)
+    return [(row["target_id"], row["target"], row["similarity"]) for row in rows]
+
+
+def co_rating_candidates(seed, rating, n):
+    # the n most co-rated movies, not the n most voted ones, popularity is a source of its own
+    rows = movie_user_recommendations_singular(
+        seed, rating, k=n, slim=True, by_user_count=True
+    )
+    return [(row["rec_id"], row["recommendation"], row["user_count"]) for row in rows]
+
+
+def min_max_normalize(scores):
+    """
+    Scales {id: score} to [0, 1], a source where every candidate scored the same gives them all 1.0
+    """
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {id: 1.0 for id in scores}
+    return {id: (score - low) / (high - low) for id, score in scores.items()}
+
+
+def reciprocal_ranks(scores, rrf_k=RRF_K):
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return {id: 1.0 / (rrf_k + rank) for rank, id in enumerate(ranked, start=1)}
+
+
+def gather_candidates(seeds, candidates_per_source=20):
+    """
+    Runs every candidate source concurrently, so latency is close to the slowest source
+    seeds: {movie_id: rating}
+    Returns ({source: {candidate_id: best score across seeds}}, {candidate_id: movie})
+    """
+    jobs = {}
+    liked = [
+        seed for seed, rating in seeds.items() if rating >= CONTENT_SEED_MIN_RATING
+    ]
+    with ThreadPoolExecutor(max_workers=HYBRID_WORKERS) as pool:
+        if liked:
+            jobs[pool.submit(plot_candidates, liked, candidates_per_source)] = "plot"
+        for seed in liked:
+            jobs[pool.submit(poster_candidates, seed, candidates_per_source)] = "poster"
+        for seed, rating in seeds.items():
+            jobs[
+                pool.submit(co_rating_candidates, seed, rating, candidates_per_source)
+            ] = "co_rating"
+
+        signals = {"plot": {}, "poster": {}, "co_rating": {}}
+        movies = {}
+        for future, source in jobs.items():
+            try:
+                candidates = future.result()
+            except Exception as e:
+                # one failing source (e.g. a missing vector index) should not sink the whole ranking
+                logger.error(f"Candidate source {source} failed: {e}")
+                continue
+            for candidate_id, movie, score in candidates:
+                if candidate_id in seeds:
+                    continue
+                movies.setdefault(candidate_id, movie)
+                best = signals[source].get(candidate_id)
+                if best is None or score > best:
+                    signals[source][candidate_id] = score
+    return signals, movies
+
+
+def hybrid_recommendations(
+    seeds, k=10, weights=None, fusion="weighted", candidates_per_source=20
+):
+    """
+    Blends plot similarity, poster similarity, co-rating counts and imdbVotes popularity into one ranked list
+    seeds: {movie_id: rating}, the rating is what the user gave the movie, the co-rating source matches it
+    and only seeds rated CONTENT_SEED_MIN_RATING or more feed the plot and poster sources
+    fusion: "weighted" sums min-max normalized scores times weights,
+            "rrf" sums weights / (RRF_K + rank) over every source that returned the candidate
+    Returns [{"movie_id", "movie", "score", "signals": {source: raw score}}, ...] best first
+    """
+    if not seeds:
+        return []
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    start = time.perf_counter()
+    signals, movies = gather_candidates(seeds, candidates_per_source)
+    # popularity only re-ranks candidates that another source produced
+    signals["popularity"] = {
+        id: math.log1p(movie.get("imdbVotes") or 0) for id, movie in movies.items()
+    }
+
+    if fusion == "rrf":
+        fused = {source: reciprocal_ranks(scores) for source, scores in signals.items()}
+    elif fusion == "weighted":
+        fused = {
+            source: min_max_normalize(scores) for source, scores in signals.items()
+        }
+    else:
+        raise ValueError(f"Unknown fusion method: {fusion}")
+
+    totals = {
+        id: sum(
+            weights.get(source, 0) * scores.get(id, 0)
+            for source, scores in fused.items()
+        )
+        for id in movies
+    }
+    ranked = sorted(totals, key=totals.get, reverse=True)[:k]
+    logger.info(
+        f"Hybrid ranking of {len(movies)} candidates took {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    return [
+        {
+            "movie_id": id,
+            "movie": movies[id],
+            "score": totals[id],
+            "signals": {
+                source: scores[id] for source, scores in signals.items() if id in scores
+            },
+        }
+        for id in ranked
+    ]
@@ -1,34 +1,180 @@
+from functions.data_preprocess import (
+    pre_created_embeddings_load,
+    drop_missing,
+    create_catalogue_indexes,
+)
+from functions.connections import get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import run_cypher, WRITE
+from functions.helper_functions.logging_config import get_logger
 import os
-from dotenv import load_dotenv
-import logging
-from functions.data_preprocess import pre_created_embeddings_load, drop_missing
-
-
-# Load environment variables
-load_dotenv(".env")
-
-# Configure logging
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# Create console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-# Create file handler
-log_file_path = os.getenv("INITIALIZE_LOG_FILE_PATH", "app.log")
-file_handler = logging.FileHandler(log_file_path)
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-
-def start():
-    logger.info("Initializing the application")
-    logger.info("Loading pre-created embeddings")
-    pre_created_embeddings_load()
-    logger.info("Dropping missing data")
-    drop_missing()
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, initialization then only runs once per process
+    fcntl = None
+
+
+logger = get_logger(__name__, "INITIALIZE_LOG_FILE_PATH")
+
+# bump when an initialization step changes, so graphs prepared by an older version are prepared again
+SCHEMA_VERSION = int(os.getenv("SCHEMA_VERSION", "3"))
+# every Streamlit worker on the host takes this lock before touching the graph
+INITIALIZE_LOCK_PATH = os.getenv("INITIALIZE_LOCK_PATH", "data/initialize.lock")
+
+NOT_STARTED = "not_started"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_status = {
+    "state": NOT_STARTED,
+    "step": None,
+    "schema_version": None,
+    "error": None,
+    "started_at": None,
+    "finished_at": None,
+}
+_status_lock = threading.Lock()
+_thread = None
+
+
+def get_status():
+    """
+    Snapshot of this process' initialization, for the UI to poll
+    state is one of not_started, running, done, failed
+    """
+    with _status_lock:
+        return dict(_status)
+
+
+def _update_status(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+
+@contextmanager
+def _initialize_lock(path=INITIALIZE_LOCK_PATH):
+    """
+    Exclusive lock shared by every process on the host, blocks until the holder releases it
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def graph_schema_version():
+    """
+    Schema version recorded on the (:SchemaVersion) marker node, 0 if the graph was never initialized
+    """
+    query = """
+    MATCH (s:SchemaVersion {name: "recsys"})
+    RETURN s.version AS version
+    """
+    data = run_cypher(get_driver(), query)
+    if not data or data[0]["version"] is None:
+        return 0
+    return data[0]["version"]
+
+
+def record_schema_version(version):
+    query = """
+    MERGE (s:SchemaVersion {name: "recsys"})
+    SET s.version = $version, s.updatedAt = datetime()
+    """
+    run_cypher(get_driver(), query, {"version": version}, access_mode=WRITE)
+
+
+def run_initialization(force=False):
+    """
+    Prepares the graph unless the marker node says this schema version already did
+    Holds the cross-process lock throughout, so concurrent workers wait and then see the new marker
+    Returns True on success
+    """
+    if get_driver() is None:
+        raise RuntimeError("Could not connect to Neo4j")
+    with _initialize_lock():
+        _update_status(step="checking schema version")
+        version = graph_schema_version()
+        if version >= SCHEMA_VERSION and not force:
+            logger.info(f"Graph already initialized at schema version {version}")
+            _update_status(schema_version=version)
+            return True
+
+        logger.info(
+            f"Initializing the graph from schema version {version} to {SCHEMA_VERSION}"
+        )
+        _update_status(step="loading pre-created embeddings")
+        if not pre_created_embeddings_load():
+            raise RuntimeError("Loading the pre-created embeddings failed")
+        _update_status(step="dropping missing data")
+        if not drop_missing():
+            raise RuntimeError("Dropping missing data failed")
+        _update_status(step="creating catalogue indexes")
+        if not create_catalogue_indexes():
+            raise RuntimeError("Creating the catalogue indexes failed")
+        record_schema_version(SCHEMA_VERSION)
+        _update_status(schema_version=SCHEMA_VERSION)
+        return True
+
+
+def _run(force):
+    try:
+        run_initialization(force)
+        _update_status(state=DONE, step=None, finished_at=time.time())
+        logger.info("Initialization complete")
+    except Exception as e:
+        _update_status(state=FAILED, error=str(e), finished_at=time.time())
+        logger.error(f"Initialization failed: {e}")
+
+
+def start(background=True, force=False):
+    """
+    Initializes the application once per process, later calls just return the status
+    A failed initialization is attempted again on the next call
+    background=True runs it on a daemon thread so the first page render is not blocked
+    """
+    global _thread
+    with _status_lock:
+        if _status["state"] == RUNNING or (_status["state"] == DONE and not force):
+            return dict(_status)
+        if RECSYS_BACKEND == "local":
+            # the local backend serves exported files, there is no graph to prepare
+            _status.update(state=DONE, step=None, finished_at=time.time())
+            return dict(_status)
+        _status.update(
+            state=RUNNING,
+            step=None,
+            error=None,
+            started_at=time.time(),
+            finished_at=None,
+        )
+        logger.info("Initializing the application")
+        if background:
+            _thread = threading.Thread(
+                target=_run, args=(force,), name="initialize", daemon=True
+            )
+            _thread.start()
+    if not background:
+        _run(force)
+    return get_status()
+
+
+def wait(timeout=None):
+    """
+    Blocks until a background initialization finishes, returns the status
+    """
+    thread = _thread
+    if thread is not None:
+        thread.join(timeout)
+    return get_status()
@@ -0,0 +1,426 @@
+from functions.connections import get_driver
+from functions.helper_functions.cypher import run_cypher
+from functions.embedding_store import open_embedding_store, export_embeddings
+from functions.embedding_index import EmbeddingIndex
+from functions.rating_matrix import load_rating_matrix, RATING_MATRIX_PATH
+from functions.helper_functions.logging_config import get_logger
+import os
+import re
+import json
+import bisect
+import argparse
+import threading
+from collections import Counter
+import numpy as np
+
+logger = get_logger(__name__, "LOCAL_GRAPH_LOG_FILE_PATH")
+
+LOCAL_GRAPH_DIR = os.getenv("LOCAL_GRAPH_DIR", "data/local_graph")
+
+# properties the listing queries in functions.general strip with apoc.map.removeKeys
+HIDDEN_PROPERTIES = [
+    "plotEmbedding",
+    "posterEmbedding",
+    "fastRPEmbedding",
+    "tmdbId",
+    "movieId",
+    "countries",
+    "budget",
+    "revenue",
+]
+EMBEDDING_PROPERTIES = ["plotEmbedding", "posterEmbedding", "fastRPEmbedding"]
+
+
+def catalogue_path(directory=LOCAL_GRAPH_DIR):
+    return os.path.join(directory, "catalogue.json")
+
+
+def _title_order(movie):
+    # ORDER BY m.title, m.released, Neo4j sorts nulls last on ascending order
+    properties = movie["properties"]
+    return (
+        properties.get("title") is None,
+        properties.get("title") or "",
+        properties.get("released") is None,
+        str(properties.get("released") or ""),
+    )
+
+
+def _page_order(movie):
+    # keyset order of functions.general.list_movies_page: imdbVotes descending, movies without votes last,
+    # then the id
+    votes = movie["properties"].get("imdbVotes")
+    return (votes is None, -(votes or 0), movie["id"])
+
+
+def title_words(text):
+    """
+    Lowercased words of a title or a title search, punctuation dropped
+    """
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def _trigrams(word):
+    # padded so the first letters of a word form their own trigrams and prefixes match them
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _word_score(term, word, term_trigrams):
+    # 1 when the word starts with the term, otherwise the Dice similarity of their trigrams
+    if word.startswith(term):
+        return 1.0
+    word_trigrams = _trigrams(word)
+    return (
+        2
+        * len(term_trigrams & word_trigrams)
+        / (len(term_trigrams) + len(word_trigrams))
+    )
+
+
+def _listing(properties):
+    return {
+        key: value for key, value in properties.items() if key not in HIDDEN_PROPERTIES
+    }
+
+
+class LocalGraph:
+    """
+    The Movie / Genre part of the graph held in memory, serving the catalogue queries of
+    functions.general without a database. Plot similarity and co-rating recommendations
+    reuse the embedding store and the rating matrix exported next to it.
+    """
+
+    def __init__(self, genres, movies):
+        """
+        genres: [{"id", "neo4j_id", "properties"}, ...]
+        movies: [{"id", "neo4j_id", "properties", "genres": [genre ids]}, ...], embeddings left out
+        """
+        self.genres = sorted(
+            genres, key=lambda genre: genre["properties"].get("name") or ""
+        )
+        self.genre_by_id = {genre["id"]: genre for genre in self.genres}
+        self.movies = sorted(movies, key=_title_order)
+        self.movie_by_id = {movie["id"]: movie for movie in self.movies}
+        self.movies_by_genre = {}
+        for movie in self.movies:
+            for genre_id in movie["genres"]:
+                self.movies_by_genre.setdefault(genre_id, []).append(movie)
+        self._poster_index = None
+        self._poster_index_lock = threading.Lock()
+        self.movies_by_page_order = sorted(movies, key=_page_order)
+        self._page_keys = [_page_order(movie) for movie in self.movies_by_page_order]
+        self._title_index = None
+        self._title_index_lock = threading.Lock()
+
+    def list_all_genres(self):
+        return [
+            {"Genre": genre["properties"], "GenreID": genre["id"]}
+            for genre in self.genres
+        ]
+
+    def _movie_row(self, movie):
+        return {
+            "Movie": _listing(movie["properties"]),
+            "MovieID": movie["id"],
+            "MovieNeo4jID": movie["neo4j_id"],
+        }
+
+    def _genre_row(self, movie, genre):
+        return {
+            **self._movie_row(movie),
+            "Genre": genre["properties"].get("name"),
+            "GenreID": genre["id"],
+            "GenreNeo4jID": genre["neo4j_id"],
+        }
+
+    def list_all_movies(self):
+        return [self._movie_row(movie) for movie in self.movies]
+
+    def _matching_genres(self, genres):
+        # genre ids in the order of self.genres, like the IN filter over (g:Genre)
+        names = set(genres)
+        return [
+            genre for genre in self.genres if genre["properties"].get("name") in names
+        ]
+
+    def search_movies_based_genres(self, genres):
+        rows = []
+        for genre in self._matching_genres(genres):
+            for movie in self.movies_by_genre.get(genre["id"], []):
+                rows.append((movie, genre))
+        # sort is stable, so movies in several genres keep the genres in name order
+        rows.sort(key=lambda row: _title_order(row[0]))
+        return [self._genre_row(movie, genre) for movie, genre in rows]
+
+    def display_movie_metadata(self, movie_id):
+        movie = self.movie_by_id.get(movie_id)
+        if movie is None:
+            return []
+        return [
+            self._genre_row(movie, self.genre_by_id[genre_id])
+            for genre_id in movie["genres"]
+            if genre_id in self.genre_by_id
+        ]
+
+    def fetch_movies_by_id(self, ids):
+        """
+        {id: movie} for the known ids, the embeddings are read from the embedding store instead
+        """
+        return {
+            id: self.movie_by_id[id]["properties"]
+            for id in ids
+            if id in self.movie_by_id
+        }
+
+    def _genre_names(self, movie, genre_ids=None):
+        return [
+            self.genre_by_id[genre_id]["properties"].get("name")
+            for genre_id in movie["genres"]
+            if genre_id in self.genre_by_id
+            and (genre_ids is None or genre_id in genre_ids)
+        ]
+
+    def search_movies_based_genres_display(self, genres, properties):
+        """
+        Rows of search_movies_based_genres_display, the genres joined and ordered by imdbVotes
+        """
+        genre_ids = {genre["id"] for genre in self._matching_genres(genres)}
+        movies = {}
+        for genre_id in genre_ids:
+            for movie in self.movies_by_genre.get(genre_id, []):
+                movies[movie["id"]] = movie
+        return [
+            self._display_row(movie, properties, genre_ids)
+            for movie in sorted(movies.values(), key=_page_order)
+        ]
+
+    def display_movie_metadata_display(self, movie_id, properties):
+        movie = self.movie_by_id.get(movie_id)
+        if movie is None:
+            return []
+        return [self._display_row(movie, properties)]
+
+    def display_movie_metadata_bulk(self, ids, properties):
+        """
+        Rows of display_movie_metadata_bulk, in the order of ids, unknown ids are left out
+        movies without a genre keep their row with an empty Genre
+        """
+        return [
+            {"MovieID": id, **self._display_row(self.movie_by_id[id], properties)}
+            for id in ids
+            if id in self.movie_by_id
+        ]
+
+    def _display_row(self, movie, properties, genre_ids=None):
+        return {
+            "Genre": ", ".join(self._genre_names(movie, genre_ids)),
+            **{f"Movie.{prop}": movie["properties"].get(prop) for prop in properties},
+        }
+
+    def list_movies_page(self, after, page_size):
+        """
+        Rows and cursor of list_movies_page, a binary search finds where the page starts
+        """
+        start = 0
+        if after is not None:
+            votes, id = after
+            start = bisect.bisect_right(
+                self._page_keys, (votes is None, -(votes or 0), id)
+            )
+        page = self.movies_by_page_order[start : start + page_size]
+        if start + page_size >= len(self.movies_by_page_order):
+            cursor = None
+        else:
+            cursor = (page[-1]["properties"].get("imdbVotes"), page[-1]["id"])
+        return [self._movie_row(movie) for movie in page], cursor
+
+    def title_index(self):
+        """
+        (vocabulary of the title words, trigram -> vocabulary positions,
+        vocabulary position -> positions in movies_by_page_order), built on first use
+        Typos are matched against the few thousand distinct words instead of every title
+        """
+        with self._title_index_lock:
+            if self._title_index is None:
+                vocabulary, word_index, titles = [], {}, {}
+                for position, movie in enumerate(self.movies_by_page_order):
+                    for word in set(title_words(movie["properties"].get("title"))):
+                        if word not in word_index:
+                            word_index[word] = len(vocabulary)
+                            vocabulary.append(word)
+                        titles.setdefault(word_index[word], []).append(position)
+                postings = {}
+                for i, word in enumerate(vocabulary):
+                    for trigram in _trigrams(word):
+                        postings.setdefault(trigram, []).append(i)
+                self._title_index = (vocabulary, postings, titles)
+            return self._title_index
+
+    def search_movie_titles(self, terms, limit, min_score=0.5):
+        """
+        Rows of search_movie_titles: every term must start a word of the title or come close to one
+        by trigram similarity, best total score first then IMDb votes
+        """
+        if not terms:
+            movies = self.movies_by_page_order[:limit]
+        else:
+            vocabulary, postings, titles = self.title_index()
+            scores = None
+            for term in terms:
+                term_trigrams = _trigrams(term)
+                shared = Counter(
+                    i for trigram in term_trigrams for i in postings.get(trigram, [])
+                )
+                # a Dice similarity of min_score needs this many shared trigrams at least
+                needed = max(1, int(min_score * len(term_trigrams) / 2))
+                term_scores = {}
+                for i, count in shared.items():
+                    if count < needed:
+                        continue
+                    score = _word_score(term, vocabulary[i], term_trigrams)
+                    if score < min_score:
+                        continue
+                    for position in titles[i]:
+                        term_scores[position] = max(term_scores.get(position, 0), score)
+                scores = (
+                    term_scores
+                    if scores is None
+                    else {
+                        position: scores[position] + score
+                        for position, score in term_scores.items()
+                        if position in scores
+                    }
+                )
+            # positions follow the votes order, so sorting on them breaks ties by votes
+            best = sorted(scores, key=lambda position: (-scores[position], position))
+            movies = [self.movies_by_page_order[position] for position in best[:limit]]
+        return [
+            {
+                "MovieID": movie["id"],
+                "Movie.title": movie["properties"].get("title"),
+                "Movie.imdbVotes": movie["properties"].get("imdbVotes"),
+            }
+            for movie in movies
+        ]
+
+    def poster_index(self):
+        with self._poster_index_lock:
+            if self._poster_index is None:
+                store = open_embedding_store("poster")
+                if store is None:
+                    raise FileNotFoundError(
+                        "The local backend needs the poster embedding store, export it with functions.local_graph"
+                    )
+                self._poster_index = EmbeddingIndex(
+                    store.ids, store.vectors, store.genres, norms=store.norms
+                )
+            return self._poster_index
+
+    def poster_embedding_similarity(self, id, k=5):
+        """
+        Exact cosine kNN over the poster store, the rows of poster_embedding_similarity
+        """
+        index = self.poster_index()
+        row = index.row_of.get(id)
+        if row is None or id not in self.movie_by_id or k <= 0:
+            return []
+        scores = index.cosine_scores(index.unit_vectors([row]))[0]
+        scores[row] = -np.inf
+        k = min(k, len(index) - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        source = self.movie_by_id[id]["properties"]
+        return [
+            {
+                "source_id": id,
+                "source": source,
+                "target_id": index.ids[i],
+                "target": self.movie_by_id[index.ids[i]]["properties"],
+                "similarity": float(scores[i]),
+            }
+            for i in top
+            if index.ids[i] in self.movie_by_id
+        ]
+
+
+def load_local_graph(directory=LOCAL_GRAPH_DIR):
+    path = catalogue_path(directory)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No local graph in {directory}, export it with python -m functions.local_graph export"
+        )
+    with open(path) as f:
+        catalogue = json.load(f)
+    graph = LocalGraph(catalogue["genres"], catalogue["movies"])
+    logger.info(
+        f"Local graph loaded: {len(graph.movies)} movies, {len(graph.genres)} genres"
+    )
+    return graph
+
+
+_local_graph = None
+_local_graph_lock = threading.Lock()
+
+
+def get_local_graph():
+    """
+    Returns the process-wide local graph, loading it on first use
+    """
+    global _local_graph
+    with _local_graph_lock:
+        if _local_graph is None:
+            _local_graph = load_local_graph()
+        return _local_graph
+
+
+def export_local_graph(directory=LOCAL_GRAPH_DIR, dtype="float32"):
+    """
+    Exports everything the local backend serves from: the Movie / Genre catalogue to catalogue.json,
+    the rating matrix to RATING_MATRIX_PATH and the plot / poster embedding stores
+    """
+    if get_driver() is None:
+        raise RuntimeError(
+            "Exporting the local graph needs a Neo4j connection, run it with RECSYS_BACKEND=neo4j"
+        )
+    genres_query = """
+    MATCH (g:Genre)
+    RETURN elementId(g) AS id, ID(g) AS neo4j_id, properties(g) AS properties
+    """
+    movies_query = f"""
+    MATCH (m:Movie)
+    OPTIONAL MATCH (m)-[:IN_GENRE]->(g:Genre)
+    RETURN elementId(m) AS id, ID(m) AS neo4j_id,
+           apoc.map.removeKeys(m, {json.dumps(EMBEDDING_PROPERTIES)}) AS properties,
+           collect(elementId(g)) AS genres
+    """
+    genres = run_cypher(get_driver(), genres_query)
+    movies = list(run_cypher(get_driver(), movies_query, stream=True))
+    os.makedirs(directory, exist_ok=True)
+    path = catalogue_path(directory)
+    # temporal properties are not JSON, keep their ISO strings
+    with open(path + ".tmp", "w") as f:
+        json.dump({"genres": genres, "movies": movies}, f, default=str)
+    os.replace(path + ".tmp", path)
+    logger.info(f"Exported {len(movies)} movies and {len(genres)} genres to {path}")
+
+    load_rating_matrix().save(RATING_MATRIX_PATH)
+    for name in ["plot", "poster"]:
+        export_embeddings(name, dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the graph for the local (RECSYS_BACKEND=local) backend"
+    )
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--dir", default=LOCAL_GRAPH_DIR)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    args = parser.parse_args()
+    export_local_graph(args.dir, args.dtype)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+from functions.connections import get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import QueryExecutor
+from functions.helper_functions.query_cache import invalidate_query_cache
+from functions.embedding_store import open_embedding_store, EMBEDDING_STORE_DIR
+from functions.embedding_index import EmbeddingIndex
+from functions.rating_matrix import load_rating_matrix
+from functions.als_model import LIKED_RATING
+from functions.helper_functions.logging_config import get_logger
+import os
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+logger = get_logger(__name__, "EMBEDDING_INDEX_LOG_FILE_PATH")
+
+NEIGHBOUR_TABLE_DIR = os.getenv("NEIGHBOUR_TABLE_DIR", "data/neighbour_tables")
+# neighbours kept per movie and signal, requests for more than this fall back to the live engines
+NEIGHBOUR_TOP_K = int(os.getenv("NEIGHBOUR_TOP_K", "20"))
+NEIGHBOUR_WORKERS = int(os.getenv("NEIGHBOUR_WORKERS", str(os.cpu_count() or 1)))
+# source movies scored per worker task, one (block x movies) score matrix at a time
+NEIGHBOUR_BLOCK_SIZE = int(os.getenv("NEIGHBOUR_BLOCK_SIZE", "256"))
+# source movies whose relationships are replaced per write transaction
+NEIGHBOUR_WRITE_BATCH_SIZE = int(os.getenv("NEIGHBOUR_WRITE_BATCH_SIZE", "500"))
+# co-rating neighbours need at least this many users who liked both movies
+CO_RATING_MIN_SUPPORT = int(os.getenv("CO_RATING_MIN_SUPPORT", "2"))
+# a refresh touching more movies than this share of the catalogue rebuilds the whole table
+NEIGHBOUR_REBUILD_SHARE = 0.5
+
+SIMILAR_RELATIONSHIP = "SIMILAR"
+# plot: cosine of the plot embeddings among movies sharing a genre, like plot_embedding_similarity_genre
+# poster: cosine of the poster embeddings over every movie, like poster_embedding_similarity
+# co_rating: cosine of the sets of users who liked each movie (rated it LIKED_RATING or more)
+METHODS = ["plot", "poster", "co_rating"]
+
+WRITE_NEIGHBOURS_QUERY = f"""
+UNWIND $rows AS row
+MATCH (source:Movie)
+WHERE elementId(source) = row.source_id
+CALL {{
+    WITH source
+    MATCH (source)-[old:{SIMILAR_RELATIONSHIP}]->(:Movie)
+    WHERE old.method = $method
+    DELETE old
+}}
+WITH source, row
+UNWIND row.targets AS target_row
+MATCH (target:Movie)
+WHERE elementId(target) = target_row.id
+CREATE (source)-[:{SIMILAR_RELATIONSHIP} {{method: $method, score: target_row.score}}]->(target)
+"""
+
+
+class EmbeddingScorer:
+    """
+    Cosine scores of source movies against every movie of an embedding store, opened memory-mapped
+    so the workers of the pool share the page cache instead of each holding a copy
+    """
+
+    def __init__(self, name, directory, same_genre):
+        store = open_embedding_store(name, directory)
+        self.index = EmbeddingIndex(
+            store.ids, store.vectors, store.genres, norms=store.norms
+        )
+        self.same_genre = same_genre
+
+    def scores(self, rows):
+        scores = self.index.cosine_scores(self.index.unit_vectors(rows))
+        if self.same_genre:
+            masks = np.stack([self.index.same_genre_mask(row) for row in rows])
+            scores = np.where(masks, scores, -np.inf)
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+
+class CoRatingScorer:
+    """
+    Cosine of the liked-by user sets: users who liked both movies / sqrt(likes of each),
+    pairs with fewer than min_support shared users are left out
+    """
+
+    def __init__(self, liked, min_support):
+        # users x movies, one column slice per source block
+        self.liked = sp.csc_matrix(liked, dtype=np.float32)
+        self.by_user = self.liked.tocsr()
+        counts = np.asarray(self.liked.sum(axis=0)).ravel()
+        counts[counts == 0] = 1.0
+        self.inv_norms = 1.0 / np.sqrt(counts)
+        self.min_support = min_support
+
+    def scores(self, rows):
+        shared = (self.liked[:, rows].T @ self.by_user).toarray()
+        scores = shared * self.inv_norms[rows, None] * self.inv_norms[None, :]
+        scores[shared < max(1, self.min_support)] = -np.inf
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores.astype(np.float32)
+
+
+def top_k_rows(scores, k):
+    """
+    (targets, scores) of the k best columns of every row, best first
+    Rows with fewer than k finite scores are padded with target -1 and score -inf
+    """
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1).astype(np.int32)
+    top_scores = np.take_along_axis(top_scores, order, axis=1).astype(np.float32)
+    top[~np.isfinite(top_scores)] = -1
+    return top, top_scores
+
+
+def make_scorer(method, payload):
+    if method == "co_rating":
+        return CoRatingScorer(payload, CO_RATING_MIN_SUPPORT)
+    return EmbeddingScorer(method, payload, same_genre=method == "plot")
+
+
+# the scorer of a pool worker, built once by _init_worker instead of being pickled with every task
+_worker_scorer = None
+_worker_k = None
+
+
+def _init_worker(method, payload, k):
+    global _worker_scorer, _worker_k
+    _worker_scorer = make_scorer(method, payload)
+    _worker_k = k
+
+
+def _score_block(rows):
+    targets, scores = top_k_rows(_worker_scorer.scores(rows), _worker_k)
+    return rows, targets, scores
+
+
+def score_rows(method, payload, rows, count, k, workers=NEIGHBOUR_WORKERS):
+    """
+    Top k neighbours of the given rows, (count, k) target / score arrays with only those rows filled
+    The rows are scored in blocks of NEIGHBOUR_BLOCK_SIZE across a process pool,
+    workers <= 1 scores them in this process
+    """
+    targets = np.full((count, k), -1, dtype=np.int32)
+    scores = np.full((count, k), -np.inf, dtype=np.float32)
+    rows = np.asarray(rows, dtype=np.int64)
+    blocks = [
+        rows[start : start + NEIGHBOUR_BLOCK_SIZE]
+        for start in range(0, len(rows), NEIGHBOUR_BLOCK_SIZE)
+    ]
+
+    def fill(results):
+        for block, block_targets, block_scores in results:
+            width = block_targets.shape[1]
+            targets[block, :width] = block_targets
+            scores[block, :width] = block_scores
+
+    if workers <= 1 or len(blocks) <= 1:
+        _init_worker(method, payload, k)
+        fill(map(_score_block, blocks))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(blocks)),
+            initializer=_init_worker,
+            initargs=(method, payload, k),
+        ) as pool:
+            fill(pool.map(_score_block, blocks))
+    return targets, scores
+
+
+def _fingerprint(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def load_signal(method, directory=EMBEDDING_STORE_DIR):
+    """
+    (movie ids, fingerprint of every movie's input, scorer payload) of one signal
+    A fingerprint changes when the movie's embedding (and genres for plot) or its set of likers changes,
+    the payload is what make_scorer needs in every worker: the store directory or the liked matrix
+    """
+    if method == "co_rating":
+        ratings = load_rating_matrix()
+        liked = (ratings.matrix >= LIKED_RATING).astype(np.float32).tocsc()
+        user_ids = np.asarray([str(user_id) for user_id in ratings.user_ids])
+        fingerprints = [
+            _fingerprint(
+                "\n".join(
+                    sorted(
+                        user_ids[
+                            liked.indices[liked.indptr[col] : liked.indptr[col + 1]]
+                        ]
+                    )
+                ).encode()
+            )
+            for col in range(liked.shape[1])
+        ]
+        return ratings.movie_ids, fingerprints, liked
+
+    store = open_embedding_store(method, directory)
+    if store is None:
+        raise FileNotFoundError(
+            f"No {method} embedding store in {directory}, export it with python -m functions.embedding_store export {method}"
+        )
+    fingerprints = []
+    for row in range(len(store)):
+        genres = ",".join(sorted(store.genres[row])) if method == "plot" else ""
+        fingerprints.append(
+            _fingerprint(np.asarray(store.vectors[row]).tobytes(), genres.encode())
+        )
+    return store.ids, fingerprints, directory
+
+
+class NeighbourTable:
+    """
+    The top k neighbours of every movie for one signal, row i holding movie_ids[i]'s neighbours
+    as indices into movie_ids (-1 past the last one) and their scores, best first.
+    fingerprints keep what every row was computed from, so a refresh finds the movies that changed.
+    """
+
+    def __init__(self, method, movie_ids, fingerprints, targets, scores):
+        self.method = method
+        self.movie_ids = list(movie_ids)
+        self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.fingerprints = list(fingerprints)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    @property
+    def k(self):
+        return self.targets.shape[1]
+
+    def neighbours(self, movie_id, k=5):
+        """
+        Returns [(target_id, score), ...], best first, [] for a movie missing from the table
+        """
+        row = self.movie_index.get(movie_id)
+        if row is None:
+            return []
+        return [
+            (self.movie_ids[target], float(score))
+            for target, score in zip(self.targets[row, :k], self.scores[row, :k])
+            if target >= 0
+        ]
+
+    def relationship_rows(self, movie_ids):
+        # the $rows of WRITE_NEIGHBOURS_QUERY
+        return [
+            {
+                "source_id": movie_id,
+                "targets": [
+                    {"id": target_id, "score": score}
+                    for target_id, score in self.neighbours(movie_id, self.k)
+                ],
+            }
+            for movie_id in movie_ids
+        ]
+
+    def save(self, directory=NEIGHBOUR_TABLE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = neighbour_table_path(self.method, directory)
+        np.savez(
+            path,
+            movie_ids=np.asarray(self.movie_ids),
+            fingerprints=np.asarray(self.fingerprints),
+            targets=self.targets,
+            scores=self.scores,
+        )
+        logger.info(f"{self.method} neighbour table saved to {path}")
+
+    @classmethod
+    def load(cls, method, directory=NEIGHBOUR_TABLE_DIR):
+        with np.load(neighbour_table_path(method, directory)) as saved:
+            return cls(
+                method,
+                saved["movie_ids"].tolist(),
+                saved["fingerprints"].tolist(),
+                saved["targets"],
+                saved["scores"],
+            )
+
+
+def neighbour_table_path(method, directory=NEIGHBOUR_TABLE_DIR):
+    return os.path.join(directory, f"{method}.npz")
+
+
+def build_neighbour_table(method, k=NEIGHBOUR_TOP_K, workers=NEIGHBOUR_WORKERS):
+    start = time.perf_counter()
+    movie_ids, fingerprints, payload = load_signal(method)
+    targets, scores = score_rows(
+        method, payload, range(len(movie_ids)), len(movie_ids), k, workers
+    )
+    logger.info(
+        f"{method} neighbour table built for {len(movie_ids)} movies in {time.perf_counter() - start:.1f} s"
+    )
+    return NeighbourTable(method, movie_ids, fingerprints, targets, scores)
+
+
+def refresh_neighbour_table(table, k=NEIGHBOUR_TOP_K, workers=NEIGHBOUR_WORKERS):
+    """
+    Recomputes only the rows that can have changed since the table was built:
+    movies whose fingerprint changed or that are new, movies listing a changed or removed movie
+    as a neighbour, and movies a changed movie now scores above their current k-th neighbour
+    Returns (table, movie ids whose neighbours changed), None instead of the ids when the table was rebuilt
+    """
+    movie_ids, fingerprints, payload = load_signal(table.method)
+    if k != table.k:
+        logger.info(f"{table.method} neighbour count changed, rebuilding the table")
+        return build_neighbour_table(table.method, k, workers), None
+
+    count = len(movie_ids)
+    old_rows = np.asarray(
+        [table.movie_index.get(movie_id, -1) for movie_id in movie_ids]
+    )
+    changed = np.asarray(
+        [
+            old_row < 0 or table.fingerprints[old_row] != fingerprint
+            for old_row, fingerprint in zip(old_rows, fingerprints)
+        ],
+        dtype=bool,
+    )
+    if changed.sum() > NEIGHBOUR_REBUILD_SHARE * count:
+        logger.info(f"Most {table.method} inputs changed, rebuilding the table")
+        return build_neighbour_table(table.method, k, workers), None
+
+    # carry the unchanged rows over, old target positions mapped to the new ones, -2 for removed movies,
+    # the -1 padding indexes the extra last entry and stays -1
+    new_position = np.full(len(table.movie_ids) + 1, -1, dtype=np.int64)
+    new_position[:-1] = -2
+    new_position[old_rows[old_rows >= 0]] = np.flatnonzero(old_rows >= 0)
+    targets = np.full((count, k), -1, dtype=np.int32)
+    scores = np.full((count, k), -np.inf, dtype=np.float32)
+    kept = old_rows >= 0
+    targets[kept] = new_position[table.targets[old_rows[kept]]]
+    scores[kept] = table.scores[old_rows[kept]]
+
+    listed = targets >= 0
+    affected = changed | (targets == -2).any(axis=1)
+    affected |= (listed & changed[np.where(listed, targets, 0)]).any(axis=1)
+    # the scores are symmetric, a changed movie's row says how it now scores for every other movie
+    changed_rows = np.flatnonzero(changed)
+    if len(changed_rows):
+        scorer = make_scorer(table.method, payload)
+        kth = scores[:, -1]
+        for start in range(0, len(changed_rows), NEIGHBOUR_BLOCK_SIZE):
+            block = scorer.scores(changed_rows[start : start + NEIGHBOUR_BLOCK_SIZE])
+            affected |= (block > kth[None, :]).any(axis=0)
+
+    rows = np.flatnonzero(affected)
+    new_targets, new_scores = score_rows(table.method, payload, rows, count, k, workers)
+    targets[rows] = new_targets[rows]
+    scores[rows] = new_scores[rows]
+    logger.info(
+        f"{table.method} neighbour table refreshed: {int(changed.sum())} movies changed, "
+        f"{len(rows)} rows recomputed"
+    )
+    refreshed = NeighbourTable(table.method, movie_ids, fingerprints, targets, scores)
+    # movies that left the signal keep no neighbours, writing them clears their relationships
+    removed = [
+        movie_id
+        for movie_id in table.movie_ids
+        if movie_id not in refreshed.movie_index
+    ]
+    return refreshed, [movie_ids[row] for row in rows] + removed
+
+
+def write_neighbour_table(table, movie_ids=None, batch_size=NEIGHBOUR_WRITE_BATCH_SIZE):
+    """
+    Writes the table as (:Movie)-[:SIMILAR {method, score}]->(:Movie) relationships
+    movie_ids limits the write to those source movies, each batch replaces their relationships of this method
+    in one transaction, None replaces every relationship of the method
+    """
+    executor = QueryExecutor(get_driver())
+    with get_driver().session() as session:
+        session.run(f"""
+            CREATE INDEX similarMethod IF NOT EXISTS
+            FOR ()-[s:{SIMILAR_RELATIONSHIP}]-()
+            ON (s.method)
+            """).consume()
+        if movie_ids is None:
+            # CALL { } IN TRANSACTIONS must run in an auto-commit transaction, hence session.run
+            session.run(
+                f"""
+                MATCH ()-[s:{SIMILAR_RELATIONSHIP}]->()
+                WHERE s.method = $method
+                CALL {{ WITH s DELETE s }} IN TRANSACTIONS OF 10000 ROWS
+                """,
+                {"method": table.method},
+            ).consume()
+    movie_ids = table.movie_ids if movie_ids is None else list(movie_ids)
+    start = time.perf_counter()
+    for batch in range(0, len(movie_ids), batch_size):
+        rows = table.relationship_rows(movie_ids[batch : batch + batch_size])
+        executor.write(WRITE_NEIGHBOURS_QUERY, {"rows": rows, "method": table.method})
+    invalidate_query_cache()
+    logger.info(
+        f"{table.method} neighbours of {len(movie_ids)} movies written in {time.perf_counter() - start:.1f} s"
+    )
+    return len(movie_ids)
+
+
+_neighbour_tables = {}
+_neighbour_tables_lock = threading.Lock()
+
+
+def get_neighbour_table(method, directory=NEIGHBOUR_TABLE_DIR):
+    """
+    Returns the process-wide neighbour table of one signal, loading it from disk on first use
+    Returns None if the table has not been built yet, except on the local backend,
+    which builds it in memory from the embedding stores and the rating matrix
+    """
+    with _neighbour_tables_lock:
+        if method not in _neighbour_tables:
+            if os.path.exists(neighbour_table_path(method, directory)):
+                _neighbour_tables[method] = NeighbourTable.load(method, directory)
+                logger.info(f"{method} neighbour table loaded from {directory}")
+            elif RECSYS_BACKEND == "local":
+                # no process pool inside the app server
+                _neighbour_tables[method] = build_neighbour_table(method, workers=1)
+        return _neighbour_tables.get(method)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the top k neighbours of every movie as SIMILAR relationships"
+    )
+    parser.add_argument("command", choices=["build", "refresh"])
+    parser.add_argument(
+        "methods", nargs="*", help=f"any of {', '.join(METHODS)}, defaults to all"
+    )
+    parser.add_argument("--top-k", type=int, default=NEIGHBOUR_TOP_K)
+    parser.add_argument("--workers", type=int, default=NEIGHBOUR_WORKERS)
+    parser.add_argument("--dir", default=NEIGHBOUR_TABLE_DIR)
+    args = parser.parse_args()
+    unknown = set(args.methods) - set(METHODS)
+    if unknown:
+        parser.error(f"unknown methods: {', '.join(sorted(unknown))}")
+
+    for method in args.methods or METHODS:
+        path = neighbour_table_path(method, args.dir)
+        if args.command == "build" or not os.path.exists(path):
+            table = build_neighbour_table(method, args.top_k, args.workers)
+            changed = None
+        else:
+            table, changed = refresh_neighbour_table(
+                NeighbourTable.load(method, args.dir), args.top_k, args.workers
+            )
+        table.save(args.dir)
+        # the local backend reads the saved table, there is no graph to write to
+        if RECSYS_BACKEND != "local":
+            write_neighbour_table(table, changed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import numpy as np
+
+# Codecs compressing unit-normalized embeddings, used by the IVF index of functions.ann_index.
+# Scores are asymmetric: the query stays float32 and is compared against the compressed rows
+# directly, rows are never decoded back to float32 as a whole.
+
+
+class Float32Codec:
+    """
+    No compression, 4 bytes per dimension
+    """
+
+    name = "float32"
+
+    def fit(self, vectors):
+        return self
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, query, codes):
+        return codes @ query
+
+    def state(self):
+        return {}
+
+    def nbytes(self):
+        return 0
+
+
+class Float16Codec(Float32Codec):
+    """
+    Half precision, 2 bytes per dimension
+    """
+
+    name = "float16"
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors, dtype=np.float16)
+
+    def scores(self, query, codes):
+        return np.asarray(codes, dtype=np.float32) @ query
+
+
+class Int8Codec(Float32Codec):
+    """
+    Scalar quantization, every dimension mapped onto 256 levels between its min and max, 1 byte per dimension
+    """
+
+    name = "int8"
+
+    def __init__(self, low=None, step=None):
+        self.low = low
+        self.step = step
+
+    def fit(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.low = vectors.min(axis=0)
+        step = (vectors.max(axis=0) - self.low) / 255
+        step[step == 0] = 1.0
+        self.step = step.astype(np.float32)
+        return self
+
+    def encode(self, vectors):
+        levels = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.step)
+        return np.clip(levels, 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return self.low + np.asarray(codes, dtype=np.float32) * self.step
+
+    def scores(self, query, codes):
+        # (low + code * step) . q == low . q + code . (step * q)
+        return codes.astype(np.float32) @ (self.step * query) + self.low @ query
+
+    def state(self):
+        return {"low": self.low, "step": self.step}
+
+    def nbytes(self):
+        return self.low.nbytes + self.step.nbytes
+
+
+def _kmeans(vectors, k, iterations, rng):
+    # plain Euclidean k-means, for the sub-vector codebooks of PQCodec
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        # ||x||^2 is the same for every centroid, leave it out
+        distances = (centroids**2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        assignment = np.argmin(distances, axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # an empty cluster restarts from a random row
+        centroids[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()))]
+    return centroids
+
+
+class PQCodec(Float32Codec):
+    """
+    Product quantization: the vector is split into subspaces sub-vectors, each replaced by the id of
+    the nearest of 256 centroids learned for its subspace, 1 byte per subspace
+    Scores use a per-query lookup table of sub-vector dot products (asymmetric distance computation)
+    """
+
+    name = "pq"
+
+    def __init__(self, subspaces=None, codebooks=None):
+        self.subspaces = subspaces
+        self.codebooks = codebooks
+
+    def fit(self, vectors, iterations=15, sample_size=20000, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        # 16 dimensions per sub-vector by default, 96 bytes for a 1536 dimension plot embedding
+        self.subspaces = self.subspaces or max(1, dim // 16)
+        if dim % self.subspaces:
+            raise ValueError(
+                f"{dim} dimensions do not split into {self.subspaces} subspaces"
+            )
+        rng = np.random.default_rng(seed)
+        sample = vectors[
+            rng.choice(len(vectors), min(len(vectors), sample_size), replace=False)
+        ]
+        centroids = min(256, len(sample))
+        width = dim // self.subspaces
+        self.codebooks = np.stack(
+            [
+                _kmeans(
+                    sample[:, j * width : (j + 1) * width], centroids, iterations, rng
+                )
+                for j in range(self.subspaces)
+            ]
+        )
+        return self
+
+    def _split(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(len(vectors), self.subspaces, -1)
+
+    def encode(self, vectors, block_size=8192):
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        squared = (self.codebooks**2).sum(axis=2)
+        for start in range(0, len(vectors), block_size):
+            parts = self._split(vectors[start : start + block_size])
+            for j in range(self.subspaces):
+                # distances to the subspace's centroids up to the constant ||x||^2
+                distances = squared[j] - 2 * parts[:, j] @ self.codebooks[j].T
+                codes[start : start + block_size, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        parts = self.codebooks[np.arange(self.subspaces), codes]
+        return parts.reshape(len(codes), -1)
+
+    def scores(self, query, codes):
+        table = np.einsum(
+            "scw,sw->sc", self.codebooks, query.reshape(self.subspaces, -1)
+        )
+        return table[np.arange(self.subspaces), codes].sum(axis=1)
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+    def nbytes(self):
+        return self.codebooks.nbytes
+
+
+CODECS = {
+    codec.name: codec for codec in [Float32Codec, Float16Codec, Int8Codec, PQCodec]
+}
+
+
+def make_codec(name, pq_subspaces=None):
+    if name not in CODECS:
+        raise ValueError(f"Unknown quantization {name}, use one of {', '.join(CODECS)}")
+    if name == "pq":
+        return PQCodec(pq_subspaces)
+    return CODECS[name]()
+
+
+def codec_from_state(name, state):
+    """
+    Rebuilds a fitted codec from its name and state(), as saved with the IVF index
+    """
+    if name == "int8":
+        return Int8Codec(state["low"], state["step"])
+    if name == "pq":
+        return PQCodec(len(state["codebooks"]), state["codebooks"])
+    return make_codec(name)
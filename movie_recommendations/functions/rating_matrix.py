@@ -0,0 +1,142 @@
+from functions.connections import get_driver, RECSYS_BACKEND
+from functions.helper_functions.cypher import run_cypher
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.logging_config import get_logger
+import os
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+logger = get_logger(__name__, "RATING_MATRIX_LOG_FILE_PATH")
+
+# where the local backend reads the rating matrix from
+RATING_MATRIX_PATH = os.getenv("RATING_MATRIX_PATH", "data/local_graph/ratings.npz")
+
+
+class RatingMatrix:
+    """
+    Sparse user x movie rating matrix exported from the (:User)-[:RATED]->(:Movie) edges.
+    Rows follow user_ids, columns follow movie_ids (every Movie node, rated or not).
+    """
+
+    def __init__(self, user_ids, movie_ids, matrix, imdb_votes, watermark):
+        """
+        user_ids: userId of each row
+        movie_ids: element id of each column
+        matrix: CSR float32 ratings, 0 means not rated
+        imdb_votes: imdbVotes of each column, NaN when missing
+        watermark: latest RATED timestamp included in the matrix
+        """
+        self.user_ids = list(user_ids)
+        self.movie_ids = list(movie_ids)
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.matrix = sp.csr_matrix(matrix, dtype=np.float32)
+        self.imdb_votes = np.asarray(imdb_votes, dtype=np.float64)
+        self.watermark = watermark
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def save(self, path=RATING_MATRIX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.asarray(self.matrix.shape),
+            user_ids=np.asarray(self.user_ids),
+            movie_ids=np.asarray(self.movie_ids),
+            imdb_votes=self.imdb_votes,
+            watermark=np.asarray(self.watermark),
+        )
+        logger.info(f"Rating matrix saved to {path}")
+
+    @classmethod
+    def load(cls, path=RATING_MATRIX_PATH):
+        with np.load(path) as saved:
+            matrix = sp.csr_matrix(
+                (saved["data"], saved["indices"], saved["indptr"]),
+                shape=tuple(saved["shape"]),
+            )
+            return cls(
+                saved["user_ids"].tolist(),
+                saved["movie_ids"].tolist(),
+                matrix,
+                saved["imdb_votes"],
+                saved["watermark"].item(),
+            )
+
+
+def load_rating_matrix():
+    """
+    Streams every RATED edge out of Neo4j and builds a RatingMatrix
+    The local backend reads the exported matrix from RATING_MATRIX_PATH instead
+    """
+    if RECSYS_BACKEND == "local":
+        return RatingMatrix.load(RATING_MATRIX_PATH)
+
+    movies_query = """
+    MATCH (m:Movie)
+    RETURN elementId(m) AS movie_id, m.imdbVotes AS imdb_votes
+    """
+    ratings_query = """
+    MATCH (u:User)-[r:RATED]->(m:Movie)
+    RETURN u.userId AS user_id, elementId(m) AS movie_id, r.rating AS rating, r.timestamp AS timestamp
+    """
+    movie_ids, imdb_votes = [], []
+    for row in run_cypher(get_driver(), movies_query, stream=True):
+        movie_ids.append(row["movie_id"])
+        imdb_votes.append(
+            np.nan if row["imdb_votes"] is None else float(row["imdb_votes"])
+        )
+    movie_index = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+
+    user_index = {}
+    rows, cols, ratings = [], [], []
+    watermark = 0
+    for row in run_cypher(get_driver(), ratings_query, stream=True):
+        col = movie_index.get(row["movie_id"])
+        if col is None or row["rating"] is None:
+            continue
+        rows.append(user_index.setdefault(row["user_id"], len(user_index)))
+        cols.append(col)
+        ratings.append(row["rating"])
+        if row["timestamp"] is not None:
+            watermark = max(watermark, row["timestamp"])
+
+    matrix = sp.csr_matrix(
+        (np.asarray(ratings, dtype=np.float32), (rows, cols)),
+        shape=(len(user_index), len(movie_ids)),
+    )
+    logger.info(
+        f"Rating matrix loaded: {matrix.shape[0]} users, {matrix.shape[1]} movies, {matrix.nnz} ratings"
+    )
+    return RatingMatrix(list(user_index), movie_ids, matrix, imdb_votes, watermark)
+
+
+_rating_matrix = None
+_rating_matrix_lock = threading.Lock()
+
+
+def get_rating_matrix():
+    """
+    Returns the process-wide rating matrix, loaded with load_rating_matrix on first use
+    """
+    global _rating_matrix
+    with _rating_matrix_lock:
+        if _rating_matrix is None:
+            _rating_matrix = load_rating_matrix()
+        return _rating_matrix
+
+
+def reset_rating_matrix():
+    global _rating_matrix
+    with _rating_matrix_lock:
+        _rating_matrix = None
+
+
+# the matrix is exported from the RATED edges, the next query reloads it
+QUERY_CACHE.add_invalidation_listener(reset_rating_matrix)
@@ -0,0 +1,143 @@
+from functions.rating_matrix import get_rating_matrix
+from functions.helper_functions.query_cache import QUERY_CACHE
+from functions.helper_functions.logging_config import get_logger
+import os
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+logger = get_logger(__name__, "RATING_MATRIX_LOG_FILE_PATH")
+
+# a user agrees with a seed when they rated it within this many stars of the seed's rating
+RATING_TOLERANCE = float(os.getenv("RATING_TOLERANCE", "0.5"))
+# most similar users whose ratings are aggregated
+RATING_NEIGHBOURS = int(os.getenv("RATING_NEIGHBOURS", "100"))
+# candidates need ratings from at least this many neighbours
+RATING_MIN_SUPPORT = int(os.getenv("RATING_MIN_SUPPORT", "2"))
+# neighbour weight of the catalogue mean every score is pulled towards, damps movies few neighbours rated
+RATING_SHRINKAGE = float(os.getenv("RATING_SHRINKAGE", "2.0"))
+
+
+class RatingNeighbours:
+    """
+    User-based collaborative filtering on the sparse user x movie rating matrix.
+    A profile of (movie, rating) seeds is matched against every user who rated a seed within
+    the tolerance band, the closest users are kept as neighbours and each other movie is scored
+    by the similarity-weighted mean of the neighbours' ratings.
+    """
+
+    def __init__(self, ratings):
+        self.movie_ids = ratings.movie_ids
+        self.movie_index = ratings.movie_index
+        self.imdb_votes = np.nan_to_num(ratings.imdb_votes, nan=0.0)
+        self.by_user = ratings.matrix
+        # the seeds are columns, CSC slices them without scanning every user
+        self.by_movie = ratings.matrix.tocsc()
+        self.mean_rating = (
+            float(ratings.matrix.data.mean()) if ratings.matrix.nnz else 0.0
+        )
+
+    def neighbours(self, seeds, tolerance=RATING_TOLERANCE, count=RATING_NEIGHBOURS):
+        """
+        seeds: [(column, rating), ...]
+        Returns (users, similarities) of the count most similar users, most similar first
+        A user's similarity is their mean agreement over the seeds: 1 for the same rating,
+        falling linearly to 0 just past the tolerance band, 0 for a seed they did not rate
+        """
+        users, weights = [], []
+        for col, rating in seeds:
+            start, end = self.by_movie.indptr[col], self.by_movie.indptr[col + 1]
+            difference = np.abs(self.by_movie.data[start:end] - rating)
+            within = difference <= tolerance
+            users.append(self.by_movie.indices[start:end][within])
+            weights.append(1 - difference[within] / (tolerance + 0.5))
+        users = np.concatenate(users)
+        if len(users) == 0:
+            return users, np.zeros(0, dtype=np.float32)
+        users, inverse = np.unique(users, return_inverse=True)
+        similarities = np.bincount(inverse, weights=np.concatenate(weights)) / len(
+            seeds
+        )
+        if len(users) > count:
+            top = np.argpartition(-similarities, count - 1)[:count]
+            users, similarities = users[top], similarities[top]
+        order = np.argsort(-similarities, kind="stable")
+        return users[order], similarities[order]
+
+    def recommend(
+        self,
+        seeds,
+        k=5,
+        tolerance=RATING_TOLERANCE,
+        neighbours=RATING_NEIGHBOURS,
+        min_support=RATING_MIN_SUPPORT,
+        shrinkage=RATING_SHRINKAGE,
+    ):
+        """
+        seeds: [(movie_id, rating), ...], movies missing from the matrix are ignored
+        Returns [(rec_id, score, support), ...], best score first, ties broken by imdbVotes
+        score is the similarity-weighted mean rating of the neighbours, shrunk towards the catalogue mean,
+        support the number of neighbours who rated the movie
+        """
+        seeds = [
+            (self.movie_index[movie_id], float(rating))
+            for movie_id, rating in seeds
+            if movie_id in self.movie_index
+        ]
+        if not seeds:
+            return []
+        users, similarities = self.neighbours(seeds, tolerance, neighbours)
+        if len(users) == 0:
+            return []
+
+        rated = self.by_user[users]
+        weighted = rated.T @ similarities
+        weight = (
+            sp.csr_matrix(
+                (np.ones_like(rated.data), rated.indices, rated.indptr),
+                shape=rated.shape,
+            ).T
+            @ similarities
+        )
+        support = np.bincount(rated.indices, minlength=rated.shape[1])
+        scores = (weighted + shrinkage * self.mean_rating) / (weight + shrinkage)
+
+        candidates = support >= max(1, min_support)
+        candidates[[col for col, _ in seeds]] = False
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) == 0:
+            return []
+        # best score first, imdbVotes breaks ties
+        candidates = candidates[
+            np.lexsort((-self.imdb_votes[candidates], -scores[candidates]))[:k]
+        ]
+        return [
+            (self.movie_ids[col], float(scores[col]), int(support[col]))
+            for col in candidates
+        ]
+
+
+_rating_neighbours = None
+_rating_neighbours_lock = threading.Lock()
+
+
+def get_rating_neighbours():
+    """
+    Returns the process-wide neighbour engine, built from the rating matrix on first use
+    """
+    global _rating_neighbours
+    with _rating_neighbours_lock:
+        if _rating_neighbours is None:
+            _rating_neighbours = RatingNeighbours(get_rating_matrix())
+            logger.info("Rating neighbour engine built from the rating matrix")
+        return _rating_neighbours
+
+
+def reset_rating_neighbours():
+    global _rating_neighbours
+    with _rating_neighbours_lock:
+        _rating_neighbours = None
+
+
+# built on the rating matrix, rebuilt from the reloaded one on the next query
+QUERY_CACHE.add_invalidation_listener(reset_rating_neighbours)
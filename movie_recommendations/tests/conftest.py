@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+# the app imports its packages from the movie_recommendations directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# everything runs on in-memory data, no test connects to Neo4j
+os.environ["RECSYS_BACKEND"] = "local"
+
+
+@pytest.fixture
+def synthetic_graph(tmp_path, monkeypatch):
+    """
+    A small synthetic export of the local backend in tmp_path, the rating matrix read from there
+    """
+    from benchmarks.recommenders import write_synthetic_graph
+    import functions.rating_matrix as rating_matrix
+
+    write_synthetic_graph(
+        str(tmp_path),
+        movies=300,
+        users=400,
+        ratings_per_user=15,
+        genres=6,
+        plot_dim=32,
+        poster_dim=16,
+    )
+    monkeypatch.setattr(
+        rating_matrix, "RATING_MATRIX_PATH", str(tmp_path / "ratings.npz")
+    )
+    return tmp_path
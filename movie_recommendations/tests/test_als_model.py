@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from functions.als_model import ALSModel, implicit_feedback, has_liked_seed
+from functions.rating_matrix import load_rating_matrix
+
+
+@pytest.fixture
+def model(synthetic_graph):
+    return ALSModel.train(
+        load_rating_matrix(), factors=8, iterations=3, threads=1, seed=0
+    )
+
+
+def dense_fold_in(model, seeds):
+    # the implicit ALS user step over every movie, unrated ones at preference 0 and confidence 1
+    preference = np.zeros(len(model.movie_ids), dtype=np.float32)
+    confidence = np.ones(len(model.movie_ids), dtype=np.float32)
+    cols = [model.movie_index[movie_id] for movie_id, _ in seeds]
+    preference[cols], confidence[cols] = implicit_feedback(
+        np.asarray([rating for _, rating in seeds], dtype=np.float32), model.alpha
+    )
+    items = model.item_factors
+    lhs = (items.T * confidence) @ items + model.regularization * np.eye(items.shape[1])
+    return np.linalg.solve(lhs, items.T @ (confidence * preference))
+
+
+def test_fold_in_solves_the_user_step(model):
+    seeds = [("movie:1", 5.0), ("movie:20", 4.0), ("movie:33", 1.0)]
+    np.testing.assert_allclose(
+        model.fold_in(seeds), dense_fold_in(model, seeds), rtol=1e-3, atol=1e-5
+    )
+
+
+def test_neutral_seeds_fold_in_as_zero(model):
+    assert not has_liked_seed([("movie:1", 3.0), ("movie:2", 1.0)])
+    np.testing.assert_allclose(
+        model.fold_in([("movie:1", 3.0), ("movie:2", 1.0)]), 0, atol=1e-7
+    )
+    assert model.recommend([("movie:1", 3.0)]) == []
+
+
+def test_recommend_leaves_out_seeds_and_unknown_movies(model):
+    seeds = [("movie:1", 5.0), ("movie:2", 4.5), ("missing", 5.0)]
+    results = model.recommend(seeds, k=10)
+    assert len(results) == 10
+    assert not {"movie:1", "movie:2"} & {movie_id for movie_id, _ in results}
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert model.recommend([("missing", 5.0)]) == []
+
+
+def test_save_and_load(model, tmp_path):
+    path = str(tmp_path / "als.npz")
+    model.save(path)
+    loaded = ALSModel.load(path)
+    seeds = [("movie:5", 5.0)]
+    assert loaded.recommend(seeds, k=5) == model.recommend(seeds, k=5)
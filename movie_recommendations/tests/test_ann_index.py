@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from benchmarks.ann import synthetic_catalogue
+from functions.ann_index import IVFIndex
+from functions.embedding_store import EmbeddingStore
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    return synthetic_catalogue(600, 32, genres=5, clusters=20, seed=0)
+
+
+def exact_search(vectors, query, k, keep=None):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = unit @ (query / np.linalg.norm(query))
+    if keep is not None:
+        scores[~keep] = -np.inf
+    top = np.argsort(-scores, kind="stable")[:k]
+    return top, scores[top]
+
+
+def store_of(ids, vectors):
+    return EmbeddingStore("test", vectors, np.linalg.norm(vectors, axis=1), ids, ids)
+
+
+def test_full_probe_matches_exact_search(catalogue):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, seed=0)
+    for row in [0, 17, 311]:
+        top, scores = exact_search(vectors, vectors[row], 10)
+        results = index.search(vectors[row], k=10, nprobe=index.nlist)
+        assert [id for id, _ in results] == [ids[i] for i in top]
+        np.testing.assert_allclose([score for _, score in results], scores, atol=1e-5)
+
+
+def test_results_are_ordered_and_sized(catalogue):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, seed=0)
+    results = index.search(vectors[5], k=7, nprobe=1)
+    assert len(results) == 7
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert index.search(vectors[5], k=0) == []
+
+
+def test_filters(catalogue):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, seed=0)
+    results = index.search(
+        vectors[3],
+        k=10,
+        nprobe=index.nlist,
+        genres=["genre-1"],
+        years=(1980, 2000),
+        exclude=[ids[3]],
+    )
+    keep = np.asarray(
+        [
+            "genre-1" in row_genres and 1980 <= year <= 2000
+            for row_genres, year in zip(genres, years)
+        ]
+    )
+    keep[3] = False
+    top, _ = exact_search(vectors, vectors[3], 10, keep)
+    assert [id for id, _ in results] == [ids[i] for i in top]
+
+
+def test_search_similar_excludes_the_movie(catalogue):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, seed=0)
+    results = index.search_similar(ids[8], k=5, nprobe=index.nlist)
+    assert ids[8] not in [id for id, _ in results]
+    assert all(set(genres[ids.index(id)]) & set(genres[8]) for id, _ in results)
+    assert index.search_similar("missing", k=5) == []
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8", "pq"])
+def test_compressed_rerank_recall(catalogue, quantization):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(
+        ids, vectors, genres, years, nlist=16, seed=0, quantization=quantization
+    )
+    assert index.attach_store(store_of(ids, vectors))
+    hits = 0
+    for row in range(0, 600, 30):
+        top, _ = exact_search(vectors, vectors[row], 10)
+        results = index.search(vectors[row], k=10, nprobe=index.nlist, rerank=4)
+        hits += len({id for id, _ in results} & {ids[i] for i in top})
+    assert hits / (20 * 10) >= 0.9
+
+
+def test_store_missing_movies_is_not_attached(catalogue):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, quantization="int8")
+    assert not index.attach_store(store_of(ids[:500], vectors[:500]))
+    assert index.store is None
+    # the index still answers from its own codes
+    assert index.search(vectors[0], k=3, nprobe=index.nlist)[0][0] == ids[0]
+
+
+def test_save_and_load(catalogue, tmp_path):
+    ids, vectors, genres, years = catalogue
+    index = IVFIndex.build(ids, vectors, genres, years, nlist=16, quantization="int8")
+    path = str(tmp_path / "plot.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert loaded.search(vectors[9], k=5, nprobe=4) == index.search(
+        vectors[9], k=5, nprobe=4
+    )
@@ -0,0 +1,180 @@
+import asyncio
+import pytest
+import functions.general as general
+import functions.async_queries as async_queries
+from functions.local_graph import LocalGraph
+
+
+def catalogue_movies():
+    # repeated vote counts and movies without votes exercise both halves of the cursor
+    votes = [500, 20, None, 20, 7, 500, None, 20, 1, 0, None, 7, 300]
+    return [
+        {
+            "id": f"4:movie:{i:02d}",
+            "neo4j_id": i,
+            "properties": {"title": f"Movie {i}", "imdbVotes": count, "budget": 1},
+            "genres": [],
+        }
+        for i, count in enumerate(votes)
+    ]
+
+
+def expected_order(movies):
+    voted = sorted(
+        (movie for movie in movies if movie["properties"]["imdbVotes"] is not None),
+        key=lambda movie: (-movie["properties"]["imdbVotes"], movie["id"]),
+    )
+    unvoted = sorted(
+        (movie for movie in movies if movie["properties"]["imdbVotes"] is None),
+        key=lambda movie: movie["id"],
+    )
+    return [movie["id"] for movie in voted + unvoted]
+
+
+def walk(list_page, page_size):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = list_page(cursor, page_size)
+        pages.append([row["MovieID"] for row in rows])
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 5, 13, 50])
+def test_local_pages_cover_the_catalogue_in_order(page_size):
+    movies = catalogue_movies()
+    graph = LocalGraph([], movies)
+    pages = walk(graph.list_movies_page, page_size)
+    assert [id for page in pages for id in page] == expected_order(movies)
+    assert all(len(page) == page_size for page in pages[:-1])
+
+
+def test_local_rows_hide_the_listing_properties():
+    rows, _ = LocalGraph([], catalogue_movies()).list_movies_page(None, 1)
+    assert rows[0]["Movie"] == {"title": "Movie 0", "imdbVotes": 500}
+    assert rows[0]["MovieNeo4jID"] == 0
+
+
+def fake_run_cypher(movies):
+    # answers the two page queries of functions.general the way Neo4j would
+    def run_cypher(driver, query, parameters):
+        after_id = parameters["after_id"]
+        if query == general.LIST_MOVIES_PAGE_QUERY:
+            after_votes = parameters["after_votes"]
+            rows = [
+                movie
+                for movie in movies
+                if movie["properties"]["imdbVotes"] is not None
+                and (
+                    movie["properties"]["imdbVotes"] < after_votes
+                    or (
+                        movie["properties"]["imdbVotes"] == after_votes
+                        and movie["id"] > after_id
+                    )
+                )
+            ]
+            rows.sort(
+                key=lambda movie: (-movie["properties"]["imdbVotes"], movie["id"])
+            )
+        else:
+            assert query == general.LIST_UNVOTED_MOVIES_PAGE_QUERY
+            rows = sorted(
+                (
+                    movie
+                    for movie in movies
+                    if movie["properties"]["imdbVotes"] is None
+                    and movie["id"] > after_id
+                ),
+                key=lambda movie: movie["id"],
+            )
+        return [
+            {
+                "Movie": movie["properties"],
+                "MovieID": movie["id"],
+                "MovieNeo4jID": movie["neo4j_id"],
+                "votes": movie["properties"]["imdbVotes"],
+            }
+            for movie in rows[: parameters["page_size"]]
+        ]
+
+    return run_cypher
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 4, 10, 13, 50])
+def test_neo4j_cursors_match_the_local_pages(monkeypatch, page_size):
+    movies = catalogue_movies()
+    monkeypatch.setattr(general, "RECSYS_BACKEND", "neo4j")
+    monkeypatch.setattr(general, "get_driver", lambda: None)
+    monkeypatch.setattr(general, "run_cypher", fake_run_cypher(movies))
+    pages = walk(general.list_movies_page, page_size)
+    assert pages == walk(LocalGraph([], movies).list_movies_page, page_size)
+
+
+def test_iter_all_movies_walks_every_page(monkeypatch):
+    movies = catalogue_movies()
+    monkeypatch.setattr(general, "get_local_graph", lambda: LocalGraph([], movies))
+    ids = [row["MovieID"] for row in general.iter_all_movies(page_size=4)]
+    assert ids == expected_order(movies)
+
+
+def neo4j_order_by(movies, query):
+    """
+    movies sorted by the ORDER BY clause of query with Neo4j's null handling:
+    null is the largest value, last on ascending order and first on DESC
+    """
+    clause = query.split("ORDER BY", 1)[1].split("\n", 1)[0]
+    values = {
+        "m.imdbVotes IS NULL": lambda movie: movie["properties"]["imdbVotes"] is None,
+        "m.imdbVotes": lambda movie: movie["properties"]["imdbVotes"],
+        "id": lambda movie: movie["id"],
+        "elementId(m)": lambda movie: movie["id"],
+    }
+    rows = list(movies)
+    # one stable sort per key, the last key first
+    for key in reversed([key.strip() for key in clause.split(",")]):
+        descending = key.endswith(" DESC")
+        value = values[key.removesuffix(" DESC")]
+        rows.sort(
+            key=lambda movie: (value(movie) is None, value(movie) or 0),
+            reverse=descending,
+        )
+    return rows
+
+
+def fake_top_titles(movies):
+    def run_cypher(*args):
+        query, parameters = args[-2], args[-1]
+        assert query == general.TOP_MOVIE_TITLES_QUERY
+        return [
+            {
+                "MovieID": movie["id"],
+                "Movie.title": movie["properties"]["title"],
+                "Movie.imdbVotes": movie["properties"]["imdbVotes"],
+            }
+            for movie in neo4j_order_by(movies, query)[: parameters["limit"]]
+        ]
+
+    return run_cypher
+
+
+@pytest.mark.parametrize("limit", [3, 9, 13])
+def test_empty_title_search_lists_the_most_voted_movies_on_both_backends(
+    monkeypatch, limit
+):
+    movies = catalogue_movies()
+    monkeypatch.setattr(general, "get_local_graph", lambda: LocalGraph([], movies))
+    local = general.search_movie_titles("", limit)["MovieID"].tolist()
+    assert local == expected_order(movies)[:limit]
+
+    fake = fake_top_titles(movies)
+    monkeypatch.setattr(general, "RECSYS_BACKEND", "neo4j")
+    monkeypatch.setattr(general, "cached_run_cypher", fake)
+    assert general.search_movie_titles(" ", limit)["MovieID"].tolist() == local
+
+    async def fake_async(query, parameters):
+        return fake(query, parameters)
+
+    monkeypatch.setattr(async_queries, "RECSYS_BACKEND", "neo4j")
+    monkeypatch.setattr(async_queries, "cached_run_cypher_async", fake_async)
+    results = asyncio.run(async_queries.search_movie_titles_async("", limit))
+    assert results["MovieID"].tolist() == local
@@ -0,0 +1,144 @@
+import json
+import os
+import numpy as np
+import pytest
+import functions.neighbour_tables as neighbour_tables
+from functions.neighbour_tables import (
+    top_k_rows,
+    build_neighbour_table,
+    refresh_neighbour_table,
+    NeighbourTable,
+)
+from functions.embedding_store import store_paths
+from functions.rating_matrix import RatingMatrix
+
+K = 10
+
+
+def test_top_k_rows_matches_a_full_sort():
+    scores = np.random.default_rng(0).standard_normal((20, 50)).astype(np.float32)
+    targets, top_scores = top_k_rows(scores, 5)
+    expected = np.argsort(-scores, axis=1)[:, :5]
+    np.testing.assert_array_equal(targets, expected)
+    np.testing.assert_array_equal(
+        top_scores, np.take_along_axis(scores, expected, axis=1)
+    )
+
+
+def test_top_k_rows_pads_missing_scores():
+    scores = np.full((2, 6), -np.inf, dtype=np.float32)
+    scores[0, [1, 4]] = [0.2, 0.9]
+    targets, top_scores = top_k_rows(scores, 3)
+    assert targets[0].tolist() == [4, 1, -1]
+    assert targets[1].tolist() == [-1, -1, -1]
+    assert top_scores[0, 2] == -np.inf
+
+
+def test_top_k_rows_caps_k_at_the_columns():
+    targets, _ = top_k_rows(np.arange(6, dtype=np.float32).reshape(2, 3), 10)
+    assert targets.tolist() == [[2, 1, 0], [2, 1, 0]]
+
+
+@pytest.fixture
+def signal_directory(synthetic_graph, monkeypatch):
+    # load_signal binds the store directory at import, point it at the synthetic export
+    load_signal = neighbour_tables.load_signal
+    directory = str(synthetic_graph)
+    monkeypatch.setattr(
+        neighbour_tables,
+        "load_signal",
+        lambda method: load_signal(method, directory),
+    )
+    return directory
+
+
+def _replace(path, save):
+    # the old file may still be memory-mapped, write a new one and swap it in
+    tmp = path + ".tmp.npy"
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def change_store(directory, name, rows, seed=1):
+    paths = store_paths(name, directory)
+    vectors = np.load(paths["vectors"])
+    vectors[rows] = np.random.default_rng(seed).standard_normal(
+        (len(rows), vectors.shape[1])
+    )
+    _replace(paths["vectors"], lambda path: np.save(path, vectors))
+    _replace(
+        paths["norms"], lambda path: np.save(path, np.linalg.norm(vectors, axis=1))
+    )
+    if name == "plot":
+        with open(paths["ids"]) as f:
+            id_map = json.load(f)
+        id_map["genres"][rows[0]] = ["genre-0"]
+        with open(paths["ids"], "w") as f:
+            json.dump(id_map, f)
+
+
+def change_ratings(directory, users, movie):
+    path = os.path.join(directory, "ratings.npz")
+    ratings = RatingMatrix.load(path)
+    matrix = ratings.matrix.tolil()
+    for user in users:
+        matrix[user, movie] = 5.0
+    # one liker fewer for the first rated movie of the last user
+    matrix[users[-1], ratings.matrix[users[-1]].indices[0]] = 0
+    RatingMatrix(
+        ratings.user_ids,
+        ratings.movie_ids,
+        matrix.tocsr(),
+        ratings.imdb_votes,
+        ratings.watermark,
+    ).save(path)
+
+
+def assert_same_table(refreshed, rebuilt):
+    assert refreshed.movie_ids == rebuilt.movie_ids
+    assert refreshed.fingerprints == rebuilt.fingerprints
+    np.testing.assert_array_equal(refreshed.scores, rebuilt.scores)
+    # tied scores come back in any order, the targets above each row's k-th score must match
+    for row, kth in enumerate(rebuilt.scores[:, -1]):
+        above = rebuilt.scores[row] > kth
+        assert set(refreshed.targets[row, above]) == set(rebuilt.targets[row, above])
+
+
+@pytest.mark.parametrize("method", ["plot", "poster", "co_rating"])
+def test_refresh_without_changes_recomputes_nothing(signal_directory, method):
+    table = build_neighbour_table(method, k=K, workers=1)
+    refreshed, changed = refresh_neighbour_table(table, k=K, workers=1)
+    assert changed == []
+    assert_same_table(refreshed, table)
+
+
+@pytest.mark.parametrize("method", ["plot", "poster"])
+def test_embedding_refresh_matches_a_full_build(signal_directory, method):
+    table = build_neighbour_table(method, k=K, workers=1)
+    change_store(signal_directory, method, [3, 40, 41])
+    refreshed, changed = refresh_neighbour_table(table, k=K, workers=1)
+    assert changed is not None and "movie:3" in changed
+    assert_same_table(refreshed, build_neighbour_table(method, k=K, workers=1))
+
+
+def test_co_rating_refresh_matches_a_full_build(signal_directory):
+    table = build_neighbour_table("co_rating", k=K, workers=1)
+    change_ratings(signal_directory, users=[1, 2, 3, 4], movie=7)
+    refreshed, changed = refresh_neighbour_table(table, k=K, workers=1)
+    assert changed is not None and "movie:7" in changed
+    assert_same_table(refreshed, build_neighbour_table("co_rating", k=K, workers=1))
+
+
+def test_refresh_with_another_k_rebuilds(signal_directory):
+    table = build_neighbour_table("poster", k=K, workers=1)
+    refreshed, changed = refresh_neighbour_table(table, k=K + 1, workers=1)
+    assert changed is None and refreshed.k == K + 1
+
+
+def test_table_save_and_load(signal_directory, tmp_path):
+    table = build_neighbour_table("poster", k=K, workers=1)
+    table.save(str(tmp_path / "tables"))
+    loaded = NeighbourTable.load("poster", str(tmp_path / "tables"))
+    assert_same_table(loaded, table)
+    assert loaded.neighbours("movie:0", 3) == table.neighbours("movie:0", 3)
+    assert loaded.neighbours("missing") == []
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from functions.quantization import CODECS, make_codec, codec_from_state
+
+
+def unit_vectors(count=500, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_scores_match_decoded_rows(name):
+    vectors = unit_vectors()
+    codec = make_codec(name).fit(vectors)
+    codes = codec.encode(vectors)
+    query = vectors[0]
+    # the asymmetric scores are the dot products with the decoded rows, without decoding them
+    np.testing.assert_allclose(
+        codec.scores(query, codes), codec.decode(codes) @ query, atol=1e-4
+    )
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_state_round_trip(name):
+    vectors = unit_vectors()
+    codec = make_codec(name).fit(vectors)
+    codes = codec.encode(vectors)
+    restored = codec_from_state(name, codec.state())
+    np.testing.assert_array_equal(restored.encode(vectors), codes)
+    np.testing.assert_allclose(
+        restored.scores(vectors[1], codes), codec.scores(vectors[1], codes)
+    )
+
+
+def test_float_codecs_are_near_lossless():
+    vectors = unit_vectors()
+    for name, atol in [("float32", 0), ("float16", 1e-3)]:
+        codec = make_codec(name).fit(vectors)
+        np.testing.assert_allclose(
+            codec.decode(codec.encode(vectors)), vectors, atol=atol
+        )
+
+
+def test_int8_error_is_within_half_a_step():
+    vectors = unit_vectors()
+    codec = make_codec("int8").fit(vectors)
+    codes = codec.encode(vectors)
+    assert codes.dtype == np.uint8
+    error = np.abs(codec.decode(codes) - vectors)
+    assert (error <= codec.step / 2 + 1e-6).all()
+
+
+def test_int8_clips_values_outside_the_fitted_range():
+    vectors = unit_vectors()
+    codec = make_codec("int8").fit(vectors)
+    codes = codec.encode(np.stack([vectors.max(axis=0) + 1, vectors.min(axis=0) - 1]))
+    assert (codes[0] == 255).all() and (codes[1] == 0).all()
+
+
+def test_pq_codes_one_byte_per_subspace():
+    vectors = unit_vectors()
+    codec = make_codec("pq", pq_subspaces=8).fit(vectors)
+    codes = codec.encode(vectors)
+    assert codes.shape == (len(vectors), 8) and codes.dtype == np.uint8
+    # 256 centroids per 4 dimensions reconstruct the vectors far better than the zero vector
+    error = np.linalg.norm(codec.decode(codes) - vectors, axis=1)
+    assert error.mean() < 0.5
+
+
+def test_pq_rejects_dimensions_that_do_not_split():
+    with pytest.raises(ValueError):
+        make_codec("pq", pq_subspaces=5).fit(unit_vectors(dim=32))
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        make_codec("int4")
@@ -1,43 +1,22 @@
 import streamlit as st
 from functions.general import (
-    list_all_movies,
     list_all_genres,
-    search_movies_based_genres,
-    display_movie_metadata,
+    display_movie_metadata_bulk,
 )
+from functions.async_queries import search_movies_based_genres_display_async
 from functions.collaborative_filtering_methods import (
-    movie_user_recommendations_singular,
+    movie_user_recommendations_multi_display,
+    MULTI_SEED_ENGINE,
 )
-from functions.helper_functions.streamlit_setup import page_config
+from functions.rating_neighbours import RATING_TOLERANCE
+from functions.als_model import has_liked_seed, LIKED_RATING
+from functions.helper_functions.streamlit_setup import page_config, movie_picker
+from functions.helper_functions.logging_config import get_logger
 import pandas as pd
-import os
-from dotenv import load_dotenv
-import logging
-
 
 page_config()
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-
-# add the console handler to the logger
-logger.addHandler(ch)
-
-log_file_path = os.getenv("FRONT_END_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
-
-logger.addHandler(fh)
+logger = get_logger(__name__, "FRONT_END_LOG_FILE_PATH")
 
 # Title
 st.title("Bipartite Graph (Movie and Users) Based Movie Recommendations")
@@ -66,108 +45,41 @@ if selected_genres:
         selected_genres.append("(no genres listed)")
 
     selected_genres = list(set(selected_genres))
-    movies_genre_based = search_movies_based_genres(selected_genres)
-    # each item in list movies_genre_based containts a json with keys "Movie". "MovieID", "Genre", and "GenreID"
-    # For the Movie key, it is another json and I want to display all the properties of the movie in its own columns
-    # And lastly display the Genre
-    movies_genre_based = pd.json_normalize(movies_genre_based)
-    movies_genre_based = movies_genre_based.drop(columns=["GenreID", "MovieID"])
-    movies_genre_based = movies_genre_based.drop(
-        columns=[
-            "Movie.year",
-            "Movie.imdbId",
-        ]
-    )
-    # movies might appear in multiple genres, so we will drop duplicates based on the title after we will append all genres the movie is in and display it in the Genre column
-    # group by title and aggregate the genres
-    # Also we need to keep the Movie Title
-    movies_genre_based = movies_genre_based.groupby("Movie.title").agg(
-        {
-            "Genre": lambda x: ", ".join(x),
-            "Movie.released": "first",
-            "Movie.imdbRating": "first",
-            "Movie.imdbVotes": "first",
-            "Movie.plot": "first",
-            "Movie.runtime": "first",
-            "Movie.languages": "first",
-            "Movie.poster": "first",
-            "Movie.url": "first",
-        }
-    )
-    movies_genre_based = movies_genre_based.reset_index()
-
-    # orderby Movie.imdbVotes
-    movies_genre_based = movies_genre_based.sort_values(
-        by=["Movie.imdbVotes"], ascending=False
-    )
-
-    # reorder columns to: ['Genre', 'Movie.title', 'Movie.released', 'Movie.imdbRating', 'Movie.imdbVotes', 'Movie.plot',
-    # 'Movie.runtime', 'Movie.languages', 'Movie.poster','Movie.url']
-    movies_genre_based = movies_genre_based[
-        [
-            "Genre",
-            "Movie.title",
-            "Movie.released",
-            "Movie.imdbRating",
-            "Movie.imdbVotes",
-            "Movie.plot",
-            "Movie.runtime",
-            "Movie.languages",
-            "Movie.poster",
-            "Movie.url",
-        ]
-    ]
+    # one row per movie with its genres joined and ordered by IMDb votes in the query,
+    # only the display columns come back
     st.write(
         f"Movies based on selected genres {selected_genres}, ordered by IMDb Votes"
     )
-    st.dataframe(movies_genre_based, use_container_width=True, hide_index=True)
+    # filled once the picker's title search and the genre search, run concurrently, are back
+    genre_table = st.empty()
 
     st.header("Select Movies to get Recommendations")
-    all_movies = list_all_movies()
-    # sort all_movies by imdbVotes
-    all_movies = pd.json_normalize(all_movies)
-    all_movies = all_movies.drop(
-        columns=[
-            "Movie.year",
-            "Movie.imdbId",
-        ]
-    )
-    all_movies = all_movies.sort_values(by=["Movie.imdbVotes"], ascending=False)
-
-    selected_movies = st.multiselect(
-        "Select 1 Movie and rate it to get Recommendations",
-        all_movies["Movie.title"].tolist(),
-        max_selections=1,
+    # movie_id -> title of the picked movies, found through the title search
+    selected_movies, (movies_genre_based,) = movie_picker(
+        "Select up to 10 Movies and rate them to get Recommendations",
+        "bipartite-movies",
+        search_movies_based_genres_display_async(selected_genres),
     )
+    genre_table.dataframe(movies_genre_based, use_container_width=True, hide_index=True)
 
     if selected_movies:
         st.success("You have selected the following movies:")
+        # the metadata of every selected movie in one round trip, genres already joined
+        selected_metadata = display_movie_metadata_bulk(list(selected_movies))
+        metadata_position = {
+            movie_id: position
+            for position, movie_id in enumerate(selected_metadata["MovieID"])
+        }
         count = 1
-        for movie in selected_movies:
-            # look up the movie_id based off the title
-            movie_id = all_movies[all_movies["Movie.title"] == movie]["MovieID"].values[
-                0
-            ]
-            # Using that movie_id, display the movie's metadata + genre
-            movie_metadata = display_movie_metadata(movie_id)
-            display_data = pd.json_normalize(movie_metadata)
-            display_data = display_data.drop(columns=["GenreID", "MovieID"])
-            # group by title and aggregate the genres
-            # Also we need to keep the Movie Title
-            display_data = display_data.groupby("Movie.title").agg(
-                {
-                    "Genre": lambda x: ", ".join(x),
-                    "Movie.released": "first",
-                    "Movie.imdbRating": "first",
-                    "Movie.imdbVotes": "first",
-                    "Movie.plot": "first",
-                    "Movie.runtime": "first",
-                    "Movie.languages": "first",
-                    "Movie.poster": "first",
-                    "Movie.url": "first",
-                }
+        for movie_id, movie in selected_movies.items():
+            # the selected movie's row of the bulk lookup, without the id column
+            if movie_id not in metadata_position:
+                # the movie is gone from the graph since it was picked
+                logger.warning(f"No metadata for selected movie {movie_id}")
+                continue
+            display_data = selected_metadata.iloc[[metadata_position[movie_id]]].drop(
+                columns=["MovieID"]
             )
-            display_data = display_data.reset_index()
 
             st.write(f"{count}. {movie}")
             st.markdown(
@@ -177,60 +89,89 @@ if selected_genres:
             st.dataframe(display_data, use_container_width=True, hide_index=True)
             count += 1
 
-            form = st.form(key="form")
-            rating = form.slider(
-                "Rate the movie",
+        form = st.form(key="form")
+        # one rating per selected movie, all of them are matched at once
+        ratings = {
+            movie_id: form.slider(
+                f"Rate {movie}",
                 min_value=0.5,
                 max_value=5.0,
                 value=3.0,
                 step=0.5,
+                key=f"rating-{movie_id}",
             )
-            submit_button = form.form_submit_button("Get Recommendations")
-
-            if submit_button:
-                # get recommendations based on the movie_id and rating
-                recommendations = movie_user_recommendations_singular(movie_id, rating)
-                recommendations = pd.json_normalize(recommendations)
-                # recommendations = recommendations.drop(
-                #     columns=[
-                #         "user_id",
-                #     ]
-                # )
-                # drop all columns containing the word user
-                recommendations = recommendations[
-                    recommendations.columns.drop(
-                        list(recommendations.filter(regex="user"))
-                    )
-                ]
-                recommendations = recommendations.sort_values(
-                    by=["recommendation.imdbVotes"], ascending=False
-                )
-                recommendations = recommendations.drop(
-                    columns=["recommendation.imdbId"]
-                )
-                recommendations = recommendations.rename(
-                    columns={
-                        "rec_id": "MovieID",
-                        "recommendation.title": "Movie Title",
-                        "recommendation.released": "Released",
-                        "recommendation.imdbRating": "IMDb Rating",
-                        "recommendation.imdbVotes": "IMDb Votes",
-                        "recommendation.plot": "Plot",
-                        "recommendation.runtime": "Runtime",
-                        "recommendation.languages": "Languages",
-                        "recommendation.poster": "Poster",
-                        "recommendation.url": "URL",
-                    }
+            for movie_id, movie in selected_movies.items()
+        }
+        engines = {
+            "Similar users": "neighbours",
+            "Matrix factorization (ALS)": "als",
+        }
+        engine_names = list(engines.values())
+        engine = form.radio(
+            "Recommend with",
+            list(engines),
+            # an unknown MULTI_SEED_ENGINE falls back to the first engine
+            index=(
+                engine_names.index(MULTI_SEED_ENGINE)
+                if MULTI_SEED_ENGINE in engine_names
+                else 0
+            ),
+            horizontal=True,
+        )
+        tolerance = form.slider(
+            "Match users whose ratings are within this many stars of yours (similar users only)",
+            min_value=0.0,
+            max_value=2.0,
+            value=RATING_TOLERANCE,
+            step=0.5,
+        )
+        submit_button = form.form_submit_button("Get Recommendations")
+
+        if submit_button:
+            # get recommendations based on every rated movie
+            # only the display properties come back, best weighted score first
+            seeds = list(ratings.items())
+            if engines[engine] == "als" and not has_liked_seed(seeds):
+                # neutral and low ratings give the model nothing to rank by
+                st.warning(
+                    f"Rate at least one movie {LIKED_RATING} or above to use matrix factorization, "
+                    "showing similar users instead"
                 )
-                st.write(
-                    f"Other movies that users who have rated {movie} at {rating} have rated highly"
+            recommendations = movie_user_recommendations_multi_display(
+                seeds, tolerance=tolerance, engine=engines[engine]
+            )
+            if not recommendations.empty and recommendations["user_count"].isna().all():
+                # the ALS model scores movies directly, no user is matched
+                recommendations = recommendations.drop(columns=["user_count"])
+            recommendations = recommendations.rename(
+                columns={
+                    "Movie.title": "Movie Title",
+                    "Movie.released": "Released",
+                    "Movie.imdbRating": "IMDb Rating",
+                    "Movie.imdbVotes": "IMDb Votes",
+                    "Movie.plot": "Plot",
+                    "Movie.runtime": "Runtime",
+                    "Movie.languages": "Languages",
+                    "Movie.poster": "Poster",
+                    "Movie.url": "URL",
+                    "score": "Score",
+                    "user_count": "Similar Users",
+                }
+            )
+            rated = ", ".join(
+                f"{selected_movies[movie_id]} at {rating}"
+                for movie_id, rating in ratings.items()
+            )
+            if recommendations.empty:
+                st.write(f"No other users have rated {rated} closely enough yet")
+            else:
+                st.write(f"Movies that users who have rated {rated} have rated highly")
+            # display the movie title, poster, plot
+            # then display the node's properties
+            for index, row in recommendations.iterrows():
+                st.markdown(
+                    f"![{row['Movie Title']}]({row['Poster']})",
+                    unsafe_allow_html=True,
                 )
-                # display the movie title, poster, plot
-                # then display the node's properties
-                for index, row in recommendations.iterrows():
-                    st.markdown(
-                        f"![{row['Movie Title']}]({row['Poster']})",
-                        unsafe_allow_html=True,
-                    )
-                    st.write(f"Plot: {row['Plot']}")
-                    st.write(row)
+                st.write(f"Plot: {row['Plot']}")
+                st.write(row)
@@ -0,0 +1,62 @@
+import streamlit as st
+from functions.helper_functions.query_metrics import (
+    QUERY_METRICS,
+    QUERY_PROFILE_THRESHOLD_MS,
+)
+from functions.helper_functions.query_cache import query_cache_stats
+from functions.helper_functions.streamlit_setup import page_config
+from functions.helper_functions.logging_config import get_logger
+import pandas as pd
+
+
+page_config()
+
+logger = get_logger(__name__, "FRONT_END_LOG_FILE_PATH")
+
+# Title
+st.title("Query Diagnostics")
+
+# Subheader
+st.subheader("Latency of every Cypher query this server has run, slowest in total first")
+
+summary = pd.DataFrame(QUERY_METRICS.summary())
+if summary.empty:
+    st.info("No queries have run yet, open one of the recommendation pages first")
+else:
+    st.dataframe(
+        summary,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            column: st.column_config.NumberColumn(format="%.1f")
+            for column in summary.columns
+            if column.endswith("_ms")
+        },
+    )
+
+st.header("Query cache")
+st.dataframe(pd.DataFrame([query_cache_stats()]), hide_index=True)
+
+st.header("Slow queries")
+if not QUERY_PROFILE_THRESHOLD_MS:
+    st.write(
+        "Profiling is off, set QUERY_PROFILE_THRESHOLD_MS to capture the PROFILE plan of slow read queries"
+    )
+elif not QUERY_METRICS.slow_queries:
+    st.write(f"No read query has taken longer than {QUERY_PROFILE_THRESHOLD_MS:.0f} ms")
+for profile in list(QUERY_METRICS.slow_queries):
+    with st.expander(
+        f"{profile['query']}: {profile['wall_ms']:.1f} ms, {profile['db_hits']} db hits"
+    ):
+        st.code(profile["cypher"], language="cypher")
+        st.code(profile["plan"], language="text")
+
+st.header("Prometheus")
+metrics = QUERY_METRICS.prometheus_text()
+st.download_button("Download metrics", metrics, file_name="metrics.txt")
+with st.expander("Metrics in the Prometheus text format"):
+    st.code(metrics, language="text")
+
+if st.button("Reset metrics"):
+    QUERY_METRICS.reset()
+    st.rerun()
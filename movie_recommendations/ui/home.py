@@ -1,37 +1,42 @@
 import streamlit as st
 from functions.helper_functions.streamlit_setup import page_config
-from functions.initialize import start
-import os
-import logging
+from functions.initialize import start, get_status, RUNNING, FAILED
+from functions.helper_functions.logging_config import get_logger
 
 try:
     page_config()
 except Exception as e:
     print("********")
 
-# create logger for the module
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger = get_logger(__name__, "FRONT_END_LOG_FILE_PATH")
 
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+# runs on a background thread once per process, the page renders straight away
+start()
 
-# create formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
 
-# add the console handler to the logger
-logger.addHandler(ch)
+def render_status(status):
+    # renders nothing once the initialization has finished
+    if status["state"] == RUNNING:
+        st.info(f"Preparing the graph: {status['step'] or 'starting'}...")
+    elif status["state"] == FAILED:
+        st.error(f"Preparing the graph failed: {status['error']}")
 
-log_file_path = os.getenv("FRONT_END_LOG_FILE_PATH", "app.log")
-fh = logging.FileHandler(log_file_path)
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
 
-logger.addHandler(fh)
+@st.fragment(run_every=2)
+def initialization_status():
+    # polls the background initialization while it runs,
+    # a full rerun once it has finished renders the status statically and stops the polling
+    status = get_status()
+    if status["state"] != RUNNING:
+        st.rerun()
+    render_status(status)
 
-start()
+
+status = get_status()
+if status["state"] == RUNNING:
+    initialization_status()
+else:
+    render_status(status)
 
 # Title
 st.title("Movie Recommendations")
@@ -0,0 +1,70 @@
+import streamlit as st
+from functions.hybrid_ranker import DEFAULT_WEIGHTS, hybrid_recommendations
+from functions.helper_functions.streamlit_setup import page_config, movie_picker
+from functions.helper_functions.logging_config import get_logger
+import pandas as pd
+
+page_config()
+
+logger = get_logger(__name__, "FRONT_END_LOG_FILE_PATH")
+
+# Title
+st.title("Hybrid Movie Recommendations (Plot, Poster and Bipartite Graph)")
+
+# Subheader
+st.subheader("Rate a few movies to get one blended list of recommendations")
+
+# movie_id -> title of the picked movies, found through the title search
+selected_movies, _ = movie_picker(
+    "Select up to 10 Movies and rate them", "hybrid-movies"
+)
+
+if not selected_movies:
+    st.warning("Please select at least one movie")
+    st.stop()
+
+# seeds are {movie_id: rating}
+seeds = {}
+for movie_id, movie in selected_movies.items():
+    seeds[movie_id] = st.slider(
+        f"Rate {movie}",
+        min_value=0.5,
+        max_value=5.0,
+        value=5.0,
+        step=0.5,
+        key=f"rating_{movie_id}",
+    )
+
+with st.expander("Ranking settings"):
+    fusion = st.radio(
+        "Fusion method",
+        ["weighted", "rrf"],
+        format_func=lambda x: (
+            "Weighted normalized scores"
+            if x == "weighted"
+            else "Reciprocal rank fusion"
+        ),
+    )
+    weights = {
+        source: st.slider(
+            f"{source} weight", min_value=0.0, max_value=1.0, value=weight, step=0.05
+        )
+        for source, weight in DEFAULT_WEIGHTS.items()
+    }
+    k = st.slider("Number of recommendations", min_value=5, max_value=30, value=10)
+
+if st.button("Generate Recommendations"):
+    recommendations = hybrid_recommendations(seeds, k=k, weights=weights, fusion=fusion)
+    if not recommendations:
+        st.warning("No recommendations found for the selected movies")
+        st.stop()
+
+    st.success("Recommendations based on selected movies")
+    for count, recommendation in enumerate(recommendations, start=1):
+        movie = recommendation["movie"]
+        st.write(f"{count}. {movie.get('title')}")
+        st.markdown(f"![{movie.get('title')}]({movie.get('poster')})")
+        st.write(f"Plot: {movie.get('plot')}")
+        # show the fused score and the raw score from every source that proposed the movie
+        scores = {"score": recommendation["score"], **recommendation["signals"]}
+        st.dataframe(pd.DataFrame([scores]), use_container_width=True, hide_index=True)